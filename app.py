@@ -1,17 +1,32 @@
 # -*- coding: utf-8 -*-
 import streamlit as st
+import io
 import os
-import base64
+import tempfile
 from datetime import datetime
 import time
 
 # インポート
 from database import authenticate_user, create_user, get_user_by_id, update_user_profile
-from database import get_all_users, delete_user, promote_to_admin, demote_from_admin
-from database import create_admin_user, check_user_has_password, reset_user_password
+from database import add_friend, remove_friend, is_friend, get_friends_page, get_friend_count
+from database import get_friend_suggestions, get_mutual_friend_count, get_friend_graph_stats
+from database import get_similar_interest_users, get_interest_matrix_stats
+from database import search_users_by_interests, get_interest_counts, get_interest_index_stats
+from database import search_users_by_keyword, get_text_index_stats, USER_LIST_FIELDS
+from database import list_users_page, USER_LIST_ORDER_FIELDS, delete_user, promote_to_admin, demote_from_admin
+from database import create_admin_user, backfill_has_password_flags, reset_user_password, get_user_cache_stats
+from database import get_user_mirror_stats
+from database import run_bulk_admin_action, iter_all_users, count_users
 from auth_utils import create_user_session, clear_user_session, get_current_user_id, is_authenticated, is_admin
-from qr_utils import generate_user_qr_code, display_qr_code
-from config import APP_CONFIG
+from qr_utils import generate_user_qr_code, display_qr_code, qr_code_cache
+from qr_badges import generate_all_badge_sheets
+from attendee_import import CSV_ENCODINGS, import_attendees
+from user_export import EXPORT_FIELDS, EXPORT_FORMATS, export_users
+from blob_store import is_blob_ref, load_blob
+from image_utils import select_photo, store_profile_photo
+from config import APP_CONFIG, INTEREST_OPTIONS, METRICS_CONFIG, QR_RENDERER, TEXT_SEARCH_CONFIG
+from metrics import registry as metrics_registry, set_page, start_metrics_server, track_rerun
+from storage import get_user_repository
 
 # ページ設定
 st.set_page_config(
@@ -24,7 +39,13 @@ def display_profile_image(image_data, caption="プロフィール写真", width=
     """プロフィール写真を安全に表示する"""
     if image_data:
         try:
-            if isinstance(image_data, str) and image_data.startswith('data:image'):
+            if is_blob_ref(image_data):
+                photo_bytes = load_blob(image_data)
+                if photo_bytes:
+                    st.image(photo_bytes, caption=caption, width=width)
+                else:
+                    st.warning("プロフィール写真が見つかりません")
+            elif isinstance(image_data, str) and image_data.startswith('data:image'):
                 st.image(image_data, caption=caption, width=width, use_container_width=True)
             elif isinstance(image_data, str) and image_data.startswith('http'):
                 st.image(image_data, caption=caption, width=width, use_container_width=True)
@@ -35,10 +56,24 @@ def display_profile_image(image_data, caption="プロフィール写真", width=
     else:
         st.info("プロフィール写真が設定されていません")
 
+def store_uploaded_photo(uploaded_file):
+    """アップロードされた写真を変換してBlobストアに保存し、ユーザードキュメント用のフィールドを返す"""
+    return store_profile_photo(uploaded_file.getvalue())
+
 def main():
     """メイン関数"""
     st.title(APP_CONFIG["app_name"])
     
+    # データベース接続を確立（プロセスごとに一度だけ実行される）
+    try:
+        get_user_repository()
+    except Exception as e:
+        st.error(f"データベース接続エラー: {e}")
+        return
+    
+    if METRICS_CONFIG["enabled"] and METRICS_CONFIG["port"]:
+        start_metrics_server(METRICS_CONFIG["port"])
+    
     # URLパラメータの確認
     user_id_param = st.query_params.get("user_id", None)
     
@@ -66,12 +101,12 @@ def show_authenticated_navigation():
         st.sidebar.success("👑 管理者モード")
         page = st.sidebar.selectbox(
             "ページを選択",
-            ["マイページ", "管理者パネル", "ログアウト"]
+            ["マイページ", "参加者検索", "管理者パネル", "ログアウト"]
         )
     else:
         page = st.sidebar.selectbox(
             "ページを選択",
-            ["マイページ", "プロフィール編集", "ログアウト"]
+            ["マイページ", "参加者検索", "プロフィール編集", "ログアウト"]
         )
     
     if page == "ログアウト":
@@ -80,6 +115,8 @@ def show_authenticated_navigation():
             st.rerun()
     elif page == "管理者パネル" and is_admin():
         show_admin_panel()
+    elif page == "参加者検索":
+        show_user_search()
     elif page == "プロフィール編集":
         show_profile_edit()
     else:
@@ -95,6 +132,7 @@ def show_unauthenticated_navigation():
 
 def show_login_register():
     """ログイン・新規登録画面"""
+    set_page('login')
     tab1, tab2 = st.tabs(["ログイン", "新規登録"])
     
     with tab1:
@@ -172,7 +210,7 @@ def show_register_form():
         profile = st.text_area("プロフィール")
         interests = st.multiselect(
             "興味のあるジャンル",
-            ["技術", "音楽", "スポーツ", "料理", "旅行", "アート", "ゲーム", "その他"]
+            INTEREST_OPTIONS
         )
         
         # 写真アップロード
@@ -191,16 +229,14 @@ def show_register_form():
                     return
                 
                 # 写真の処理
-                photo_data = None
+                photo_fields = {}
                 if uploaded_file is not None:
                     try:
                         if uploaded_file.size > 5 * 1024 * 1024:
                             st.error("ファイルサイズは5MB以下にしてください。")
                             return
                         
-                        photo_bytes = uploaded_file.read()
-                        photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
-                        photo_data = f"data:image/{uploaded_file.type};base64,{photo_base64}"
+                        photo_fields = store_uploaded_photo(uploaded_file)
                         st.success("写真がアップロードされました")
                     except Exception as e:
                         st.error(f"❌ 写真のアップロードに失敗しました: {e}")
@@ -213,7 +249,7 @@ def show_register_form():
                     'display_name': display_name,
                     'profile': profile,
                     'interests': interests,
-                    'photo': photo_data
+                    **photo_fields
                 }
                 
                 # ユーザーを作成
@@ -234,6 +270,7 @@ def show_main_content():
 
 def show_mypage():
     """マイページ"""
+    set_page('mypage')
     st.header("マイページ")
     
     user_id = get_current_user_id()
@@ -246,7 +283,7 @@ def show_mypage():
         with col1:
             st.subheader("プロフィール写真")
             if user.get('photo'):
-                display_profile_image(user['photo'], "プロフィール写真", 200)
+                display_profile_image(select_photo(user, 200), "プロフィール写真", 200)
             else:
                 st.info("プロフィール写真が設定されていません")
         
@@ -263,40 +300,164 @@ def show_mypage():
         
         # QRコード
         st.subheader("QRコード")
-        qr_code = generate_user_qr_code(user_id)
+        qr_code = generate_user_qr_code(user_id, APP_CONFIG["base_url"])
         if qr_code:
-            display_qr_code(qr_code, f"{user.get('display_name', 'ユーザー')}のQRコード")
+            # SVGを選んだ場合は、印刷用にSVGのダウンロードも提供する
+            svg_code = generate_user_qr_code(user_id, APP_CONFIG["base_url"], image_format='svg') if QR_RENDERER == 'svg' else None
+            display_qr_code(qr_code, f"{user.get('display_name', 'ユーザー')}のQRコード", svg_code)
             st.info(f"このQRコードを読み取ると、あなたの公開ページにアクセスできます")
         else:
             st.error("QRコードの生成に失敗しました")
         
         # 友達リスト
-        st.subheader("友達リスト")
-        friends = user.get('friends', [])
-        if friends:
-            for friend_id in friends:
-                friend = get_user_by_id(friend_id)
-                if friend:
-                    col_friend1, col_friend2 = st.columns([3, 1])
-                    with col_friend1:
-                        st.write(f"• **{friend.get('display_name', 'Unknown')}** ({friend.get('email', 'No email')})")
-                        if st.button(f"👤 公開ページを見る", key=f"view_friend_{friend_id}"):
-                            st.query_params["user_id"] = friend_id
+        friend_count = get_friend_count(user)
+        st.subheader(f"友達リスト（{friend_count}人）")
+        if friend_count:
+            # ページごとの開始カーソルを積み上げて、前のページに戻れるようにする
+            cursors = st.session_state.setdefault('friend_page_cursors', [None])
+            page = get_friends_page(user_id, cursor=cursors[-1])
+            for friend in page['friends']:
+                friend_id = friend['user_id']
+                col_friend_photo, col_friend1, col_friend2 = st.columns([1, 6, 2])
+                with col_friend_photo:
+                    thumbnail = select_photo(friend, 64)
+                    if is_blob_ref(thumbnail):
+                        display_profile_image(thumbnail, None, 64)
+                with col_friend1:
+                    st.write(f"• **{friend.get('display_name', 'Unknown')}** ({friend.get('email', 'No email')})")
+                    if st.button(f"👤 公開ページを見る", key=f"view_friend_{friend_id}"):
+                        st.query_params["user_id"] = friend_id
+                        st.rerun()
+                with col_friend2:
+                    if st.button(f"❌ 友達削除", key=f"remove_friend_{friend_id}"):
+                        removed, error = remove_friend(user_id, friend_id)
+                        if error:
+                            st.error(error)
+                        else:
+                            st.success("友達を削除しました")
                             st.rerun()
-                    with col_friend2:
-                        if st.button(f"❌ 友達削除", key=f"remove_friend_{friend_id}"):
-                            if 'friends' in user:
-                                user['friends'].remove(friend_id)
-                                update_user_profile(user_id, {'friends': user['friends']})
-                                st.success("友達を削除しました")
-                                st.rerun()
+            if page['missing_ids']:
+                st.caption(f"退会などで表示できない友達: {len(page['missing_ids'])}人")
+            
+            col_prev, col_next = st.columns(2)
+            with col_prev:
+                if len(cursors) > 1 and st.button("◀ 前の友達"):
+                    cursors.pop()
+                    st.rerun()
+            with col_next:
+                if page['next_cursor'] and st.button("次の友達 ▶"):
+                    cursors.append(page['next_cursor'])
+                    st.rerun()
         else:
             st.info("友達がいません。他のユーザーのQRコードを読み取って友達になりましょう！")
+        
+        # 友達の友達から、共通の友達が多い順に表示する
+        suggestions = get_friend_suggestions(user_id) if friend_count else []
+        if suggestions:
+            st.subheader("知り合いかも？")
+            for suggestion in suggestions:
+                suggestion_id = suggestion['user_id']
+                col_photo, col_info, col_add = st.columns([1, 6, 2])
+                with col_photo:
+                    thumbnail = select_photo(suggestion, 64)
+                    if is_blob_ref(thumbnail):
+                        display_profile_image(thumbnail, None, 64)
+                with col_info:
+                    st.write(f"• **{suggestion.get('display_name', 'Unknown')}**（共通の友達 {suggestion['mutual_friend_count']}人）")
+                    if st.button(f"👤 公開ページを見る", key=f"view_suggestion_{suggestion_id}"):
+                        st.query_params["user_id"] = suggestion_id
+                        st.rerun()
+                with col_add:
+                    if st.button(f"🤝 友達になる", key=f"add_suggestion_{suggestion_id}"):
+                        added, error = add_friend(user_id, suggestion_id)
+                        if error:
+                            st.error(error)
+                        else:
+                            st.success("友達になりました！")
+                            st.rerun()
+        
+        # 興味のあるジャンルが似ている参加者
+        similar_users = get_similar_interest_users(user_id) if user.get('interests') else []
+        if similar_users:
+            st.subheader("興味が似ている参加者")
+            for similar_user in similar_users:
+                similar_id = similar_user['user_id']
+                common_interests = [interest for interest in similar_user.get('interests', []) if interest in user['interests']]
+                col_photo, col_info = st.columns([1, 8])
+                with col_photo:
+                    thumbnail = select_photo(similar_user, 64)
+                    if is_blob_ref(thumbnail):
+                        display_profile_image(thumbnail, None, 64)
+                with col_info:
+                    st.write(f"• **{similar_user.get('display_name', 'Unknown')}**（共通: {'・'.join(common_interests)}）")
+                    if st.button(f"👤 公開ページを見る", key=f"view_similar_{similar_id}"):
+                        st.query_params["user_id"] = similar_id
+                        st.rerun()
     else:
         st.error("ユーザー情報の取得に失敗しました")
 
+def show_user_search():
+    """参加者検索"""
+    set_page('search')
+    st.header("参加者検索")
+    
+    interest_counts = get_interest_counts()
+    if interest_counts:
+        st.caption("、".join(f"{interest} {count}人" for interest, count in interest_counts.items()))
+    
+    keyword = st.text_input("キーワード（表示名・プロフィール）", placeholder="例: やまだ、カメラ").strip()
+    
+    col_any, col_all, col_none = st.columns(3)
+    with col_any:
+        any_of = st.multiselect("いずれかに興味がある", INTEREST_OPTIONS)
+    with col_all:
+        all_of = st.multiselect("すべてに興味がある", INTEREST_OPTIONS)
+    with col_none:
+        none_of = st.multiselect("興味がない", INTEREST_OPTIONS)
+    
+    # 条件が変わったら1ページ目に戻る
+    query = (keyword, tuple(any_of), tuple(all_of), tuple(none_of))
+    if st.session_state.get('search_query') != query:
+        st.session_state.search_query = query
+        st.session_state.search_page_cursors = [None]
+    cursors = st.session_state.setdefault('search_page_cursors', [None])
+    
+    if keyword:
+        # キーワードとジャンルの条件の両方に一致した参加者（一致度の高い順、ページ送りなし）
+        found_users = search_users_by_keyword(keyword, any_of=any_of, all_of=all_of, none_of=none_of)
+        page = {'users': found_users, 'total': len(found_users), 'next_cursor': None}
+    else:
+        page = search_users_by_interests(any_of, all_of, none_of, cursor=cursors[-1])
+    if keyword and page['total'] >= TEXT_SEARCH_CONFIG["max_results"]:
+        st.write(f"一致度の高い上位**{page['total']}人**を表示しています（キーワードを追加すると絞り込めます）")
+    else:
+        st.write(f"**{page['total']}人**が見つかりました")
+    for found_user in page['users']:
+        found_id = found_user['user_id']
+        col_photo, col_info = st.columns([1, 8])
+        with col_photo:
+            thumbnail = select_photo(found_user, 64)
+            if is_blob_ref(thumbnail):
+                display_profile_image(thumbnail, None, 64)
+        with col_info:
+            st.write(f"• **{found_user.get('display_name', 'Unknown')}**（{'・'.join(found_user.get('interests', []))}）")
+            if st.button(f"👤 公開ページを見る", key=f"view_search_{found_id}"):
+                st.query_params["user_id"] = found_id
+                st.rerun()
+    
+    col_prev, col_next = st.columns(2)
+    with col_prev:
+        if len(cursors) > 1 and st.button("◀ 前のページ"):
+            cursors.pop()
+            st.rerun()
+    with col_next:
+        if page['next_cursor'] and st.button("次のページ ▶"):
+            cursors.append(page['next_cursor'])
+            st.rerun()
+
 def show_profile_edit():
     """プロフィール編集"""
+    set_page('profile_edit')
     st.header("プロフィール編集")
     
     user_id = get_current_user_id()
@@ -308,7 +469,7 @@ def show_profile_edit():
             new_profile = st.text_area("プロフィール", value=user.get('profile', ''))
             new_interests = st.multiselect(
                 "興味のあるジャンル",
-                ["技術", "音楽", "スポーツ", "料理", "旅行", "アート", "ゲーム", "その他"],
+                INTEREST_OPTIONS,
                 default=user.get('interests', [])
             )
             
@@ -331,10 +492,7 @@ def show_profile_edit():
                             st.error("ファイルサイズは5MB以下にしてください。")
                             return
                         
-                        photo_bytes = uploaded_file.read()
-                        photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
-                        photo_data = f"data:image/{uploaded_file.type};base64,{photo_base64}"
-                        update_data['photo'] = photo_data
+                        update_data.update(store_uploaded_photo(uploaded_file))
                         st.success("写真がアップロードされました")
                     except Exception as e:
                         st.error(f"❌ 写真のアップロードに失敗しました: {e}")
@@ -353,8 +511,46 @@ def show_profile_edit():
 
 def show_admin_panel():
     """管理者パネル"""
+    set_page('admin')
     st.header("👑 管理者パネル")
     
+    # 接続状態
+    health = get_user_repository().health_check()
+    if health['ok']:
+        st.caption(f"🟢 {health['detail']} 接続正常（応答 {health['latency_ms']:.0f}ms）")
+    else:
+        st.warning(f"データベース接続エラー: {health['error']}")
+    
+    with st.expander("📊 キャッシュ統計"):
+        for label, stats in [("ユーザー情報", get_user_cache_stats()), ("QRコード", qr_code_cache.stats())]:
+            st.write(
+                f"**{label}:** ヒット率 {stats['hit_ratio']:.1%}"
+                f"（ヒット {stats['hits']} / ミス {stats['misses']}）、"
+                f"保持 {stats['entries']}件、追い出し {stats['evictions']}件"
+            )
+        mirror_stats = get_user_mirror_stats()
+        if mirror_stats:
+            show_mirror_stats(mirror_stats)
+        graph_stats = get_friend_graph_stats()
+        if graph_stats:
+            st.write(
+                f"**友達関係のインデックス:** ユーザー {graph_stats['users']}人、友達関係 {graph_stats['edges']}件、"
+                f"{graph_stats['bytes'] / 1024:.0f}KB（作成 {graph_stats['build_seconds']:.2f}秒、"
+                f"{graph_stats['age_seconds']:.0f}秒前）"
+            )
+        for label, index_stats in [("興味のあるジャンルの類似度", get_interest_matrix_stats()),
+                                   ("興味のあるジャンルの検索", get_interest_index_stats()),
+                                   ("キーワード検索", get_text_index_stats())]:
+            if index_stats:
+                st.write(
+                    f"**{label}のインデックス:** ユーザー {index_stats['users']}人、"
+                    f"{index_stats['bytes'] / 1024:.0f}KB（作成 {index_stats['build_seconds']:.2f}秒、"
+                    f"{index_stats['age_seconds']:.0f}秒前）"
+                )
+    
+    with st.expander("⏱ 処理時間・読み書き回数"):
+        show_metrics_summary()
+    
     # 管理者ユーザー作成
     st.subheader("管理者ユーザー作成")
     with st.form("create_admin_form"):
@@ -368,7 +564,11 @@ def show_admin_panel():
                 if len(admin_password) < 8:
                     st.error("パスワードは8文字以上で入力してください。")
                 else:
-                    user_id, error = create_admin_user(admin_email, admin_password, admin_display_name)
+                    user_id, error = create_admin_user({
+                        'email': admin_email,
+                        'password': admin_password,
+                        'display_name': admin_display_name
+                    })
                     if user_id:
                         st.success("管理者ユーザーを作成しました！")
                         st.balloons()
@@ -377,9 +577,177 @@ def show_admin_panel():
             else:
                 st.error("すべての項目を入力してください。")
     
+    # QRコードバッジシート
+    st.subheader("QRコードバッジシート")
+    if st.button("🖨️ 全参加者のバッジシートを作成"):
+        progress_bar = st.progress(0.0, text="バッジを生成しています...")
+        
+        def update_progress(done, total):
+            ratio = min(done / total, 1.0) if total else 0.0
+            progress_bar.progress(ratio, text=f"{done}/{total}人のバッジを生成しました")
+        
+        output_dir = tempfile.mkdtemp(prefix="badges_")
+        try:
+            pdf_path, badge_count, sheet_count = generate_all_badge_sheets(output_dir, update_progress)
+        except Exception as e:
+            progress_bar.empty()
+            st.error(f"バッジシート生成エラー: {e}")
+        else:
+            progress_bar.progress(1.0, text=f"{badge_count}人分のバッジを{sheet_count}枚のシートに出力しました")
+            st.session_state.badge_pdf_path = pdf_path
+    
+    if st.session_state.get('badge_pdf_path') and os.path.exists(st.session_state.badge_pdf_path):
+        with open(st.session_state.badge_pdf_path, 'rb') as pdf_file:
+            st.download_button(
+                label="バッジシート（PDF）をダウンロード",
+                data=pdf_file,
+                file_name="badges.pdf",
+                mime="application/pdf"
+            )
+    
+    # 参加者の一括登録
+    st.subheader("参加者の一括登録（CSV）")
+    st.caption("見出しに「メールアドレス」「表示名」（必須）、「プロフィール」「興味のあるジャンル」「パスワード」を含むCSVを登録します。"
+               "パスワードが空の参加者には初期パスワードを設定します。")
+    uploaded_csv = st.file_uploader("参加者名簿", type=['csv'], key="import_csv")
+    import_encoding = st.selectbox("文字コード", list(CSV_ENCODINGS), format_func=CSV_ENCODINGS.get)
+    if uploaded_csv is not None and st.button("📥 一括登録"):
+        progress_text = st.empty()
+        
+        def update_import_progress(rows, imported):
+            progress_text.info(f"{rows}行を読み込み、{imported}人を登録しました...")
+        
+        output_dir = tempfile.mkdtemp(prefix="import_")
+        reject_path = os.path.join(output_dir, "rejects.csv")
+        credentials_path = os.path.join(output_dir, "credentials.csv")
+        # アップロードされたファイルは行ごとに読み込み、文字列全体には変換しない
+        csv_file = io.TextIOWrapper(uploaded_csv, encoding=import_encoding, newline='')
+        # 不備のある行の一覧はExcelで開けるようBOM付きのUTF-8で書き出す
+        with open(reject_path, 'w', encoding='utf-8-sig', newline='') as reject_file, \
+                open(credentials_path, 'w', encoding='utf-8-sig', newline='') as credentials_file:
+            try:
+                summary, error = import_attendees(csv_file, reject_file, credentials_file, update_import_progress)
+            except UnicodeDecodeError:
+                summary, error = None, "文字コードが正しくありません。別の文字コードを選択してください"
+            finally:
+                csv_file.detach()
+        progress_text.empty()
+        st.session_state.import_result = {
+            'summary': summary,
+            'error': error,
+            'reject_path': reject_path,
+            'credentials_path': credentials_path
+        }
+    
+    import_result = st.session_state.get('import_result')
+    if import_result:
+        summary = import_result['summary']
+        if import_result['error']:
+            st.error(f"一括登録エラー: {import_result['error']}")
+        if summary:
+            st.success(f"{summary['rows']}行のうち{summary['imported']}人を登録しました")
+            if summary['rejected'] and os.path.exists(import_result['reject_path']):
+                st.warning(f"{summary['rejected']}行は登録できませんでした（理由を付けた一覧を修正して、そのまま再登録できます）")
+                with open(import_result['reject_path'], 'rb') as reject_file:
+                    st.download_button("登録できなかった行（CSV）をダウンロード", reject_file,
+                                       file_name="rejects.csv", mime="text/csv")
+            if summary['imported'] and os.path.exists(import_result['credentials_path']):
+                with open(import_result['credentials_path'], 'rb') as credentials_file:
+                    st.download_button("初期パスワードの一覧（CSV）をダウンロード", credentials_file,
+                                       file_name="credentials.csv", mime="text/csv")
+    
+    # 参加者のエクスポート
+    st.subheader("参加者のエクスポート")
+    col_format, col_fields = st.columns([1, 3])
+    with col_format:
+        export_format = st.selectbox("形式", list(EXPORT_FORMATS), format_func=EXPORT_FORMATS.get)
+    with col_fields:
+        export_fields = st.multiselect("項目", EXPORT_FIELDS, default=EXPORT_FIELDS)
+    if st.button("📤 エクスポート"):
+        progress_bar = st.progress(0.0, text="書き出しています...")
+        
+        def update_export_progress(count, total):
+            ratio = min(count / total, 1.0) if total else 0.0
+            progress_bar.progress(ratio, text=f"{count}/{total}人を書き出しました")
+        
+        # 一時ファイルに1人ずつ書き出し、全員分をメモリに保持しない
+        export_path = os.path.join(tempfile.mkdtemp(prefix="export_"), f"users.{export_format}")
+        encoding = 'utf-8-sig' if export_format == 'csv' else 'utf-8'
+        with open(export_path, 'w', encoding=encoding, newline='') as output:
+            summary, error = export_users(output, export_format, export_fields,
+                                          progress_callback=update_export_progress, total=count_users())
+        st.session_state.export_result = {'summary': summary, 'error': error, 'path': export_path}
+        if error:
+            progress_bar.empty()
+        else:
+            progress_bar.progress(1.0, text=f"{summary['count']}人を書き出しました")
+    
+    export_result = st.session_state.get('export_result')
+    if export_result:
+        if export_result['error']:
+            st.error(f"{export_result['error']}（{export_result['summary']['count']}人まで書き出しました）")
+        elif os.path.exists(export_result['path']):
+            export_name = os.path.basename(export_result['path'])
+            with open(export_result['path'], 'rb') as export_file:
+                st.download_button(f"{export_name}をダウンロード", export_file, file_name=export_name,
+                                   mime="text/csv" if export_name.endswith('.csv') else "application/x-ndjson")
+    
     # ユーザー管理
     st.subheader("ユーザー管理")
-    users = get_all_users()
+    
+    order_labels = {'created_at': "登録日", 'display_name': "表示名"}
+    col_order, col_direction, col_size = st.columns(3)
+    with col_order:
+        order_by = st.selectbox("並び順", USER_LIST_ORDER_FIELDS, format_func=lambda field: order_labels[field])
+    with col_direction:
+        descending = st.radio("方向", ["昇順", "降順"], horizontal=True) == "降順"
+    with col_size:
+        page_size = st.selectbox("表示件数", [10, 20, 50, 100], index=1)
+    keyword = st.text_input("キーワードで検索（表示名・メールアドレス・プロフィール）").strip()
+    
+    if keyword:
+        # 検索結果は一致度の高い順に表示する（ページ送りなし）
+        users = search_users_by_keyword(keyword, page_size, USER_LIST_FIELDS, include_email=True)
+        page = {'users': users, 'next_cursor': None, 'prev_cursor': None}
+    else:
+        page = list_users_page(
+            page_size=page_size,
+            order_by=order_by,
+            descending=descending,
+            cursor=st.session_state.get('admin_users_cursor'),
+            backwards=st.session_state.get('admin_users_backwards', False)
+        )
+    users = page['users']
+    
+    # 旧データにはパスワード設定状態のフラグが無いため、必要に応じて集計する
+    if any('has_password' not in user for user in users):
+        if st.button("🔄 パスワード設定状態を集計"):
+            updated_count, error = backfill_has_password_flags()
+            if error:
+                st.error(error)
+            else:
+                st.success(f"{updated_count}人のパスワード設定状態を集計しました")
+                st.rerun()
+    
+    # 削除などでページが空になった場合は先頭ページに戻る
+    if not users and not keyword and st.session_state.get('admin_users_cursor'):
+        del st.session_state.admin_users_cursor
+        st.session_state.admin_users_backwards = False
+        st.rerun()
+    
+    col_prev, col_next = st.columns(2)
+    with col_prev:
+        if page['prev_cursor'] and st.button("◀ 前のページ"):
+            st.session_state.admin_users_cursor = page['prev_cursor']
+            st.session_state.admin_users_backwards = True
+            st.rerun()
+    with col_next:
+        if page['next_cursor'] and st.button("次のページ ▶"):
+            st.session_state.admin_users_cursor = page['next_cursor']
+            st.session_state.admin_users_backwards = False
+            st.rerun()
+    
+    show_bulk_admin_actions(users)
     
     if users:
         for user in users:
@@ -420,7 +788,9 @@ def show_admin_panel():
                                 st.error(f"削除エラー: {error}")
                 
                 # パスワードリセット
-                if check_user_has_password(user['user_id']):
+                if user.get('has_password') is None:
+                    st.caption("パスワード設定状態は未集計です")
+                elif user['has_password']:
                     st.info("このユーザーはパスワードを設定済みです")
                 else:
                     st.warning("このユーザーはパスワードを設定していません")
@@ -452,6 +822,170 @@ def show_admin_panel():
     else:
         st.info("ユーザーが見つかりません")
 
+# 一括操作の表示名（database.BULK_ADMIN_ACTIONSの順）
+BULK_ACTION_LABELS = {
+    'promote': "👑 管理者に昇格",
+    'demote': "👤 一般ユーザーに変更",
+    'reset_password': "🔑 パスワードリセット（未設定のユーザーのみ）",
+    'delete': "❌ 削除"
+}
+
+def show_bulk_admin_actions(users):
+    """選択したユーザーへの一括操作"""
+    with st.expander("📋 一括操作", expanded='admin_bulk_result' in st.session_state):
+        # 前回の実行結果（実行後は一覧を読み込み直すため、結果はセッションに保持して表示する）
+        result = st.session_state.pop('admin_bulk_result', None)
+        if result:
+            st.success(f"{BULK_ACTION_LABELS[result['action']]}: {result['succeeded']}人を処理しました"
+                       f"（{result['elapsed']:.1f}秒）")
+            if result['error']:
+                st.error(result['error'])
+            if result['failures']:
+                st.warning(f"{len(result['failures'])}人は処理できませんでした")
+                st.dataframe(
+                    [{'ユーザーID': user_id, 'エラー': message} for user_id, message in result['failures']],
+                    use_container_width=True
+                )
+        
+        target = st.radio("対象", ["このページで選択したユーザー", "すべてのユーザー"], horizontal=True,
+                          key="admin_bulk_target")
+        if target == "すべてのユーザー":
+            selected_ids = None
+        else:
+            user_labels = {
+                user['user_id']: f"{user.get('display_name', 'Unknown')} ({user.get('email', 'No email')})"
+                for user in users
+            }
+            selected_ids = st.multiselect("ユーザー", list(user_labels), format_func=user_labels.get,
+                                          key="admin_bulk_selection")
+        action = st.selectbox("操作", list(BULK_ACTION_LABELS), format_func=BULK_ACTION_LABELS.get,
+                              key="admin_bulk_action")
+        
+        new_password = None
+        if action == 'reset_password':
+            new_password = st.text_input("新しいパスワード（対象の全員に設定します）", type="password",
+                                         key="admin_bulk_password")
+        confirmed = True
+        if action == 'delete' or selected_ids is None:
+            confirmed = st.checkbox("対象のユーザーに実行することを確認しました", key="admin_bulk_confirm")
+        
+        if st.button("一括実行", disabled=selected_ids == [] or not confirmed):
+            if action == 'reset_password' and (not new_password or len(new_password) < 8):
+                st.error("パスワードは8文字以上で入力してください")
+                return
+            
+            if selected_ids is None:
+                # 一覧の読み込みに失敗した場合は、一部のユーザーだけに実行しないよう中止する
+                try:
+                    selected_ids = [user['user_id'] for user in iter_all_users(['user_id'])]
+                except Exception as e:
+                    st.error(f"ユーザー一覧の取得に失敗したため、一括操作を中止しました: {e}")
+                    return
+            # 自分自身の権限の変更・削除はできない
+            current_user_id = get_current_user_id()
+            failures = []
+            if action in ('demote', 'delete') and current_user_id in selected_ids:
+                selected_ids = [user_id for user_id in selected_ids if user_id != current_user_id]
+                failures.append((current_user_id, "ログイン中の管理者自身は変更できません"))
+            
+            progress_bar = st.progress(0.0, text="処理しています...")
+            
+            def update_progress(done, total):
+                ratio = min(done / total, 1.0) if total else 1.0
+                progress_bar.progress(ratio, text=f"{done}/{total}人を処理しました")
+            
+            started = time.perf_counter()
+            results, error = run_bulk_admin_action(action, selected_ids, new_password, update_progress)
+            failures += [(user_id, message) for user_id, message in results.items() if message]
+            st.session_state.admin_bulk_result = {
+                'action': action,
+                'succeeded': sum(1 for message in results.values() if message is None),
+                'failures': failures,
+                'error': error,
+                'elapsed': time.perf_counter() - started
+            }
+            for key in ('admin_bulk_selection', 'admin_bulk_password', 'admin_bulk_confirm'):
+                st.session_state.pop(key, None)
+            st.rerun()
+
+MIRROR_STATE_LABELS = {
+    'connecting': "🟡 全員分を読み込み中", 'live': "🟢 同期中",
+    'disconnected': "🔴 切断（直接読み込み）", 'unsupported': "⚪ 購読に未対応（直接読み込み）"
+}
+
+def show_mirror_stats(stats):
+    """ユーザー情報のミラーの状態と鮮度を表示する"""
+    freshness = []
+    if stats['last_change_age_seconds'] is not None:
+        freshness.append(f"最終変更 {stats['last_change_age_seconds']:.0f}秒前")
+    if stats['lag_seconds'] is not None:
+        freshness.append(f"反映の遅れ {stats['lag_seconds'] * 1000:.0f}ms")
+    st.write(
+        f"**ユーザー情報のミラー:** {MIRROR_STATE_LABELS.get(stats['state'], stats['state'])}、"
+        f"ユーザー {stats['users']}人、複製からの読み込み {stats['mirror_ratio']:.1%}"
+        f"（複製 {stats['mirror_reads']} / 直接 {stats['direct_reads']}）、"
+        f"反映待ち {stats['pending']}人、再接続 {stats['reconnects']}回"
+        + (f"（{'、'.join(freshness)}）" if freshness else "")
+    )
+    if stats['error'] and stats['state'] != 'live':
+        st.caption(stats['error'])
+
+def format_p95(row, digits):
+    """p95を表示用の文字列にする（計測の最大の区切りを超えた場合は「>10000」のように表示する）"""
+    if row['p95_overflow']:
+        return f">{row['p95_ms']:.0f}"
+    return f"{row['p95_ms']:.{digits}f}"
+
+def show_metrics_summary():
+    """計測結果の集計を表示する"""
+    if not METRICS_CONFIG["enabled"]:
+        st.info("METRICS_ENABLED=trueを設定すると、ページごとの処理時間と読み書き回数を記録します")
+        return
+    
+    page_labels = {
+        'mypage': "マイページ", 'public': "公開ページ", 'admin': "管理者パネル",
+        'profile_edit': "プロフィール編集", 'login': "ログイン・新規登録", 'app': "その他"
+    }
+    summary = metrics_registry.summarize()
+    st.write("**ページごと（rerun 1回あたり）**")
+    st.dataframe([
+        {
+            "ページ": page_labels.get(row['page'], row['page']),
+            "rerun数": row['reruns'],
+            "平均(ms)": round(row['mean_ms'], 1),
+            "p95(ms)": format_p95(row, 1),
+            "読み込み": round(row['reads_per_rerun'], 1),
+            "書き込み": round(row['writes_per_rerun'], 1)
+        }
+        for row in summary['pages']
+    ], hide_index=True)
+    
+    st.write("**処理ごと（合計時間の長い順）**")
+    st.dataframe([
+        {
+            "処理": row['operation'],
+            "呼び出し": row['calls'],
+            "合計(ms)": round(row['total_ms'], 1),
+            "平均(ms)": round(row['mean_ms'], 2),
+            "p95(ms)": format_p95(row, 2),
+            "エラー": row['errors']
+        }
+        for row in summary['operations']
+    ], hide_index=True)
+    
+    col_download, col_reset = st.columns(2)
+    with col_download:
+        st.download_button(
+            "📥 Prometheus形式でダウンロード",
+            data=metrics_registry.render_prometheus(),
+            file_name="metrics.txt",
+            mime="text/plain"
+        )
+    with col_reset:
+        if st.button("🔄 計測値をリセット"):
+            metrics_registry.reset()
+            st.rerun()
+
 def show_user_edit_form(user):
     """ユーザー編集フォーム"""
     st.subheader(f"ユーザー編集: {user.get('display_name', 'Unknown')}")
@@ -461,7 +995,7 @@ def show_user_edit_form(user):
         new_profile = st.text_area("プロフィール", value=user.get('profile', ''))
         new_interests = st.multiselect(
             "興味のあるジャンル",
-            ["技術", "音楽", "スポーツ", "料理", "旅行", "アート", "ゲーム", "その他"],
+            INTEREST_OPTIONS,
             default=user.get('interests', [])
         )
         
@@ -483,6 +1017,7 @@ def show_user_edit_form(user):
 
 def show_public_user_page(user_id):
     """公開ユーザーページ"""
+    set_page('public')
     user = get_user_by_id(user_id)
     
     if user:
@@ -493,7 +1028,7 @@ def show_public_user_page(user_id):
         with col1:
             st.subheader("プロフィール写真")
             if user.get('photo'):
-                display_profile_image(user['photo'], "プロフィール写真", 200)
+                display_profile_image(select_photo(user, 200), "プロフィール写真", 200)
             else:
                 st.info("プロフィール写真が設定されていません")
         
@@ -511,24 +1046,24 @@ def show_public_user_page(user_id):
         if is_authenticated():
             current_user_id = get_current_user_id()
             if current_user_id != user_id:
-                current_user = get_user_by_id(current_user_id)
-                if current_user:
-                    friends = current_user.get('friends', [])
-                    
-                    if user_id in friends:
-                        st.success("✅ 既に友達です")
-                        if st.button("❌ 友達削除", key=f"remove_friend_{user_id}"):
-                            friends.remove(user_id)
-                            update_user_profile(current_user_id, {'friends': friends})
+                mutual_count = get_mutual_friend_count(current_user_id, user_id)
+                if mutual_count:
+                    st.write(f"**共通の友達:** {mutual_count}人")
+                if is_friend(current_user_id, user_id):
+                    st.success("✅ 既に友達です")
+                    if st.button("❌ 友達削除", key=f"remove_friend_{user_id}"):
+                        removed, error = remove_friend(current_user_id, user_id)
+                        if error:
+                            st.error(error)
+                        else:
                             st.success("友達を削除しました")
                             st.rerun()
-                    else:
-                        if st.button("🤝 友達になる", key=f"add_friend_{user_id}"):
-                            if 'friends' not in current_user:
-                                current_user['friends'] = []
-                            current_user['friends'].append(user_id)
-                            update_user_profile(current_user_id, {'friends': current_user['friends']})
-                            
+                else:
+                    if st.button("🤝 友達になる", key=f"add_friend_{user_id}"):
+                        added, error = add_friend(current_user_id, user_id)
+                        if error:
+                            st.error(error)
+                        else:
                             st.session_state.friend_added = True
                             st.success("友達になりました！")
                             st.rerun()
@@ -559,4 +1094,6 @@ def show_public_user_page(user_id):
             st.rerun()
 
 if __name__ == "__main__":
-    main()
+    # rerunごとの処理時間と読み書き回数を記録する（計測が無効の場合は何もしない）
+    with track_rerun():
+        main()
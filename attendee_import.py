@@ -0,0 +1,257 @@
+"""
+参加者名簿（CSV）から参加者を一括登録するモジュール
+管理者パネルから実行するほか、python attendee_import.py <CSVファイル> でも実行できます。
+"""
+
+import argparse
+import csv
+import os
+import re
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from config import IMPORT_CONFIG, INTEREST_OPTIONS
+from password_utils import hash_passwords
+from process_pool import create_process_pool
+from storage import normalize_email
+
+# 列名（英語・日本語の見出しのどちらでもよい）
+COLUMN_ALIASES = {
+    'email': ['email', 'メールアドレス'],
+    'display_name': ['display_name', '表示名', '氏名', '名前'],
+    'profile': ['profile', 'プロフィール'],
+    'interests': ['interests', '興味のあるジャンル'],
+    'password': ['password', 'パスワード']
+}
+REQUIRED_COLUMNS = ['email', 'display_name']
+
+# 読み込めるファイルの文字コード（Excelで保存したCSVはShift_JISのことが多い）
+CSV_ENCODINGS = {'utf-8-sig': "UTF-8", 'cp932': "Shift_JIS（Excel）"}
+
+# 興味のあるジャンルの区切り文字
+INTEREST_SEPARATOR = re.compile(r'[;；,，、/／|]')
+
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+MIN_PASSWORD_LENGTH = 8
+
+# パスワードの列が空の行に設定する初期パスワードのバイト数（URLセーフなBase64で12文字）
+INITIAL_PASSWORD_BYTES = 9
+
+# 不備のある行の一覧の見出し（元の列の前に付ける）
+REJECT_COLUMNS = ['行', '理由']
+
+# 初期パスワードの一覧の見出し
+CREDENTIAL_COLUMNS = ['メールアドレス', '表示名', '初期パスワード']
+
+def resolve_columns(fieldnames):
+    """CSVの見出しから、項目名 -> 列名の対応を求める"""
+    columns = {}
+    for fieldname in fieldnames or []:
+        name = fieldname.strip().lower()
+        for field, aliases in COLUMN_ALIASES.items():
+            if field not in columns and name in aliases:
+                columns[field] = fieldname
+    return columns
+
+def parse_row(row, columns):
+    """1行を登録用のユーザー情報にする
+
+    Returns:
+        (ユーザー情報, 不備の理由) いずれかはNone
+    """
+    def value(field):
+        return (row.get(columns.get(field)) or '').strip() if field in columns else ''
+
+    email = value('email')
+    display_name = value('display_name')
+    password = value('password')
+    interests = [interest.strip() for interest in INTEREST_SEPARATOR.split(value('interests')) if interest.strip()]
+    if not email:
+        return None, "メールアドレスがありません"
+    if not EMAIL_PATTERN.match(email):
+        return None, "メールアドレスの形式が正しくありません"
+    if not display_name:
+        return None, "表示名がありません"
+    if password and len(password) < MIN_PASSWORD_LENGTH:
+        return None, f"パスワードは{MIN_PASSWORD_LENGTH}文字以上で入力してください"
+    unknown = [interest for interest in interests if interest not in INTEREST_OPTIONS]
+    if unknown:
+        return None, f"不明な興味のあるジャンルです: {'、'.join(unknown)}"
+    return {
+        'email': email,
+        'display_name': display_name,
+        'profile': value('profile'),
+        'interests': list(dict.fromkeys(interests)),
+        'password': password or None
+    }, None
+
+class ImportReport:
+    """不備のある行と初期パスワードを、処理しながらCSVに書き出す"""
+
+    def __init__(self, reject_file, fieldnames, credentials_file=None):
+        self._rejects = csv.writer(reject_file)
+        self._rejects.writerow(REJECT_COLUMNS + list(fieldnames))
+        self._fieldnames = list(fieldnames)
+        self._credentials = csv.writer(credentials_file) if credentials_file is not None else None
+        if self._credentials:
+            self._credentials.writerow(CREDENTIAL_COLUMNS)
+        self.rejected_count = 0
+
+    def reject(self, line_number, row, reason):
+        self._rejects.writerow([line_number, reason] + [row.get(fieldname, '') for fieldname in self._fieldnames])
+        self.rejected_count += 1
+
+    def credential(self, user_data, password):
+        self._credentials.writerow([user_data['email'], user_data['display_name'], password])
+
+def _write_batch(batch, password_hashes):
+    """ハッシュ化したパスワードを設定してユーザーを保存する"""
+    from database import create_users, new_user_document
+
+    user_docs = [
+        new_user_document(user_data, password_hash)
+        for (_, _, user_data, _), password_hash in zip(batch, password_hashes)
+    ]
+    results, error = create_users(user_docs)
+    return [(entry, results.get(user_doc['user_id'], error)) for entry, user_doc in zip(batch, user_docs)]
+
+def import_attendees(csv_file, reject_file, credentials_file=None, progress_callback=None,
+                     batch_size=None, max_workers=None):
+    """CSVの参加者を1行ずつ読み込み、batch_size行ごとにまとめて登録する
+
+    batch_size行ごとに、登録済みのメールアドレスの確認（一括取得）、パスワードのハッシュ計算
+    （プロセスプール）、書き込み（バッチ）を行う。書き込みは次のバッチのハッシュ計算と並行して行い、
+    保持するのは2バッチ分の行とファイル内のメールアドレスだけになる。
+    不備のある行・登録できなかった行は、理由と元の列をreject_fileに書き出す
+    （修正してそのまま読み込み直せる）。パスワードの列が空の行には初期パスワードを設定し、
+    credentials_fileに書き出す（credentials_fileが無い場合は不備として扱う）。
+
+    progress_callbackは(読み込んだ行数, 登録した人数)で呼び出される。
+
+    Returns:
+        ({'rows': 読み込んだ行数, 'imported': 登録した人数, 'rejected': 不備のある行数}, エラーメッセージ)
+    """
+    from database import find_registered_emails
+
+    batch_size = batch_size or IMPORT_CONFIG["batch_size"]
+    max_workers = max_workers or IMPORT_CONFIG["hash_workers"]
+    summary = {'rows': 0, 'imported': 0, 'rejected': 0}
+
+    reader = csv.DictReader(csv_file)
+    columns = resolve_columns(reader.fieldnames)
+    missing = [field for field in REQUIRED_COLUMNS if field not in columns]
+    if missing:
+        labels = [COLUMN_ALIASES[field][1] for field in missing]
+        return summary, f"必須の列がありません: {'、'.join(labels)}（見出し: {', '.join(reader.fieldnames or [])}）"
+
+    report = ImportReport(reject_file, reader.fieldnames, credentials_file)
+    # ファイル内で重複したメールアドレスを見つけるため、正規化したメールアドレス -> 行番号を保持する
+    seen_emails = {}
+
+    def finish_write(write_future):
+        for (line_number, row, user_data, generated_password), error in write_future.result():
+            if error:
+                report.reject(line_number, row, error)
+            else:
+                summary['imported'] += 1
+                if generated_password:
+                    report.credential(user_data, generated_password)
+
+    with create_process_pool(max_workers) as hash_executor, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="import-write") as write_executor:
+        error = None
+        pending_write = None
+        rows = iter(reader)
+        while True:
+            batch = []
+            for row in rows:
+                # ファイルの行番号（見出しが1行目）
+                line_number = reader.line_num
+                summary['rows'] += 1
+                user_data, reason = parse_row(row, columns)
+                if user_data is not None:
+                    email_key = normalize_email(user_data['email'])
+                    if email_key in seen_emails:
+                        reason = f"ファイル内でメールアドレスが重複しています（{seen_emails[email_key]}行目）"
+                    elif user_data['password'] is None and credentials_file is None:
+                        reason = "パスワードがありません"
+                    else:
+                        seen_emails[email_key] = line_number
+                if reason:
+                    report.reject(line_number, row, reason)
+                    continue
+                batch.append((line_number, row, user_data))
+                if len(batch) == batch_size:
+                    break
+
+            entries = []
+            if batch:
+                registered, error = find_registered_emails([user_data['email'] for _, _, user_data in batch])
+                if error:
+                    break
+                for line_number, row, user_data in batch:
+                    if normalize_email(user_data['email']) in registered:
+                        report.reject(line_number, row, "このメールアドレスは既に登録されています")
+                    else:
+                        generated_password = None
+                        if user_data['password'] is None:
+                            generated_password = secrets.token_urlsafe(INITIAL_PASSWORD_BYTES)
+                        entries.append((line_number, row, user_data, generated_password))
+                password_hashes = hash_passwords(
+                    [user_data['password'] or generated_password for _, _, user_data, generated_password in entries],
+                    hash_executor
+                )
+
+            # 前のバッチの書き込みを待ってから次のバッチを書き込む
+            if pending_write is not None:
+                finish_write(pending_write)
+                pending_write = None
+            if progress_callback:
+                progress_callback(summary['rows'], summary['imported'])
+            if not batch:
+                break
+            if entries:
+                pending_write = write_executor.submit(_write_batch, entries, password_hashes)
+
+        if pending_write is not None:
+            finish_write(pending_write)
+    summary['rejected'] = report.rejected_count
+    return summary, error
+
+def main():
+    """コマンドラインから参加者を一括登録する"""
+    from config import STORAGE_CONFIG, initialize_firebase
+
+    parser = argparse.ArgumentParser(description="参加者名簿（CSV）から参加者を一括登録する")
+    parser.add_argument("csv_path", help="参加者名簿のCSVファイル")
+    parser.add_argument("--encoding", default="utf-8-sig", choices=list(CSV_ENCODINGS), help="CSVファイルの文字コード")
+    parser.add_argument("--rejects", help="不備のある行の出力先（既定: <CSVファイル名>_rejects.csv）")
+    parser.add_argument("--credentials", help="初期パスワードの出力先（既定: <CSVファイル名>_credentials.csv）")
+    args = parser.parse_args()
+
+    if STORAGE_CONFIG["backend"] == "firestore" and not initialize_firebase():
+        print("Firebaseの初期化に失敗しました。")
+        return
+
+    base_path = os.path.splitext(args.csv_path)[0]
+    reject_path = args.rejects or f"{base_path}_rejects.csv"
+    credentials_path = args.credentials or f"{base_path}_credentials.csv"
+
+    def print_progress(rows, imported):
+        print(f"{rows}行を読み込み、{imported}人を登録しました")
+
+    # 不備のある行の一覧はExcelで開けるようBOM付きのUTF-8で書き出す
+    with open(args.csv_path, encoding=args.encoding, newline='') as csv_file, \
+            open(reject_path, 'w', encoding='utf-8-sig', newline='') as reject_file, \
+            open(credentials_path, 'w', encoding='utf-8-sig', newline='') as credentials_file:
+        summary, error = import_attendees(csv_file, reject_file, credentials_file, print_progress)
+
+    if error:
+        print(f"登録エラー: {error}")
+    print(f"{summary['rows']}行のうち{summary['imported']}人を登録しました。")
+    if summary['rejected']:
+        print(f"登録できなかった{summary['rejected']}行: {reject_path}")
+    print(f"初期パスワードの一覧: {credentials_path}（配布後は削除してください）")
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,14 @@
 import streamlit as st
 import firebase_admin
 from firebase_admin import auth, firestore
-from config import get_firestore_client
+from storage import get_user_repository
 
 def check_admin_status(user_id):
     """ユーザーが管理者かどうかをチェックする"""
     try:
-        db = get_firestore_client()
-        if db:
-            user_doc = db.collection('users').document(user_id).get()
-            if user_doc.exists:
-                return user_doc.to_dict().get('is_admin', False)
+        user = get_user_repository().get(user_id, ['is_admin'])
+        if user is not None:
+            return user.get('is_admin', False)
         return False
     except Exception as e:
         st.error(f"管理者権限チェックエラー: {e}")
@@ -36,6 +34,14 @@ def clear_user_session():
         del st.session_state.is_admin
     if 'authenticated' in st.session_state:
         del st.session_state.authenticated
+    if 'friend_page_cursors' in st.session_state:
+        del st.session_state.friend_page_cursors
+    if 'search_page_cursors' in st.session_state:
+        del st.session_state.search_page_cursors
+    if 'import_result' in st.session_state:
+        del st.session_state.import_result
+    if 'export_result' in st.session_state:
+        del st.session_state.export_result
 
 def is_authenticated():
     """ユーザーが認証されているかチェックする"""
@@ -0,0 +1,28 @@
+"""
+既存ユーザーのメールアドレス索引（emailsコレクション）を作成するスクリプト
+python backfill_email_index.py で実行してください。
+"""
+
+from config import initialize_firebase
+from database import backfill_email_index
+
+def main():
+    """メールアドレス索引を作成する"""
+    if not initialize_firebase():
+        print("Firebaseの初期化に失敗しました。")
+        return
+    
+    created_count, duplicate_ids, error = backfill_email_index()
+    if error:
+        print(f"索引作成エラー: {error}")
+        return
+    
+    print(f"{created_count}件のメールアドレス索引を作成しました。")
+    if duplicate_ids:
+        print("他のユーザーとメールアドレスが重複しているユーザー:")
+        for user_id in duplicate_ids:
+            print(f"  {user_id}")
+    print("すべてのユーザーの索引を作成したら、EMAIL_INDEX_FALLBACK=false を設定してください。")
+
+if __name__ == "__main__":
+    main()
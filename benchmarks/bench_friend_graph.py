@@ -0,0 +1,59 @@
+"""
+友達関係のインデックス（friend_graph.FriendGraph）のマイクロベンチマーク
+python -m benchmarks.bench_friend_graph --sizes 10000,100000 で実行してください。
+"""
+
+import argparse
+import random
+import time
+from friend_graph import FriendGraph
+from benchmarks.bench_load import percentile
+from benchmarks.fixtures import generate_users
+
+def generate_edges(user_count, seed):
+    """ベンチマーク用の参加者の友達関係を(ユーザーID, 友達のユーザーID)で返す"""
+    return [
+        (user['user_id'], friend_id)
+        for user in generate_users(user_count, seed) for friend_id in user['friends']
+    ]
+
+def measure_ms(func, arguments):
+    """引数ごとの実行時間（ミリ秒）を並べ替えて返す"""
+    samples = []
+    for args in arguments:
+        started = time.perf_counter()
+        func(*args)
+        samples.append((time.perf_counter() - started) * 1000)
+    return sorted(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description="友達関係のインデックスのベンチマーク")
+    parser.add_argument("--sizes", default="10000,100000", help="参加者数（カンマ区切り）")
+    parser.add_argument("--queries", type=int, default=2000, help="データサイズごとの問い合わせ回数")
+    parser.add_argument("--limit", type=int, default=5, help="友達候補の数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'参加者数':>10}{'友達関係':>10}{'作成(ms)':>10}{'MB':>8}"
+          f"{'候補p50':>10}{'候補p99':>10}{'共通p50':>10}{'追加p50':>10}")
+    for user_count in [int(size) for size in args.sizes.split(',')]:
+        edges = generate_edges(user_count, args.seed)
+        started = time.perf_counter()
+        graph = FriendGraph.from_edges(edges)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        rng = random.Random(args.seed)
+        user_ids = list(dict.fromkeys(user_id for edge in edges for user_id in edge))
+        pairs = [(rng.choice(user_ids), rng.choice(user_ids)) for _ in range(args.queries)]
+        suggest_ms = measure_ms(graph.suggest, [(user_id, args.limit) for user_id, _ in pairs])
+        mutual_ms = measure_ms(graph.mutual_friend_count, pairs)
+        # 変更した行をまとめ直す時間を含む
+        add_ms = measure_ms(graph.add_edge, pairs)
+
+        stats = graph.stats()
+        print(f"{user_count:>10}{stats['edges']:>10}{build_ms:>10.1f}{stats['bytes'] / 1024 / 1024:>8.1f}"
+              f"{percentile(suggest_ms, 0.5):>10.3f}{percentile(suggest_ms, 0.99):>10.3f}"
+              f"{percentile(mutual_ms, 0.5):>10.3f}{percentile(add_ms, 0.5):>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+興味のあるジャンルのビット行列（interest_matching.InterestMatrix）のマイクロベンチマーク
+python -m benchmarks.bench_interest_matching --sizes 10000,100000 で実行してください。
+"""
+
+import argparse
+import random
+import time
+from config import INTEREST_OPTIONS
+from interest_matching import SIMILARITY_METRICS, InterestMatrix
+from benchmarks.bench_friend_graph import measure_ms
+from benchmarks.bench_load import percentile
+from benchmarks.fixtures import generate_users
+
+def main():
+    parser = argparse.ArgumentParser(description="興味のあるジャンルのビット行列のベンチマーク")
+    parser.add_argument("--sizes", default="10000,100000", help="参加者数（カンマ区切り）")
+    parser.add_argument("--queries", type=int, default=500, help="データサイズごとの問い合わせ回数")
+    parser.add_argument("--limit", type=int, default=5, help="取得する参加者の数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'参加者数':>10}{'類似度':>10}{'作成(ms)':>10}{'KB':>8}{'p50(ms)':>10}{'p99(ms)':>10}{'全員(秒)':>10}")
+    for user_count in [int(size) for size in args.sizes.split(',')]:
+        users = [
+            {'user_id': user['user_id'], 'interests': user['interests']}
+            for user in generate_users(user_count, args.seed)
+        ]
+        started = time.perf_counter()
+        matrix = InterestMatrix.from_users(users, INTEREST_OPTIONS)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        rng = random.Random(args.seed)
+        query_ids = [rng.choice(users)['user_id'] for _ in range(args.queries)]
+        for metric in SIMILARITY_METRICS:
+            samples = measure_ms(matrix.top_matches, [(user_id, args.limit, metric) for user_id in query_ids])
+            started = time.perf_counter()
+            for _ in matrix.iter_all_top_matches(args.limit, metric):
+                pass
+            all_seconds = time.perf_counter() - started
+            print(f"{user_count:>10}{metric:>10}{build_ms:>10.1f}{matrix.stats()['bytes'] / 1024:>8.0f}"
+                  f"{percentile(samples, 0.5):>10.3f}{percentile(samples, 0.99):>10.3f}{all_seconds:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+参加者が一斉にアクセスしたときの負荷ベンチマーク
+python -m benchmarks.bench_load --sizes 1000,10000 で実行してください。
+
+各フローは、対応する画面（ログイン、マイページ、公開ページ、管理者パネル）が
+database.pyなどを呼び出す処理をStreamlitの描画を除いて再現します。
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from auth_utils import check_admin_status
+from blob_store import LocalBlobStore, load_blob, override_blob_store
+from config import APP_CONFIG, INTEREST_OPTIONS
+from database import (
+    authenticate_user, friend_graph, get_friend_suggestions, get_friends_page, get_interest_counts,
+    get_similar_interest_users, get_user_by_id, get_user_cache_stats, interest_index, interest_matrix, is_friend,
+    list_users_page, search_users_by_interests, search_users_by_keyword, text_index, user_cache
+)
+from image_utils import select_photo
+from qr_utils import generate_user_qr_code
+from storage import create_user_repository, override_user_repository
+from storage.instrumented import InstrumentedUserRepository
+from benchmarks.fixtures import FAMILY_NAMES, FIXTURE_PASSWORD, GIVEN_NAMES, fixture_email, seed_repository
+
+# フローごとの実行比率の既定値（QRコードを読み取って公開ページを開く操作が最も多い）
+DEFAULT_MIX = {'public': 50, 'mypage': 30, 'login': 15, 'search': 5, 'admin': 5}
+
+class CountingUserRepository(InstrumentedUserRepository):
+    """読み書きしたドキュメント数を実行中のスレッドごとに数えるリポジトリ
+
+    フローの実行ごとにtake_countsで取り出す。
+    """
+
+    def __init__(self, repository):
+        self._local = threading.local()
+        super().__init__(repository, self._count)
+
+    def _count(self, method, seconds, reads, writes, failed):
+        self._local.reads = getattr(self._local, 'reads', 0) + reads
+        self._local.writes = getattr(self._local, 'writes', 0) + writes
+
+    def take_counts(self):
+        """このスレッドで数えた(読み込み数, 書き込み数)を取り出してリセットする"""
+        counts = (getattr(self._local, 'reads', 0), getattr(self._local, 'writes', 0))
+        self._local.reads = self._local.writes = 0
+        return counts
+
+def _load_photo(user, width):
+    photo_ref = select_photo(user, width)
+    if photo_ref:
+        load_blob(photo_ref)
+
+def flow_login(context, rng):
+    """ログイン画面: メールアドレスとパスワードで認証する"""
+    index = rng.randrange(context['user_count'])
+    user, error = authenticate_user(fixture_email(index), FIXTURE_PASSWORD)
+    if user is None:
+        raise RuntimeError(error)
+
+def flow_mypage(context, rng):
+    """マイページ: 自分の情報、写真、QRコード、友達一覧の1ページ目、友達候補、興味が似ている参加者（サムネイル付き）を表示する"""
+    user_id = rng.choice(context['user_ids'])
+    user = get_user_by_id(user_id)
+    _load_photo(user, 200)
+    generate_user_qr_code(user_id, APP_CONFIG["base_url"])
+    if user.get('friend_count'):
+        for friend in get_friends_page(user_id)['friends']:
+            _load_photo(friend, 64)
+        for suggestion in get_friend_suggestions(user_id):
+            _load_photo(suggestion, 64)
+    if user.get('interests'):
+        for similar_user in get_similar_interest_users(user_id):
+            _load_photo(similar_user, 64)
+
+def flow_public(context, rng):
+    """公開ページ: QRコードを読み取った参加者が相手のページを開く"""
+    user = get_user_by_id(rng.choice(context['user_ids']))
+    _load_photo(user, 200)
+    # 友達追加ボタンの表示のため、閲覧している参加者の友達かどうかを確認する
+    is_friend(rng.choice(context['user_ids']), user['user_id'])
+
+def flow_search(context, rng):
+    """参加者検索: キーワードまたはジャンルの条件で検索し、結果（サムネイル付き）を表示する"""
+    get_interest_counts()
+    if rng.random() < 0.5:
+        # 名前の一部を入力して検索する
+        name = rng.choice(FAMILY_NAMES + GIVEN_NAMES)
+        for found_user in search_users_by_keyword(name[:rng.randint(1, len(name))]):
+            _load_photo(found_user, 64)
+        return
+    any_of = rng.sample(INTEREST_OPTIONS, rng.randint(0, 2))
+    none_of = rng.sample([interest for interest in INTEREST_OPTIONS if interest not in any_of], rng.randint(0, 1))
+    page = search_users_by_interests(any_of, none_of=none_of)
+    if page['next_cursor'] and rng.random() < 0.3:
+        page = search_users_by_interests(any_of, none_of=none_of, cursor=page['next_cursor'])
+    for found_user in page['users']:
+        _load_photo(found_user, 64)
+
+def flow_admin(context, rng):
+    """管理者パネル: 権限の確認、接続状態、キャッシュ統計、ユーザー一覧の1ページ目を表示する"""
+    check_admin_status(context['user_ids'][0])
+    context['repository'].health_check()
+    get_user_cache_stats()
+    page = list_users_page(page_size=20, order_by=rng.choice(['created_at', 'display_name']),
+                           descending=rng.random() < 0.5)
+    if page['next_cursor'] and rng.random() < 0.5:
+        list_users_page(page_size=20, order_by=page['next_cursor']['order_by'],
+                        descending=page['next_cursor']['descending'], cursor=page['next_cursor'])
+
+FLOWS = {
+    'login': flow_login,
+    'mypage': flow_mypage,
+    'public': flow_public,
+    'search': flow_search,
+    'admin': flow_admin
+}
+
+def percentile(sorted_values, fraction):
+    """並べ替え済みの値からパーセンタイルを求める（最近傍順位法）"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def run_load(context, requests, concurrency, mix, seed):
+    """フローを比率に従って並行に実行し、フローごとの結果を集計する"""
+    rng = random.Random(seed)
+    flow_names = list(mix)
+    schedule = rng.choices(flow_names, [mix[name] for name in flow_names], k=requests)
+    counting_repository = context['repository']
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+
+    def run_one(args):
+        request_index, flow_name = args
+        flow_rng = random.Random(seed * 1000003 + request_index)
+        counting_repository.take_counts()
+        started = time.perf_counter()
+        try:
+            FLOWS[flow_name](context, flow_rng)
+            failed = False
+        except Exception:
+            failed = True
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        reads, writes = counting_repository.take_counts()
+        with lock:
+            if failed:
+                errors[flow_name] += 1
+            else:
+                samples[flow_name].append((elapsed_ms, reads, writes))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run_one, enumerate(schedule)))
+    wall_seconds = time.perf_counter() - started
+
+    results = {}
+    for flow_name in flow_names:
+        flow_samples = samples[flow_name]
+        latencies = sorted(sample[0] for sample in flow_samples)
+        count = len(flow_samples)
+        results[flow_name] = {
+            'count': count,
+            'errors': errors[flow_name],
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'reads_per_request': sum(sample[1] for sample in flow_samples) / count if count else 0.0,
+            'writes_per_request': sum(sample[2] for sample in flow_samples) / count if count else 0.0
+        }
+    return {'wall_seconds': wall_seconds, 'throughput': requests / wall_seconds, 'flows': results}
+
+def _create_backend(backend, directory):
+    if backend == 'sqlite':
+        return create_user_repository('sqlite', sqlite_path=os.path.join(directory, 'bench.db'))
+    if backend == 'firestore' and not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        raise SystemExit("Firestoreのベンチマークはエミュレータでのみ実行できます（FIRESTORE_EMULATOR_HOSTを設定してください）")
+    return create_user_repository(backend)
+
+def run_benchmark(backend, user_count, requests, concurrency, mix, seed, with_photos=True):
+    """指定した人数のデータを用意してベンチマークを実行する"""
+    with tempfile.TemporaryDirectory() as directory:
+        repository = CountingUserRepository(_create_backend(backend, directory))
+        if repository.count() != 0:
+            raise SystemExit("空のデータベースで実行してください")
+        override_user_repository(repository)
+        # 生成した写真も一時ディレクトリに保存し、設定されたBlobストアには書き込まない
+        override_blob_store(LocalBlobStore(os.path.join(directory, 'blobs')))
+        try:
+            seed_started = time.perf_counter()
+            user_ids = seed_repository(repository, user_count, seed, with_photos)
+            seed_seconds = time.perf_counter() - seed_started
+            # プロセス内のインデックスはアプリの起動後に1回だけ作成されるため、計測の前に作成しておく
+            friend_graph.get(repository)
+            interest_matrix.get(repository)
+            interest_index.get(repository)
+            text_index.get(repository)
+            repository.take_counts()
+            user_cache.clear()
+
+            context = {'repository': repository, 'user_ids': user_ids, 'user_count': user_count}
+            result = run_load(context, requests, concurrency, mix, seed)
+            result.update({
+                'backend': backend,
+                'users': user_count,
+                'seed_seconds': seed_seconds,
+                'user_cache': get_user_cache_stats()
+            })
+            return result
+        finally:
+            override_user_repository(None)
+            override_blob_store(None)
+            repository.close()
+
+def print_report(result):
+    print(f"\n== {result['backend']} / {result['users']}人 "
+          f"（準備 {result['seed_seconds']:.1f}秒、{result['throughput']:.1f}件/秒、"
+          f"ユーザーキャッシュのヒット率 {result['user_cache']['hit_ratio']:.1%}）")
+    print(f"{'フロー':<10}{'件数':>8}{'失敗':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'読込/件':>10}{'書込/件':>10}")
+    for flow_name, stats in result['flows'].items():
+        print(f"{flow_name:<10}{stats['count']:>8}{stats['errors']:>6}"
+              f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+              f"{stats['reads_per_request']:>10.1f}{stats['writes_per_request']:>10.1f}")
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, weight = item.split('=')
+        if name not in FLOWS:
+            raise argparse.ArgumentTypeError(f"不明なフローです: {name}")
+        mix[name] = float(weight)
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description="参加者の同時アクセスを想定した負荷ベンチマーク")
+    parser.add_argument("--backend", default="memory", choices=["memory", "sqlite", "firestore"])
+    parser.add_argument("--sizes", default="1000,10000", help="参加者数（カンマ区切り）")
+    parser.add_argument("--requests", type=int, default=2000, help="データサイズごとの実行回数")
+    parser.add_argument("--concurrency", type=int, default=16, help="同時に実行するフローの数")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="フローの比率（例: public=50,mypage=30,login=15,search=5,admin=5）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-photos", action="store_true", help="プロフィール写真を生成しない")
+    parser.add_argument("--json", help="結果をJSONで保存するファイル")
+    args = parser.parse_args()
+
+    results = []
+    for user_count in [int(size) for size in args.sizes.split(',')]:
+        result = run_benchmark(args.backend, user_count, args.requests, args.concurrency,
+                               args.mix, args.seed, not args.no_photos)
+        print_report(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
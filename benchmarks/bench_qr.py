@@ -0,0 +1,50 @@
+"""
+QRコード描画方式のマイクロベンチマーク
+python -m benchmarks.bench_qr で実行してください。
+"""
+
+import argparse
+import timeit
+from io import BytesIO
+import qrcode
+from qr_utils import QR_RENDERERS, build_qr_matrix, rasterize_qr_matrix, render_qr_image, render_qr_svg
+
+SAMPLE_URL = "https://mypage-001.streamlit.app/?user_id=0b2f3a3e-3b1c-4d67-9a55-6c1c1e4a9d2f"
+
+def measure(func, repeat, number):
+    """1回あたりの実行時間（ミリ秒）の最小値を返す"""
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="QRコード描画方式のベンチマーク")
+    parser.add_argument("--box-size", type=int, default=10)
+    parser.add_argument("--border", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'方式':<24}{'時間(ms)':>10}{'サイズ(bytes)':>16}")
+    # QRコードの生成処理を含む全体の時間
+    for renderer in QR_RENDERERS:
+        elapsed = measure(
+            lambda: render_qr_image(SAMPLE_URL, args.box_size, args.border, renderer=renderer),
+            args.repeat, args.number
+        )
+        output_size = len(render_qr_image(SAMPLE_URL, args.box_size, args.border, renderer=renderer))
+        print(f"{renderer:<24}{elapsed:>10.3f}{output_size:>16}")
+
+    # モジュール配置の計算を除いた描画部分だけの時間
+    matrix = build_qr_matrix(SAMPLE_URL, qrcode.constants.ERROR_CORRECT_L)
+    qr = qrcode.QRCode(box_size=args.box_size, border=args.border)
+    qr.add_data(SAMPLE_URL)
+    qr.make(fit=True)
+    draw_only = {
+        'pil（描画のみ）': lambda: qr.make_image().save(BytesIO(), format="PNG"),
+        'numpy（描画のみ）': lambda: rasterize_qr_matrix(matrix, args.box_size, args.border),
+        'svg（描画のみ）': lambda: render_qr_svg(matrix, args.border),
+    }
+    for name, func in draw_only.items():
+        print(f"{name:<20}{measure(func, args.repeat, args.number):>10.3f}")
+
+if __name__ == "__main__":
+    main()
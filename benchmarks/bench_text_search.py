@@ -0,0 +1,50 @@
+"""
+キーワード検索のインデックス（text_search.TextSearchIndex）のマイクロベンチマーク
+python -m benchmarks.bench_text_search --size 50000 で実行してください。
+"""
+
+import argparse
+import random
+import time
+from text_search import TextSearchIndex
+from benchmarks.bench_friend_graph import measure_ms
+from benchmarks.bench_load import percentile
+from benchmarks.fixtures import FAMILY_NAMES, GIVEN_NAMES, generate_users
+
+# 名前以外の検索語（プロフィール・メールアドレスに含まれ、多くの参加者に一致するもの）
+COMMON_QUERIES = ["よろしく", "お願いします", "技術 よろしく", "participant00012", "example.com"]
+
+def main():
+    parser = argparse.ArgumentParser(description="キーワード検索のインデックスのベンチマーク")
+    parser.add_argument("--size", type=int, default=50000, help="参加者数")
+    parser.add_argument("--repeat", type=int, default=50, help="検索語ごとの実行回数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    users = [
+        {'user_id': user['user_id'], 'display_name': user['display_name'], 'email': user['email'], 'profile': user['profile']}
+        for user in generate_users(args.size, args.seed)
+    ]
+    started = time.perf_counter()
+    index = TextSearchIndex.from_users(users)
+    build_seconds = time.perf_counter() - started
+    stats = index.stats()
+    print(f"{args.size}人: 作成 {build_seconds:.1f}秒、語 {stats['grams']}種類、{stats['bytes'] / 1024 / 1024:.1f}MB")
+
+    rng = random.Random(args.seed)
+    # 入力途中を想定して、名前の先頭の一部も検索する
+    name_queries = [name[:rng.randint(1, len(name))] for name in FAMILY_NAMES + GIVEN_NAMES]
+    print(f"{'検索語':<20}{'件数':>6}{'p50(ms)':>10}{'p99(ms)':>10}")
+    for query in name_queries + COMMON_QUERIES:
+        samples = measure_ms(index.search, [(query,)] * args.repeat)
+        print(f"{query:<20}{len(index.search(query)):>6}{percentile(samples, 0.5):>10.3f}{percentile(samples, 0.99):>10.3f}")
+
+    # プロフィール編集を想定した更新
+    update_ms = measure_ms(index.set_fields, [
+        (user['user_id'], {'profile': f"{user['profile']}（更新{number}）"})
+        for number, user in enumerate(rng.sample(users, 1000))
+    ])
+    print(f"更新 p50 {percentile(update_ms, 0.5):.3f}ms、p99 {percentile(update_ms, 0.99):.3f}ms")
+
+if __name__ == "__main__":
+    main()
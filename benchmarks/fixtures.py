@@ -0,0 +1,109 @@
+"""
+ベンチマーク用の参加者データ生成
+同じシード値からは常に同じデータが生成されます。
+"""
+
+import random
+import uuid
+from datetime import datetime, timedelta
+from io import BytesIO
+from PIL import Image, ImageDraw
+from config import INTEREST_OPTIONS
+from image_utils import store_profile_photo
+from password_utils import hash_password
+
+# 全参加者に共通のパスワード（ハッシュ計算は1回だけ行う）
+FIXTURE_PASSWORD = "benchmark-password"
+
+# 生成する写真の種類（同じ写真は内容アドレスで重複排除される）
+PHOTO_VARIANTS = 16
+
+# 興味のあるジャンルの選ばれやすさ（INTEREST_OPTIONSの順）
+INTEREST_WEIGHTS = [30, 25, 15, 12, 10, 8, 12, 3]
+
+FAMILY_NAMES = ["佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "小林", "加藤"]
+GIVEN_NAMES = ["翔太", "さくら", "大輔", "ゆい", "健一", "あおい", "拓也", "はるか", "ケン", "ミナ"]
+
+def fixture_email(index):
+    """index番目の参加者のメールアドレス"""
+    return f"participant{index:06d}@example.com"
+
+def _make_photo(rng):
+    """単色の背景に図形を描いた写真（JPEG）を作成する"""
+    image = Image.new("RGB", (640, 480), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(8):
+        x, y = rng.randrange(640), rng.randrange(480)
+        draw.ellipse([x, y, x + rng.randrange(40, 200), y + rng.randrange(40, 200)],
+                     fill=tuple(rng.randrange(256) for _ in range(3)))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+def create_photo_pool(seed, count=PHOTO_VARIANTS):
+    """写真を作成してBlobストアに保存し、ユーザードキュメント用のフィールドのリストを返す"""
+    rng = random.Random(seed)
+    return [store_profile_photo(_make_photo(rng)) for _ in range(count)]
+
+def _friend_degree(rng, user_count):
+    # 少数の参加者が多くの友達を持つ偏った分布にする
+    return min(user_count - 1, int(rng.paretovariate(1.3) * 2) - 1, 500)
+
+def generate_users(user_count, seed=0, photo_pool=None, password_hash=None, photo_ratio=0.7):
+    """参加者のユーザードキュメントを生成する
+
+    友達は、友達の多い参加者ほど選ばれやすくなるよう優先的選択で決める。
+    """
+    rng = random.Random(seed)
+    user_ids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(user_count)]
+    base_time = datetime(2025, 1, 1, 9, 0)
+
+    # 友達が選ばれるたびに候補に追加し、人気のある参加者ほど選ばれやすくする
+    popularity = list(range(user_count))
+    friends = [set() for _ in range(user_count)]
+    for index in range(user_count):
+        for _ in range(_friend_degree(rng, user_count)):
+            friend_index = rng.choice(popularity)
+            if friend_index != index:
+                friends[index].add(friend_index)
+                popularity.append(friend_index)
+
+    for index, user_id in enumerate(user_ids):
+        interest_count = rng.choice([1, 1, 2, 2, 2, 3, 4])
+        interests = list(dict.fromkeys(rng.choices(INTEREST_OPTIONS, INTEREST_WEIGHTS, k=interest_count)))
+        user_doc = {
+            'user_id': user_id,
+            'email': fixture_email(index),
+            'password_hash': password_hash,
+            'has_password': password_hash is not None,
+            'display_name': f"{rng.choice(FAMILY_NAMES)} {rng.choice(GIVEN_NAMES)}",
+            'profile': f"{'・'.join(interests)}が好きです。よろしくお願いします！",
+            'interests': interests,
+            'photo': '',
+            'photo_renditions': {},
+            'sns_accounts': {},
+            'friends': [user_ids[friend_index] for friend_index in sorted(friends[index])],
+            'is_admin': index == 0,
+            'created_at': base_time + timedelta(seconds=index * 7),
+            'updated_at': base_time + timedelta(seconds=index * 7)
+        }
+        if photo_pool and rng.random() < photo_ratio:
+            user_doc.update(rng.choice(photo_pool))
+        yield user_doc
+
+def seed_repository(repository, user_count, seed=0, with_photos=True):
+    """空のリポジトリに参加者を登録する
+
+    Returns:
+        登録したユーザーIDのリスト（index番目のメールアドレスはfixture_email(index)）
+    """
+    password_hash = hash_password(FIXTURE_PASSWORD)
+    photo_pool = create_photo_pool(seed) if with_photos else None
+    user_ids = []
+    for user_doc in generate_users(user_count, seed, photo_pool, password_hash):
+        repository.create(user_doc)
+        user_ids.append(user_doc['user_id'])
+    # 友達の配列は友達関係のドキュメントにまとめて変換する
+    for user_id in user_ids:
+        repository.migrate_friend_array(user_id)
+    return user_ids
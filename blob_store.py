@@ -0,0 +1,187 @@
+import base64
+import binascii
+import hashlib
+import os
+import streamlit as st
+from config import BLOB_STORE_CONFIG, initialize_firebase
+
+# ユーザードキュメントに保存する参照文字列の接頭辞
+BLOB_REF_PREFIX = "blob:"
+
+# Content-Typeと拡張子の対応
+CONTENT_TYPE_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/webp": "webp",
+    "image/gif": "gif"
+}
+EXTENSION_CONTENT_TYPES = {ext: content_type for content_type, ext in CONTENT_TYPE_EXTENSIONS.items()}
+
+def is_blob_ref(value):
+    """値がBlobストアへの参照かどうか判定する"""
+    return isinstance(value, str) and value.startswith(BLOB_REF_PREFIX)
+
+def make_blob_key(data, content_type):
+    """データの内容からキー（<sha256>.<拡張子>）を生成する"""
+    digest = hashlib.sha256(data).hexdigest()
+    extension = CONTENT_TYPE_EXTENSIONS.get(content_type, "bin")
+    return f"{digest}.{extension}"
+
+def blob_key_from_ref(ref):
+    """参照文字列からキーを取り出す"""
+    return ref[len(BLOB_REF_PREFIX):]
+
+def content_type_from_ref(ref):
+    """参照文字列からContent-Typeを推定する"""
+    extension = ref.rsplit(".", 1)[-1]
+    return EXTENSION_CONTENT_TYPES.get(extension, "application/octet-stream")
+
+def parse_data_uri(value):
+    """data URI文字列を(データ, Content-Type)に分解する（data URIでない場合はNone）"""
+    if not isinstance(value, str) or not value.startswith("data:"):
+        return None
+    
+    header, separator, payload = value.partition(",")
+    if not separator or not header.endswith(";base64"):
+        return None
+    
+    # 旧形式の"data:image/image/png;base64,..."も受け付ける
+    content_type = header[len("data:"):-len(";base64")]
+    if content_type.startswith("image/image/"):
+        content_type = content_type[len("image/"):]
+    
+    try:
+        return base64.b64decode(payload, validate=True), content_type
+    except (binascii.Error, ValueError):
+        return None
+
+class BlobStore:
+    """内容のハッシュをキーとするBlobストアの基底クラス"""
+
+    def put(self, data, content_type):
+        """データを保存して参照文字列を返す（同じ内容は一度だけ保存される）"""
+        key = make_blob_key(data, content_type)
+        if not self._exists(key):
+            self._write(key, data, content_type)
+        return BLOB_REF_PREFIX + key
+
+    def get(self, ref):
+        """参照文字列からデータを取得する（存在しない場合はNone）"""
+        return self._read(blob_key_from_ref(ref))
+
+    def delete(self, ref):
+        """参照先のデータを削除する"""
+        self._delete(blob_key_from_ref(ref))
+
+    def _exists(self, key):
+        raise NotImplementedError
+
+    def _write(self, key, data, content_type):
+        raise NotImplementedError
+
+    def _read(self, key):
+        raise NotImplementedError
+
+    def _delete(self, key):
+        raise NotImplementedError
+
+class LocalBlobStore(BlobStore):
+    """ローカルファイルシステムに保存するBlobストア"""
+
+    def __init__(self, root_path):
+        self.root_path = root_path
+
+    def _path(self, key):
+        # 1ディレクトリ内のファイル数が増えすぎないよう先頭2文字で分ける
+        return os.path.join(self.root_path, key[:2], key)
+
+    def _exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def _write(self, key, data, content_type):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 書き込み途中のファイルが読まれないよう一時ファイルから置き換える
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+class CloudStorageBlobStore(BlobStore):
+    """Cloud Storage（Firebase Storage）に保存するBlobストア"""
+
+    def __init__(self, bucket_name=None, prefix="blobs/"):
+        from firebase_admin import storage
+
+        if not initialize_firebase():
+            raise RuntimeError("Firebaseの初期化に失敗しました")
+        self.bucket = storage.bucket(bucket_name)
+        self.prefix = prefix
+
+    def _blob(self, key):
+        return self.bucket.blob(self.prefix + key)
+
+    def _exists(self, key):
+        return self._blob(key).exists()
+
+    def _write(self, key, data, content_type):
+        blob = self._blob(key)
+        # 内容が変わらないため長期間キャッシュさせる
+        blob.cache_control = "public, max-age=31536000, immutable"
+        blob.upload_from_string(data, content_type=content_type)
+
+    def _read(self, key):
+        from google.api_core.exceptions import NotFound
+
+        try:
+            return self._blob(key).download_as_bytes()
+        except NotFound:
+            return None
+
+    def _delete(self, key):
+        from google.api_core.exceptions import NotFound
+
+        try:
+            self._blob(key).delete()
+        except NotFound:
+            pass
+
+_store_override = None
+
+@st.cache_resource(show_spinner=False)
+def _get_configured_blob_store():
+    backend = BLOB_STORE_CONFIG["backend"]
+    if backend == "local":
+        return LocalBlobStore(BLOB_STORE_CONFIG["local_path"])
+    if backend == "gcs":
+        return CloudStorageBlobStore(BLOB_STORE_CONFIG["bucket"], BLOB_STORE_CONFIG["prefix"])
+    raise ValueError(f"不明なBlobストアです: {backend}")
+
+def get_blob_store():
+    """設定に応じたBlobストアを取得する"""
+    if _store_override is not None:
+        return _store_override
+    return _get_configured_blob_store()
+
+def override_blob_store(store):
+    """get_blob_storeが返すBlobストアを差し替える（ベンチマーク用、Noneで設定に戻す）"""
+    global _store_override
+    _store_override = store
+
+@st.cache_data(show_spinner=False, max_entries=512)
+def load_blob(ref):
+    """参照先のデータを取得する（内容は不変のためキャッシュする）"""
+    return get_blob_store().get(ref)
@@ -1,4 +1,7 @@
 import os
+import itertools
+import threading
+import time
 import streamlit as st
 from firebase_admin import credentials, firestore, auth, initialize_app
 import firebase_admin
@@ -42,28 +45,227 @@ APP_CONFIG = {
     "base_url": "https://mypage-001.streamlit.app"
 }
 
+# 興味のあるジャンルの選択肢
+INTEREST_OPTIONS = ["技術", "音楽", "スポーツ", "料理", "旅行", "アート", "ゲーム", "その他"]
+
+# ユーザー情報の保存先設定
+STORAGE_CONFIG = {
+    # "firestore"、"sqlite"または"memory"（メモリはベンチマーク・CI用で、プロセス終了時に消える）
+    "backend": os.getenv("STORAGE_BACKEND", "firestore"),
+    # SQLiteのデータベースファイル（会場内のオフライン運用向け）
+    "sqlite_path": os.getenv("SQLITE_PATH", "mypage.db"),
+    # SQLiteの接続プールの大きさ（WALモードのため読み込みは並行して実行できる）
+    "sqlite_pool_size": max(1, int(os.getenv("SQLITE_POOL_SIZE", "4")))
+}
+
+# Firestore接続プール設定
+FIRESTORE_CONFIG = {
+    # プロセス内で保持するクライアント（gRPCチャネル）の数
+    "pool_size": max(1, int(os.getenv("FIRESTORE_POOL_SIZE", "1"))),
+    # 起動時に接続を確立しておくかどうか
+    "warmup": os.getenv("FIRESTORE_WARMUP", "true").lower() == "true",
+    # ウォームアップ・ヘルスチェックに使うコレクション
+    "probe_collection": os.getenv("FIRESTORE_PROBE_COLLECTION", "users")
+}
+
+# プロフィール写真などのBlobストア設定
+BLOB_STORE_CONFIG = {
+    # "local"（ローカルファイル）または"gcs"（Cloud Storage）
+    "backend": os.getenv("BLOB_STORE_BACKEND", "local"),
+    "local_path": os.getenv("BLOB_STORE_PATH", "blob_data"),
+    "bucket": os.getenv("FIREBASE_STORAGE_BUCKET"),
+    "prefix": os.getenv("BLOB_STORE_PREFIX", "blobs/")
+}
+
+# アップロード画像の変換設定
+IMAGE_CONFIG = {
+    # "WEBP"または"JPEG"
+    "format": os.getenv("IMAGE_FORMAT", "WEBP").upper(),
+    "quality": int(os.getenv("IMAGE_QUALITY", "80"))
+}
+
+# QRコードキャッシュ設定
+QR_CACHE_CONFIG = {
+    "max_entries": int(os.getenv("QR_CACHE_SIZE", "1024")),
+    # 指定した場合は生成したQRコードをディスクにも保存する
+    "persist_dir": os.getenv("QR_CACHE_DIR") or None
+}
+
+# QRコードの描画方式（"numpy"、"pil"、"svg"）
+QR_RENDERER = os.getenv("QR_RENDERER", "numpy")
+
+# QRコードバッジシート設定
+BADGE_CONFIG = {
+    "dpi": int(os.getenv("BADGE_DPI", "200")),
+    "workers": int(os.getenv("BADGE_WORKERS", str(os.cpu_count() or 1))),
+    "font_path": os.getenv("BADGE_FONT_PATH")
+}
+
+# パスワードハッシュ設定
+PASSWORD_HASH_CONFIG = {
+    # 反復回数（0の場合はtarget_msに合わせて起動時に自動調整）
+    "iterations": int(os.getenv("PASSWORD_HASH_ITERATIONS", "0")),
+    "target_ms": float(os.getenv("PASSWORD_HASH_TARGET_MS", "100")),
+    # "thread"または"process"
+    "executor": os.getenv("PASSWORD_HASH_EXECUTOR", "thread"),
+    "workers": int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1))),
+    # 同時に受け付けるハッシュ計算の上限と、空きを待つ秒数
+    "max_pending": int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64")),
+    "queue_timeout": float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "10"))
+}
+
+# メールアドレス索引設定
+EMAIL_INDEX_CONFIG = {
+    # 索引に無いメールアドレスを従来のクエリでも検索するか（backfill_email_index.py実行後はfalseにできる）
+    "fallback": os.getenv("EMAIL_INDEX_FALLBACK", "true").lower() == "true"
+}
+
+# ユーザー情報の読み込みキャッシュ設定
+USER_CACHE_CONFIG = {
+    "max_entries": int(os.getenv("USER_CACHE_SIZE", "2048")),
+    "ttl_seconds": float(os.getenv("USER_CACHE_TTL", "30"))
+}
+
+# ユーザー情報のミラー設定（変更を購読して全員分をプロセス内に複製し、読み込みに使う。Firestoreのみ）
+MIRROR_CONFIG = {
+    # 有効の場合は起動時に購読を開始する（全員分を受け取るまでは保存先から直接読み込む）
+    "enabled": os.getenv("USER_MIRROR", "false").lower() == "true",
+    # このプロセスで書き込んだユーザーの変更を待つ最大秒数（待っている間はそのユーザーを直接読み込む）
+    "pending_seconds": float(os.getenv("USER_MIRROR_PENDING_SECONDS", "10")),
+    # 購読が切れてから再接続するまでの秒数
+    "reconnect_seconds": float(os.getenv("USER_MIRROR_RECONNECT_SECONDS", "30"))
+}
+
+# 友達候補（知り合いかも）の設定
+FRIEND_GRAPH_CONFIG = {
+    # マイページに表示する友達候補の数
+    "suggestions": int(os.getenv("FRIEND_SUGGESTIONS", "5")),
+    # 友達関係のインデックスを作り直す間隔（秒）。他のプロセスでの変更はこの間隔で反映される
+    "max_age_seconds": float(os.getenv("FRIEND_GRAPH_MAX_AGE", "600")),
+    # 変更された行がこの数を超えたらインデックスをまとめ直す
+    "compact_threshold": int(os.getenv("FRIEND_GRAPH_COMPACT_THRESHOLD", "1024"))
+}
+
+# 興味のあるジャンルが似ている参加者の設定
+INTEREST_MATCH_CONFIG = {
+    # マイページに表示する参加者の数
+    "suggestions": int(os.getenv("INTEREST_MATCHES", "5")),
+    # 類似度の計算方法（"jaccard"または"cosine"）
+    "metric": os.getenv("INTEREST_MATCH_METRIC", "jaccard"),
+    # ジャンルのインデックスを作り直す間隔（秒）
+    "max_age_seconds": float(os.getenv("INTEREST_INDEX_MAX_AGE", "600"))
+}
+
+# キーワード検索（表示名・メールアドレス・プロフィール）の設定
+TEXT_SEARCH_CONFIG = {
+    # 1回の検索で表示する最大件数
+    "max_results": int(os.getenv("TEXT_SEARCH_MAX_RESULTS", "50")),
+    # キーワード検索のインデックスを作り直す間隔（秒）
+    "max_age_seconds": float(os.getenv("TEXT_INDEX_MAX_AGE", "600"))
+}
+
+# 一括書き込みの設定
+BULK_WRITE_CONFIG = {
+    # Firestoreのバッチ（500件まで）を並行してコミットする数
+    "workers": int(os.getenv("BULK_WRITE_WORKERS", "4"))
+}
+
+# 参加者名簿（CSV）の一括登録の設定
+IMPORT_CONFIG = {
+    # 登録済みのメールアドレスの確認・ハッシュ計算・書き込みをまとめて行う行数
+    "batch_size": int(os.getenv("IMPORT_BATCH_SIZE", "500")),
+    # パスワードのハッシュ計算に使うプロセス数
+    "hash_workers": int(os.getenv("IMPORT_HASH_WORKERS", str(os.cpu_count() or 1)))
+}
+
+# 処理時間・読み書き回数の計測設定
+METRICS_CONFIG = {
+    # 無効の場合は計測用のラッパーを組み込まない（起動時に決まる）
+    "enabled": os.getenv("METRICS_ENABLED", "false").lower() == "true",
+    # 0以外を指定すると、Prometheus形式の値をこのポートの/metricsで公開する
+    "port": int(os.getenv("METRICS_PORT", "0"))
+}
+
 def initialize_firebase():
     """Firebaseを初期化する"""
     try:
+        # 既存のアプリが初期化されていれば設定の再構築は不要
+        if firebase_admin._apps:
+            return True
+        
         # Firebase設定を取得
         firebase_config = get_firebase_config()
         if not firebase_config:
             st.error("❌ Firebase設定の取得に失敗しました。必須の環境変数が設定されていません。")
             return False
         
-        # 既存のアプリが初期化されているかチェック
-        if not firebase_admin._apps:
-            cred = credentials.Certificate(firebase_config)
-            initialize_app(cred)
+        cred = credentials.Certificate(firebase_config)
+        initialize_app(cred)
         return True
     except Exception as e:
         st.error(f"Firebase初期化エラー: {e}")
         return False
 
+class FirestoreClientPool:
+    """プロセス内で共有するFirestoreクライアントのプール
+    
+    クライアントごとに独立したgRPCチャネルを持ち、ラウンドロビンで払い出す。
+    """
+    
+    def __init__(self, app, pool_size=1):
+        app_credentials = app.credential.get_credential()
+        self._clients = [
+            firestore.Client(credentials=app_credentials, project=app.project_id)
+            for _ in range(pool_size)
+        ]
+        self._cycle = itertools.cycle(self._clients)
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._clients)
+    
+    def get(self):
+        """次のクライアントを取得する"""
+        with self._lock:
+            return next(self._cycle)
+    
+    def probe(self, client):
+        """軽量なクエリで接続を確認し、所要時間（ミリ秒）を返す"""
+        started = time.perf_counter()
+        # フィールドを射影しないため、ドキュメント名だけが返る
+        query = client.collection(FIRESTORE_CONFIG["probe_collection"]).select([]).limit(1)
+        list(query.stream())
+        return (time.perf_counter() - started) * 1000
+    
+    def warm_up(self):
+        """すべてのクライアントの接続を事前に確立する"""
+        return [self.probe(client) for client in self._clients]
+
+@st.cache_resource(show_spinner=False)
+def get_firestore_pool():
+    """プロセス全体で共有するFirestoreクライアントプールを取得する"""
+    # 失敗時は例外を送出し、結果がキャッシュされないようにする
+    if not initialize_firebase():
+        raise RuntimeError("Firebaseの初期化に失敗しました")
+    
+    pool = FirestoreClientPool(firebase_admin.get_app(), FIRESTORE_CONFIG["pool_size"])
+    if FIRESTORE_CONFIG["warmup"]:
+        pool.warm_up()
+    return pool
+
 def get_firestore_client():
     """Firestoreクライアントを取得する"""
     try:
-        return firestore.client()
+        return get_firestore_pool().get()
     except Exception as e:
         st.error(f"Firestore接続エラー: {e}")
         return None
+
+def check_firestore_health():
+    """Firestore接続のヘルスチェックを行う"""
+    try:
+        pool = get_firestore_pool()
+        latency_ms = pool.probe(pool.get())
+        return {'ok': True, 'latency_ms': latency_ms, 'pool_size': len(pool), 'error': None}
+    except Exception as e:
+        return {'ok': False, 'latency_ms': None, 'pool_size': 0, 'error': str(e)}
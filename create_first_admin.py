@@ -4,7 +4,7 @@
 """
 
 import streamlit as st
-from config import initialize_firebase
+from config import initialize_firebase, INTEREST_OPTIONS, STORAGE_CONFIG
 from database import create_admin_user
 
 def create_first_admin():
@@ -12,8 +12,8 @@ def create_first_admin():
     st.title("最初の管理者ユーザー作成")
     st.warning("⚠️ このスクリプトは最初の管理者ユーザーを作成するためにのみ使用してください。")
     
-    # Firebase初期化
-    if not initialize_firebase():
+    # Firebase初期化（Firestoreを使う場合のみ）
+    if STORAGE_CONFIG["backend"] == "firestore" and not initialize_firebase():
         st.error("Firebaseの初期化に失敗しました。")
         return
     
@@ -27,7 +27,7 @@ def create_first_admin():
         profile = st.text_area("プロフィール", placeholder="システムの管理者です")
         interests = st.multiselect(
             "興味のあるジャンル",
-            ["技術", "音楽", "スポーツ", "料理", "旅行", "アート", "ゲーム", "その他"]
+            INTEREST_OPTIONS
         )
         
         st.info("注意: このスクリプトは一度だけ実行してください。")
@@ -1,113 +1,202 @@
 import streamlit as st
-from firebase_admin import firestore
-from config import get_firestore_client
+from config import FRIEND_GRAPH_CONFIG, INTEREST_MATCH_CONFIG, INTEREST_OPTIONS, TEXT_SEARCH_CONFIG, USER_CACHE_CONFIG
+from blob_store import get_blob_store, parse_data_uri
+from friend_graph import FriendGraph
+from interest_index import InterestIndex
+from interest_matching import InterestMatrix
+from local_index import LocalIndex
+from image_utils import store_profile_photo
+from metrics import instrumented
+from password_utils import hash_password, verify_password, needs_rehash
+from storage import EmailAlreadyRegistered, UserNotFound, get_user_repository
+from storage.mirror import MirroredUserRepository
+from text_search import SEARCH_FIELDS, TextSearchIndex
+from user_cache import TTLCache
 import uuid
 from datetime import datetime
-import hashlib
-import os
-
-def hash_password(password):
-    """パスワードをハッシュ化する"""
-    salt = os.urandom(32)
-    hash_obj = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
-    return salt + hash_obj
-
-def verify_password(password, stored_hash):
-    """パスワードを検証する"""
-    try:
-        salt = stored_hash[:32]
-        stored_hash = stored_hash[32:]
-        hash_obj = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
-        return hash_obj == stored_hash
-    except:
-        return False
 
+# 友達一覧などの一覧表示で取得するフィールド
+USER_SUMMARY_FIELDS = ['user_id', 'display_name', 'email', 'photo_renditions.thumb']
+
+# get_user_by_idの読み込みキャッシュ（ユーザーを更新・削除する関数で無効化する）
+user_cache = TTLCache(USER_CACHE_CONFIG["max_entries"], USER_CACHE_CONFIG["ttl_seconds"])
+
+# 管理者用ユーザー一覧で取得するフィールド（写真やパスワードハッシュは含めない）
+USER_LIST_FIELDS = ['user_id', 'email', 'display_name', 'is_admin', 'interests', 'has_password', 'created_at']
+
+# ユーザー一覧で並び替えに使用できるフィールド
+USER_LIST_ORDER_FIELDS = ['created_at', 'display_name']
+
+# ユーザー一覧の1ページあたりの件数
+DEFAULT_PAGE_SIZE = 20
+
+# 友達一覧の1ページあたりの件数
+FRIEND_PAGE_SIZE = 20
+
+# 管理者用の一括操作
+BULK_ADMIN_ACTIONS = ['promote', 'demote', 'reset_password', 'delete']
+
+# 友達候補の計算に使う友達関係のインデックス（友達を追加・削除する関数で更新する）
+friend_graph = LocalIndex(
+    'friend-graph',
+    lambda repository: FriendGraph.from_edges(repository.iter_friend_edges(), FRIEND_GRAPH_CONFIG["compact_threshold"]),
+    FRIEND_GRAPH_CONFIG["max_age_seconds"]
+)
+
+# 興味のあるジャンルが似ている参加者の計算に使うビット行列（ユーザーを作成・更新・削除する関数で更新する）
+interest_matrix = LocalIndex(
+    'interest-matrix',
+    lambda repository: InterestMatrix.from_users(repository.iter_all(['user_id', 'interests']), INTEREST_OPTIONS),
+    INTEREST_MATCH_CONFIG["max_age_seconds"]
+)
+
+# 興味のあるジャンルでの検索に使う転置インデックス（ユーザーを作成・更新・削除する関数で更新する）
+interest_index = LocalIndex(
+    'interest-index',
+    lambda repository: InterestIndex.from_users(repository.iter_all(['user_id', 'interests', 'created_at'])),
+    INTEREST_MATCH_CONFIG["max_age_seconds"]
+)
+
+# キーワード検索に使う文字n-gramの転置インデックス（ユーザーを作成・更新・削除する関数で更新する）
+text_index = LocalIndex(
+    'text-index',
+    lambda repository: TextSearchIndex.from_users(repository.iter_all(['user_id', *SEARCH_FIELDS])),
+    TEXT_SEARCH_CONFIG["max_age_seconds"]
+)
+
+def _update_local_indexes(user_id, update_data):
+    """ユーザーの作成・更新をプロセス内のインデックスに反映する"""
+    if 'interests' in update_data:
+        interest_matrix.apply('set_interests', user_id, update_data['interests'])
+        interest_index.apply('set_user', user_id, update_data['interests'], update_data.get('created_at'))
+    if any(field in update_data for field in SEARCH_FIELDS):
+        text_index.apply('set_fields', user_id, update_data)
+
+def _remove_from_local_indexes(user_id):
+    """ユーザーの削除をプロセス内のインデックスに反映する"""
+    friend_graph.apply('remove_user', user_id)
+    interest_matrix.apply('remove_user', user_id)
+    interest_index.apply('remove_user', user_id)
+    text_index.apply('remove_user', user_id)
+
+def _get_indexed_users(user_ids, fields=None):
+    """プロセス内のインデックスが返したユーザーを一括取得する
+    
+    保存先に存在しないと分かったユーザー（他のプロセスで削除されたユーザー）は以降の結果から除くため、
+    インデックスからも削除する。読み込みに失敗した場合は例外をそのまま送出し、インデックスは変更しない。
+    
+    Returns:
+        (ユーザーIDをキーとする辞書, 見つからなかったユーザーIDのリスト)
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return {}, []
+    users = get_user_repository().get_many(user_ids, fields if fields is not None else USER_SUMMARY_FIELDS)
+    missing_ids = [user_id for user_id in user_ids if user_id not in users]
+    for missing_id in missing_ids:
+        _remove_from_local_indexes(missing_id)
+    return users, missing_ids
+
+def new_user_document(user_data, password_hash, is_admin=False):
+    """新規ユーザーのドキュメントを準備する（保存はしない）"""
+    # ユーザーIDを生成
+    user_id = str(uuid.uuid4())
+    
+    return {
+        'user_id': user_id,
+        'email': user_data['email'].strip(),
+        'password_hash': password_hash,  # ハッシュ化されたパスワード
+        'has_password': True,  # 一覧表示用にパスワード設定状態を保持
+        'display_name': user_data['display_name'],
+        'profile': user_data.get('profile', ''),
+        'interests': user_data.get('interests', []),
+        'photo': user_data.get('photo', ''),  # photoフィールドとして保存
+        'photo_renditions': user_data.get('photo_renditions', {}),  # サイズ別の写真
+        'sns_accounts': user_data.get('sns_accounts', {}),
+        'friend_count': 0,  # 友達の数（友達の追加・削除と同時に更新される）
+        'is_admin': is_admin,
+        'created_at': datetime.now(),
+        'updated_at': datetime.now()
+    }
+
+def _create_user_document(user_data, is_admin):
+    """ユーザードキュメントを作成する
+    
+    Returns:
+        ユーザーID（メールアドレスが登録済みの場合はEmailAlreadyRegisteredを送出する）
+    """
+    # パスワードをハッシュ化
+    user_doc = new_user_document(user_data, hash_password(user_data['password']), is_admin)
+    
+    # メールアドレスの予約と合わせて保存
+    get_user_repository().create(user_doc)
+    _update_local_indexes(user_doc['user_id'], user_doc)
+    return user_doc['user_id']
+
+@instrumented
 def create_user(user_data):
     """新規ユーザーを作成する"""
     try:
-        db = get_firestore_client()
-        if not db:
-            return None, "データベース接続エラー"
-        
-        # メールアドレスの重複チェック
-        existing_user = get_user_by_email(user_data['email'])
-        if existing_user:
-            return None, "このメールアドレスは既に登録されています"
-        
-        # ユーザーIDを生成
-        user_id = str(uuid.uuid4())
-        
-        # パスワードをハッシュ化
-        password_hash = hash_password(user_data['password'])
-        
-        # ユーザーデータを準備
-        user_doc = {
-            'user_id': user_id,
-            'email': user_data['email'],
-            'password_hash': password_hash,  # ハッシュ化されたパスワード
-            'display_name': user_data['display_name'],
-            'profile': user_data.get('profile', ''),
-            'interests': user_data.get('interests', []),
-            'photo': user_data.get('photo', ''),  # photoフィールドとして保存
-            'sns_accounts': user_data.get('sns_accounts', {}),
-            'is_admin': False,
-            'created_at': datetime.now(),
-            'updated_at': datetime.now()
-        }
-        
-        # Firestoreに保存
-        db.collection('users').document(user_id).set(user_doc)
-        return user_id, None
-        
+        return _create_user_document(user_data, is_admin=False), None
+    except EmailAlreadyRegistered:
+        return None, "このメールアドレスは既に登録されています"
     except Exception as e:
         return None, f"ユーザー作成エラー: {e}"
 
+@instrumented
 def create_admin_user(user_data):
     """管理者ユーザーを作成する"""
     try:
-        db = get_firestore_client()
-        if not db:
-            return None, "データベース接続エラー"
-        
-        # メールアドレスの重複チェック
-        existing_user = get_user_by_email(user_data['email'])
-        if existing_user:
-            return None, "このメールアドレスは既に登録されています"
-        
-        # ユーザーIDを生成
-        user_id = str(uuid.uuid4())
-        
-        # パスワードをハッシュ化
-        password_hash = hash_password(user_data['password'])
-        
-        # 管理者ユーザーデータを準備
-        user_doc = {
-            'user_id': user_id,
-            'email': user_data['email'],
-            'password_hash': password_hash,  # ハッシュ化されたパスワード
-            'display_name': user_data['display_name'],
-            'profile': user_data.get('profile', ''),
-            'interests': user_data.get('interests', []),
-            'photo': user_data.get('photo', ''),  # photoフィールドとして保存
-            'sns_accounts': user_data.get('sns_accounts', {}),
-            'is_admin': True,  # 管理者フラグをTrueに設定
-            'created_at': datetime.now(),
-            'updated_at': datetime.now()
-        }
+        return _create_user_document(user_data, is_admin=True), None
+    except EmailAlreadyRegistered:
+        return None, "このメールアドレスは既に登録されています"
+    except Exception as e:
+        return None, f"管理者ユーザー作成エラー: {e}"
+
+@instrumented
+def find_registered_emails(emails):
+    """登録済みのメールアドレスを調べる（一括登録用）
+    
+    Returns:
+        (正規化したメールアドレスのset, エラーメッセージ)
+    """
+    try:
+        return get_user_repository().find_registered_emails(emails), None
         
-        # Firestoreに保存
-        db.collection('users').document(user_id).set(user_doc)
-        return user_id, None
+    except Exception as e:
+        return set(), f"メールアドレス確認エラー: {e}"
+
+@instrumented
+def create_users(user_docs):
+    """new_user_documentで準備したユーザーをまとめて保存する（一括登録用）
+    
+    Returns:
+        ({ユーザーID: 失敗した場合はエラーメッセージ、成功した場合はNone}, エラーメッセージ)
+        途中でエラーになった場合は、それまでに保存したユーザーの結果を返す
+    """
+    user_docs_by_id = {user_doc['user_id']: user_doc for user_doc in user_docs}
+    results = {}
+    try:
+        for batch_results in get_user_repository().create_each(user_docs):
+            for user_id, error in batch_results.items():
+                results[user_id] = _bulk_error_message(error)
+                if error is None:
+                    _update_local_indexes(user_id, user_docs_by_id[user_id])
+        return results, None
         
     except Exception as e:
-        return None, f"管理者ユーザー作成エラー: {e}"
+        return results, f"ユーザー一括作成エラー: {e}"
 
+@instrumented
 def authenticate_user(email, password):
     """ユーザー認証を行う"""
     try:
         user = get_user_by_email(email)
         if user and user.get('password_hash'):
             if verify_password(password, user['password_hash']):
+                # ハッシュの形式や強度が古い場合は、平文が分かるこの時点で作り直す
+                if needs_rehash(user['password_hash']):
+                    update_user_password(user['user_id'], password)
                 return user, None
             else:
                 return None, "パスワードが正しくありません"
@@ -116,364 +205,717 @@ def authenticate_user(email, password):
     except Exception as e:
         return None, f"認証エラー: {e}"
 
+@instrumented
 def promote_to_admin(user_id):
     """既存のユーザーを管理者に昇格させる"""
     try:
-        db = get_firestore_client()
-        if not db:
-            return False, "データベース接続エラー"
-        
         # ユーザーを管理者に昇格
-        db.collection('users').document(user_id).update({
+        get_user_repository().update(user_id, {
             'is_admin': True,
             'updated_at': datetime.now()
         })
+        user_cache.invalidate(user_id)
         return True, None
         
     except Exception as e:
         return False, f"管理者昇格エラー: {e}"
 
+@instrumented
 def demote_from_admin(user_id):
     """管理者の権限を削除する"""
     try:
-        db = get_firestore_client()
-        if not db:
-            return False, "データベース接続エラー"
-        
         # 管理者権限を削除
-        db.collection('users').document(user_id).update({
+        get_user_repository().update(user_id, {
             'is_admin': False,
             'updated_at': datetime.now()
         })
+        user_cache.invalidate(user_id)
         return True, None
         
     except Exception as e:
         return False, f"管理者権限削除エラー: {e}"
 
+@instrumented
 def get_user_by_id(user_id):
     """ユーザーIDでユーザー情報を取得する"""
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    
     try:
-        db = get_firestore_client()
-        if not db:
-            return None
-        
-        user_doc = db.collection('users').document(user_id).get()
-        if user_doc.exists:
-            return user_doc.to_dict()
-        return None
+        user = get_user_repository().get(user_id)
+        if user is not None:
+            user_cache.put(user_id, user)
+        return user
         
     except Exception as e:
         st.error(f"ユーザー取得エラー: {e}")
         return None
 
+def get_user_cache_stats():
+    """ユーザーキャッシュの統計情報を取得する"""
+    return user_cache.stats()
+
+def get_user_mirror_stats():
+    """ユーザー情報のミラーの統計情報を取得する（ミラーを使用していない場合はNone）"""
+    repository = get_user_repository()
+    if not isinstance(repository, MirroredUserRepository):
+        return None
+    return repository.stats()
+
+@instrumented
+def get_users_by_ids(user_ids, fields=None):
+    """複数のユーザーIDでユーザー情報を一括取得する
+    
+    Returns:
+        (ユーザーIDをキーとする辞書, 見つからなかったユーザーIDのリスト)
+        読み込みに失敗した場合は({}, [])を返し、退会したユーザーとは扱わない
+    """
+    # 重複を除きつつ順序を保持
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return {}, []
+    
+    try:
+        field_paths = fields if fields is not None else USER_SUMMARY_FIELDS
+        users = get_user_repository().get_many(user_ids, field_paths)
+        missing_ids = [user_id for user_id in user_ids if user_id not in users]
+        return users, missing_ids
+        
+    except Exception as e:
+        st.error(f"ユーザー一括取得エラー: {e}")
+        return {}, []
+
+@instrumented
 def get_user_by_email(email):
-    """メールアドレスでユーザー情報を取得する"""
+    """メールアドレスでユーザー情報を取得する（メールアドレス索引で求めたIDで、get_user_by_idのキャッシュを通して読み込む）"""
     try:
-        db = get_firestore_client()
-        if not db:
+        repository = get_user_repository()
+        user_id = repository.get_user_id_by_email(email)
+        if not user_id:
             return None
-        
-        users = db.collection('users').where('email', '==', email).limit(1).stream()
-        for user in users:
-            return user.to_dict()
-        return None
+        user = get_user_by_id(user_id)
+        # 索引が削除済みのユーザーを指している場合は、バックエンドの検索（旧データ用の検索を含む）に任せる
+        return user if user else repository.get_by_email(email)
         
     except Exception as e:
         st.error(f"ユーザー取得エラー: {e}")
         return None
 
+@instrumented
+def backfill_email_index():
+    """既存ユーザーのメールアドレス索引を作成する（管理者用）
+    
+    Returns:
+        (作成した索引の数, 重複していたユーザーIDのリスト, エラーメッセージ)
+    """
+    try:
+        created_count, duplicate_ids = get_user_repository().backfill_email_index()
+        return created_count, duplicate_ids, None
+        
+    except Exception as e:
+        return 0, [], f"メールアドレス索引作成エラー: {e}"
+
+@instrumented
 def update_user(user_id, update_data):
     """ユーザー情報を更新する"""
     try:
-        db = get_firestore_client()
-        if not db:
-            return False, "データベース接続エラー"
-        
         # 更新日時を追加
         update_data['updated_at'] = datetime.now()
         
-        # Firestoreを更新
-        db.collection('users').document(user_id).update(update_data)
+        # メールアドレスが含まれる場合は索引も付け替えられる
+        get_user_repository().update(user_id, update_data)
+        user_cache.invalidate(user_id)
+        _update_local_indexes(user_id, update_data)
         return True, None
         
+    except EmailAlreadyRegistered:
+        return False, "このメールアドレスは既に登録されています"
     except Exception as e:
         return False, f"ユーザー更新エラー: {e}"
 
+@instrumented
 def update_user_password(user_id, new_password):
     """ユーザーのパスワードを更新する"""
     try:
-        db = get_firestore_client()
-        if not db:
-            return False, "データベース接続エラー"
-        
         # 新しいパスワードをハッシュ化
         password_hash = hash_password(new_password)
         
         # パスワードを更新
-        db.collection('users').document(user_id).update({
+        get_user_repository().update(user_id, {
             'password_hash': password_hash,
+            'has_password': True,
             'updated_at': datetime.now()
         })
+        user_cache.invalidate(user_id)
         return True, None
         
     except Exception as e:
         return False, f"パスワード更新エラー: {e}"
 
+@instrumented
 def reset_user_password(user_id, new_password):
     """ユーザーのパスワードをリセットする（管理者用）"""
     try:
-        # デバッグ情報
-        print(f"=== パスワードリセット開始 ===")
-        print(f"ユーザーID: {user_id}")
-        print(f"パスワード長: {len(new_password)}文字")
-        print(f"タイムスタンプ: {datetime.now()}")
-        
-        # データベース接続
-        print("📡 Firebase接続中...")
-        db = get_firestore_client()
-        if not db:
-            print("❌ データベース接続エラー")
-            return False, "データベース接続エラー"
-        
-        print("✅ データベース接続成功")
-        
-        # ユーザーの存在確認
-        print(f"🔍 ユーザー存在確認中...")
-        user_doc = db.collection('users').document(user_id).get()
-        if not user_doc.exists:
-            print(f"❌ ユーザーが見つかりません: {user_id}")
-            return False, f"ユーザーID {user_id} が見つかりません"
-        
-        print("✅ ユーザー存在確認完了")
-        
-        # 現在のユーザー情報を表示
-        current_user = user_doc.to_dict()
-        print(f"現在のユーザー情報: {current_user.get('display_name', 'Unknown')} ({current_user.get('email', 'No email')})")
-        
         # 新しいパスワードをハッシュ化
-        print("🔐 パスワードハッシュ化中...")
-        print(f"入力パスワード: {'*' * len(new_password)} ({len(new_password)}文字)")
-        print(f"入力パスワードの型: {type(new_password)}")
-        
-        try:
-            password_hash = hash_password(new_password)
-            print("✅ パスワードハッシュ化完了")
-            print(f"ハッシュ長: {len(password_hash)} bytes")
-            print(f"ハッシュの型: {type(password_hash)}")
-            print(f"ハッシュ内容: {password_hash[:50]}...")
-            
-            # ハッシュ化の検証
-            if isinstance(password_hash, bytes):
-                print("✅ ハッシュはbytes型で正常です")
-            else:
-                print(f"⚠️ ハッシュの型が予期しない: {type(password_hash)}")
-                
-        except Exception as hash_error:
-            print(f"❌ パスワードハッシュ化でエラー: {hash_error}")
-            print(f"エラータイプ: {type(hash_error).__name__}")
-            import traceback
-            print(f"ハッシュ化エラーのスタックトレース: {traceback.format_exc()}")
-            raise hash_error
+        password_hash = hash_password(new_password)
         
         # パスワードをリセット
-        update_data = {
+        get_user_repository().update(user_id, {
             'password_hash': password_hash,
+            'has_password': True,
             'updated_at': datetime.now()
-        }
-        
-        print(f"📝 更新データ準備完了:")
-        print(f"  password_hash: {type(password_hash)} = {len(password_hash)} bytes")
-        print(f"  updated_at: {type(datetime.now())} = {datetime.now()}")
-        print(f"  更新データ全体: {update_data}")
-        
-        # 更新データの検証
-        if 'password_hash' in update_data and update_data['password_hash'] is not None:
-            print("✅ 更新データのpassword_hashが正常に設定されています")
-        else:
-            print("❌ 更新データのpassword_hashが正しく設定されていません")
-            print(f"password_hashの値: {update_data.get('password_hash')}")
-            print(f"password_hashの型: {type(update_data.get('password_hash'))}")
-        
-        # データベース更新
-        print("💾 データベース更新中...")
-        print(f"更新対象ドキュメント: users/{user_id}")
-        print(f"更新データ: {update_data}")
-        
-        # 更新前のデータを確認
-        print("🔍 更新前のデータ確認...")
-        before_doc = db.collection('users').document(user_id).get()
-        if before_doc.exists:
-            before_data = before_doc.to_dict()
-            print(f"更新前のパスワードハッシュ: {before_data.get('password_hash', 'None')}")
-        else:
-            print("❌ 更新前のドキュメントが見つかりません")
-        
-        # 実際の更新処理
-        print("🚀 実際の更新処理を開始...")
-        try:
-            update_result = db.collection('users').document(user_id).update(update_data)
-            print(f"更新結果: {update_result}")
-            print(f"更新結果の型: {type(update_result)}")
-            print("✅ データベース更新完了")
-        except Exception as update_error:
-            print(f"❌ 更新処理でエラーが発生: {update_error}")
-            print(f"エラータイプ: {type(update_error).__name__}")
-            import traceback
-            print(f"更新エラーのスタックトレース: {traceback.format_exc()}")
-            raise update_error
-        
-        # 更新後の確認
-        print("🔍 更新確認中...")
-        print("少し待ってから確認を開始します...")
-        import time
-        time.sleep(1)  # 1秒待機
-        
-        updated_doc = db.collection('users').document(user_id).get()
-        if updated_doc.exists:
-            updated_user = updated_doc.to_dict()
-            print(f"更新後のユーザー情報: {updated_user.get('display_name', 'Unknown')}")
-            print(f"更新後のパスワードハッシュ存在: {'password_hash' in updated_user}")
-            
-            if 'password_hash' in updated_user:
-                print(f"更新後のパスワードハッシュ長: {len(updated_user['password_hash'])} bytes")
-                print(f"更新後のパスワードハッシュ内容: {updated_user['password_hash'][:50]}...")
-                
-                if updated_user['password_hash'] == password_hash:
-                    print("✅ パスワード更新確認完了 - ハッシュが一致")
-                else:
-                    print("⚠️ パスワード更新確認で不一致")
-                    print(f"期待されるハッシュ: {password_hash[:50]}...")
-                    print(f"実際のハッシュ: {updated_user['password_hash'][:50]}...")
-                    
-                    # 不一致の詳細調査
-                    print("🔍 不一致の詳細調査:")
-                    print(f"期待されるハッシュの型: {type(password_hash)}")
-                    print(f"実際のハッシュの型: {type(updated_user['password_hash'])}")
-                    print(f"期待されるハッシュの長さ: {len(password_hash)}")
-                    print(f"実際のハッシュの長さ: {len(updated_user['password_hash'])}")
-            else:
-                print("❌ 更新後のパスワードハッシュが存在しません")
-                print("更新後のユーザーデータの全フィールド:")
-                for key, value in updated_user.items():
-                    print(f"  {key}: {type(value)} = {value}")
-        else:
-            print("❌ 更新後のドキュメントが見つかりません")
-            print("ドキュメントの存在確認を再試行...")
-            # 再試行
-            time.sleep(2)
-            retry_doc = db.collection('users').document(user_id).get()
-            if retry_doc.exists:
-                print("✅ 再試行でドキュメントが見つかりました")
-            else:
-                print("❌ 再試行でもドキュメントが見つかりません")
-        
-        print("=== パスワードリセット完了 ===")
+        })
+        user_cache.invalidate(user_id)
         return True, None
         
+    except UserNotFound:
+        return False, f"ユーザーID {user_id} が見つかりません"
     except Exception as e:
-        print(f"=== パスワードリセットエラー ===")
-        print(f"エラータイプ: {type(e).__name__}")
-        print(f"エラーメッセージ: {str(e)}")
-        print(f"エラー詳細: {e}")
-        import traceback
-        print(f"スタックトレース: {traceback.format_exc()}")
         return False, f"パスワードリセットエラー: {e}"
 
+def _has_password(user_data):
+    """ユーザーデータにパスワードハッシュが設定されているか判定する"""
+    return user_data.get('password_hash') is not None
+
+@instrumented
 def check_user_has_password(user_id):
     """ユーザーがパスワードを持っているかチェックする"""
     try:
-        print(f"=== パスワード確認開始 ===")
-        print(f"ユーザーID: {user_id}")
-        
-        db = get_firestore_client()
-        if not db:
-            print("❌ データベース接続エラー")
+        user_data = get_user_repository().get(user_id, ['has_password', 'password_hash'])
+        if user_data is None:
             return False
         
-        print("✅ データベース接続成功")
+        if 'has_password' in user_data:
+            return bool(user_data['has_password'])
+        return _has_password(user_data)
         
-        user_doc = db.collection('users').document(user_id).get()
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            has_password = 'password_hash' in user_data and user_data['password_hash'] is not None
-            
-            print(f"ユーザー情報: {user_data.get('display_name', 'Unknown')}")
-            print(f"パスワードハッシュ存在: {has_password}")
-            if has_password:
-                print(f"パスワードハッシュ長: {len(user_data['password_hash'])} bytes")
-                print(f"パスワードハッシュ内容: {user_data['password_hash'][:50]}...")
-            
-            print("=== パスワード確認完了 ===")
-            return has_password
-        else:
-            print("❌ ユーザーが見つかりません")
+    except Exception as e:
+        st.error(f"パスワード確認エラー: {e}")
         return False
+
+@instrumented
+def backfill_has_password_flags():
+    """has_passwordフラグが未設定のユーザーにフラグを設定する（管理者用）
+    
+    Returns:
+        (更新したユーザー数, エラーメッセージ)
+    """
+    try:
+        repository = get_user_repository()
+        updates = []
+        for user_data in repository.iter_all(['user_id', 'has_password', 'password_hash']):
+            if 'has_password' not in user_data:
+                updates.append((user_data['user_id'], {'has_password': _has_password(user_data)}))
+        
+        # 更新はリポジトリがバッチに分けて書き込む
+        repository.update_many(updates)
+        updated_count = len(updates)
+        user_cache.clear()
+        return updated_count, None
         
     except Exception as e:
-        print(f"=== パスワード確認エラー ===")
-        print(f"エラータイプ: {type(e).__name__}")
-        print(f"エラーメッセージ: {str(e)}")
-        import traceback
-        print(f"スタックトレース: {traceback.format_exc()}")
-        return False
+        return 0, f"パスワード状態更新エラー: {e}"
 
+@instrumented
 def get_all_users():
-    """すべてのユーザーを取得する（管理者用）"""
+    """すべてのユーザーを写真を含めて取得する（管理者用）
+    
+    全員分をメモリに読み込むため、一覧の表示やエクスポートにはiter_all_users・user_export.pyを使う。
+    """
     try:
-        db = get_firestore_client()
-        if not db:
-            return []
-        
-        users = db.collection('users').stream()
-        return [user.to_dict() for user in users]
+        return list(get_user_repository().iter_all())
         
     except Exception as e:
         st.error(f"ユーザー一覧取得エラー: {e}")
         return []
 
+@instrumented
+def count_users():
+    """登録ユーザー数を取得する（集計クエリを使用し、ドキュメントは読み込まない）"""
+    try:
+        return get_user_repository().count()
+        
+    except Exception as e:
+        st.error(f"ユーザー数取得エラー: {e}")
+        return 0
+
+def iter_all_users(fields=None, start_after=None):
+    """すべてのユーザーをユーザーIDの順に1人ずつ返す（エクスポート用）
+    
+    リポジトリが区切って読み込むため、ユーザー数に関わらずメモリ使用量は一定になる。
+    start_afterにユーザーIDを指定すると、そのユーザーIDより後のユーザーから返す。
+    """
+    return get_user_repository().iter_all(fields, start_after)
+
+def iter_users(fields=None, page_size=200, order_by='created_at'):
+    """ユーザーをページ単位で読み込みながら1人ずつ返す"""
+    cursor = None
+    while True:
+        page = list_users_page(page_size=page_size, order_by=order_by, cursor=cursor, fields=fields)
+        yield from page['users']
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+def _make_page_cursor(user, order_by, descending):
+    """ページ送り用のカーソルを作成する"""
+    return {
+        'order_by': order_by,
+        'descending': descending,
+        'values': [user.get(order_by), user['user_id']]
+    }
+
+@instrumented
+def list_users_page(page_size=DEFAULT_PAGE_SIZE, order_by='created_at', descending=False,
+                    cursor=None, backwards=False, fields=None):
+    """ユーザー一覧を1ページ分取得する（管理者用）
+    
+    cursorには前回の結果の'next_cursor'または'prev_cursor'を渡す。
+    前のページへ戻る場合はbackwards=Trueとともに'prev_cursor'を渡す。
+    
+    Returns:
+        {'users': ユーザーのリスト, 'next_cursor': 次ページのカーソル, 'prev_cursor': 前ページのカーソル}
+        次・前のページが無い場合、対応するカーソルはNone
+    """
+    empty_page = {'users': [], 'next_cursor': None, 'prev_cursor': None}
+    if order_by not in USER_LIST_ORDER_FIELDS:
+        raise ValueError(f"並び替えできないフィールドです: {order_by}")
+    
+    # 並び順が変わった場合は古いカーソルを使わない
+    if cursor and (cursor['order_by'] != order_by or cursor['descending'] != descending):
+        cursor, backwards = None, False
+    
+    try:
+        repository = get_user_repository()
+        field_paths = list(fields if fields is not None else USER_LIST_FIELDS)
+        # カーソルの作成に必要なフィールドは必ず取得する
+        for required_field in ('user_id', order_by):
+            if required_field not in field_paths:
+                field_paths.append(required_field)
+        
+        # 1件多く取得して、その先のページがあるかを判定する
+        if backwards:
+            users = repository.list_page(order_by, descending, page_size + 1,
+                                         end_before=cursor['values'], fields=field_paths)
+            has_more = len(users) > page_size
+            users = users[1:] if has_more else users
+            has_prev, has_next = has_more, True
+        else:
+            users = repository.list_page(order_by, descending, page_size + 1,
+                                         start_after=cursor['values'] if cursor else None, fields=field_paths)
+            has_more = len(users) > page_size
+            users = users[:page_size]
+            has_prev, has_next = cursor is not None, has_more
+        
+        if not users:
+            return empty_page
+        
+        return {
+            'users': users,
+            'next_cursor': _make_page_cursor(users[-1], order_by, descending) if has_next else None,
+            'prev_cursor': _make_page_cursor(users[0], order_by, descending) if has_prev else None
+        }
+        
+    except Exception as e:
+        st.error(f"ユーザー一覧取得エラー: {e}")
+        return empty_page
+
+@instrumented
 def delete_user(user_id):
     """ユーザーを削除する（管理者用）"""
     try:
-        db = get_firestore_client()
-        if not db:
-            return False, "データベース接続エラー"
-        
-        db.collection('users').document(user_id).delete()
+        # ユーザーとメールアドレス索引をまとめて削除する
+        get_user_repository().delete(user_id)
+        user_cache.invalidate(user_id)
+        _remove_from_local_indexes(user_id)
         return True, None
         
     except Exception as e:
         return False, f"ユーザー削除エラー: {e}"
 
-def search_users_by_interests(interests):
-    """興味のあるジャンルでユーザーを検索する"""
+def _bulk_error_message(error):
+    """一括操作のユーザーごとの例外を表示用のメッセージにする"""
+    if error is None:
+        return None
+    if isinstance(error, UserNotFound):
+        return "ユーザーが見つかりません"
+    if isinstance(error, EmailAlreadyRegistered):
+        return "このメールアドレスは既に登録されています"
+    return str(error) or type(error).__name__
+
+@instrumented
+def run_bulk_admin_action(action, user_ids, new_password=None, progress=None):
+    """複数のユーザーに同じ操作をまとめて行う（管理者用）
+    
+    actionはBULK_ADMIN_ACTIONSのいずれか。書き込みはバッチに分けて行い、progressを指定した場合は
+    バッチが終わるたびに(処理済みのユーザー数, 全体のユーザー数)で呼び出す。
+    パスワードリセットはパスワードを設定していないユーザーだけが対象で、全員にnew_passwordを設定する。
+    
+    Returns:
+        ({ユーザーID: 失敗した場合はエラーメッセージ、成功した場合はNone}, エラーメッセージ)
+        途中でエラーになった場合は、それまでに処理したユーザーの結果を返す
+    """
+    if action not in BULK_ADMIN_ACTIONS:
+        raise ValueError(f"不明な一括操作です: {action}")
+    
+    user_ids = list(dict.fromkeys(user_ids))
+    results = {}
     try:
-        db = get_firestore_client()
-        if not db:
-            return []
+        repository = get_user_repository()
+        if action == 'delete':
+            batches = repository.delete_each(user_ids)
+        else:
+            target_ids = user_ids
+            if action == 'promote' or action == 'demote':
+                update_data = {'is_admin': action == 'promote', 'updated_at': datetime.now()}
+            else:
+                # パスワードを設定済みのユーザーは変更しない
+                users = repository.get_many(user_ids, ['has_password', 'password_hash'])
+                target_ids = []
+                for user_id in user_ids:
+                    if user_id not in users:
+                        results[user_id] = _bulk_error_message(UserNotFound(user_id))
+                    elif users[user_id].get('has_password', _has_password(users[user_id])):
+                        results[user_id] = "パスワードを設定済みのため変更しませんでした"
+                    else:
+                        target_ids.append(user_id)
+                # 全員に同じパスワードを設定するため、ハッシュは1回だけ計算する
+                update_data = {
+                    'password_hash': hash_password(new_password) if target_ids else None,
+                    'has_password': True,
+                    'updated_at': datetime.now()
+                }
+            batches = repository.update_each([(user_id, update_data) for user_id in target_ids])
+        
+        if progress:
+            progress(len(results), len(user_ids))
+        for batch_results in batches:
+            for user_id, error in batch_results.items():
+                results[user_id] = _bulk_error_message(error)
+                user_cache.invalidate(user_id)
+                if action == 'delete' and error is None:
+                    _remove_from_local_indexes(user_id)
+            if progress:
+                progress(len(results), len(user_ids))
+        return results, None
         
-        users = db.collection('users').where('interests', 'array_contains_any', interests).stream()
-        return [user.to_dict() for user in users]
+    except Exception as e:
+        return results, f"一括操作エラー: {e}"
+
+@instrumented
+def search_users_by_interests(any_of=None, all_of=None, none_of=None, page_size=DEFAULT_PAGE_SIZE, cursor=None):
+    """興味のあるジャンルの組み合わせでユーザーを検索する（登録日時の順）
+    
+    any_ofのいずれか・all_ofのすべてを持ち、none_ofのいずれも持たないユーザーを返す。
+    条件を指定しない場合はすべてのユーザーが該当する。cursorには前回の結果の'next_cursor'を渡す。
+    
+    Returns:
+        {'users': ユーザー情報（USER_SUMMARY_FIELDSと'interests'）のリスト,
+         'total': 該当するユーザー数, 'next_cursor': 次ページのカーソル（無い場合はNone）}
+    """
+    empty_page = {'users': [], 'total': 0, 'next_cursor': None}
+    try:
+        page = interest_index.get(get_user_repository()).search(
+            all_of or (), any_of or (), none_of or (), page_size, cursor
+        )
+        users, missing_ids = _get_indexed_users(page['user_ids'], USER_SUMMARY_FIELDS + ['interests'])
+        return {
+            'users': [users[user_id] for user_id in page['user_ids'] if user_id in users],
+            'total': page['total'] - len(missing_ids),
+            'next_cursor': page['next_cursor']
+        }
         
     except Exception as e:
         st.error(f"ユーザー検索エラー: {e}")
+        return empty_page
+
+@instrumented
+def search_users_by_keyword(keyword, limit=TEXT_SEARCH_CONFIG["max_results"], fields=None, include_email=False,
+                            any_of=None, all_of=None, none_of=None):
+    """表示名・プロフィール（include_emailの場合はメールアドレスも）にキーワードを含むユーザーを検索する
+    
+    ひらがな・カタカナ、全角・半角の違いは区別しない。空白で区切った場合はすべてを含むユーザーを返す。
+    any_of・all_of・none_ofは興味のあるジャンルの条件（search_users_by_interestsと同じ）で、
+    limit件に絞る前に適用する。
+    
+    Returns:
+        ユーザー情報（fieldsを省略した場合はUSER_SUMMARY_FIELDSと'interests'）のリスト（一致度の高い順）
+    """
+    try:
+        repository = get_user_repository()
+        match_fields = [field for field in SEARCH_FIELDS if include_email or field != 'email']
+        allowed = None
+        if any_of or all_of or none_of:
+            allowed = interest_index.get(repository).matching_user_ids(all_of or (), any_of or (), none_of or ())
+        matches = text_index.get(repository).search(keyword, limit, match_fields, allowed)
+        if not matches:
+            return []
+        
+        user_ids = [user_id for user_id, _ in matches]
+        users, _ = _get_indexed_users(user_ids, fields or USER_SUMMARY_FIELDS + ['interests'])
+        return [users[user_id] for user_id in user_ids if user_id in users]
+        
+    except Exception as e:
+        st.error(f"キーワード検索エラー: {e}")
         return []
 
+def get_text_index_stats():
+    """キーワード検索のインデックスの統計情報を取得する（未作成の場合はNone）"""
+    return text_index.stats()
+
+@instrumented
+def get_interest_counts():
+    """興味のあるジャンルごとのユーザー数を取得する（多い順）"""
+    try:
+        return interest_index.get(get_user_repository()).interest_counts()
+        
+    except Exception as e:
+        st.error(f"ジャンル集計エラー: {e}")
+        return {}
+
+def get_interest_index_stats():
+    """興味のあるジャンルの転置インデックスの統計情報を取得する（未作成の場合はNone）"""
+    return interest_index.stats()
+
+@instrumented
 def update_user_profile(user_id, update_data):
     """ユーザーのプロフィール情報を更新する"""
     try:
-        db = get_firestore_client()
-        if not db:
-            return False, "データベース接続エラー"
-        
         # 更新日時を追加
         update_data['updated_at'] = datetime.now()
         
         # photoフィールドがある場合はphotoとして保存（photo_urlではなく）
         # データベースの構造に合わせて調整
         
-        # Firestoreを更新
-        db.collection('users').document(user_id).update(update_data)
+        get_user_repository().update(user_id, update_data)
+        user_cache.invalidate(user_id)
+        _update_local_indexes(user_id, update_data)
         return True, None
         
     except Exception as e:
         return False, f"プロフィール更新エラー: {e}"
+
+def _ensure_friend_edges(user_id):
+    """友達を配列で保存している旧形式のユーザーを、友達関係のドキュメントに移行する"""
+    user = get_user_by_id(user_id)
+    if user is not None and 'friends' in user:
+        get_user_repository().migrate_friend_array(user_id)
+        user_cache.invalidate(user_id)
+        friend_graph.apply('add_edges', user_id, user['friends'])
+
+def get_friend_count(user):
+    """ユーザーの友達の数を取得する"""
+    # 移行前のユーザーは配列の長さを使う
+    if 'friends' in user:
+        return len(user['friends'])
+    return user.get('friend_count', 0)
+
+@instrumented
+def add_friend(user_id, friend_id):
+    """友達を追加する（同時に追加しても友達の数がずれない）"""
+    if user_id == friend_id:
+        return False, "自分自身を友達にすることはできません"
+    
+    try:
+        _ensure_friend_edges(user_id)
+        added = get_user_repository().add_friend(user_id, friend_id)
+        user_cache.invalidate(user_id)
+        friend_graph.apply('add_edge', user_id, friend_id)
+        return added, None
+        
+    except Exception as e:
+        return False, f"友達追加エラー: {e}"
+
+@instrumented
+def remove_friend(user_id, friend_id):
+    """友達を削除する"""
+    try:
+        _ensure_friend_edges(user_id)
+        removed = get_user_repository().remove_friend(user_id, friend_id)
+        user_cache.invalidate(user_id)
+        friend_graph.apply('remove_edge', user_id, friend_id)
+        return removed, None
+        
+    except Exception as e:
+        return False, f"友達削除エラー: {e}"
+
+@instrumented
+def is_friend(user_id, friend_id):
+    """friend_idのユーザーがuser_idのユーザーの友達かどうか"""
+    try:
+        _ensure_friend_edges(user_id)
+        return get_user_repository().is_friend(user_id, friend_id)
+        
+    except Exception as e:
+        st.error(f"友達確認エラー: {e}")
+        return False
+
+@instrumented
+def get_friends_page(user_id, page_size=FRIEND_PAGE_SIZE, cursor=None):
+    """友達一覧を追加した順に1ページ分取得する
+    
+    cursorには前回の結果の'next_cursor'を渡す。
+    
+    Returns:
+        {'friends': 友達のユーザー情報（USER_SUMMARY_FIELDS）のリスト,
+         'missing_ids': 退会などで見つからなかった友達のユーザーIDのリスト,
+         'next_cursor': 次ページのカーソル（無い場合はNone）}
+    """
+    empty_page = {'friends': [], 'missing_ids': [], 'next_cursor': None}
+    try:
+        _ensure_friend_edges(user_id)
+        # 1件多く取得して、次のページがあるかを判定する
+        edges = get_user_repository().list_friends(user_id, page_size + 1, start_after=cursor)
+        has_next = len(edges) > page_size
+        edges = edges[:page_size]
+        if not edges:
+            return empty_page
+        
+        friend_ids = [edge['friend_id'] for edge in edges]
+        # 読み込みの失敗は下で友達一覧の取得エラーとして扱い、友達を退会扱いにしない
+        friend_users = get_user_repository().get_many(friend_ids, USER_SUMMARY_FIELDS)
+        return {
+            'friends': [friend_users[friend_id] for friend_id in friend_ids if friend_id in friend_users],
+            'missing_ids': [friend_id for friend_id in friend_ids if friend_id not in friend_users],
+            'next_cursor': [edges[-1]['created_at'], edges[-1]['friend_id']] if has_next else None
+        }
+        
+    except Exception as e:
+        st.error(f"友達一覧取得エラー: {e}")
+        return empty_page
+
+@instrumented
+def get_friend_suggestions(user_id, limit=FRIEND_GRAPH_CONFIG["suggestions"]):
+    """友達の友達のうち、まだ友達でないユーザーを共通の友達が多い順に取得する
+    
+    Returns:
+        ユーザー情報（USER_SUMMARY_FIELDS）に'mutual_friend_count'（共通の友達の数）を加えたリスト
+    """
+    try:
+        _ensure_friend_edges(user_id)
+        # 退会したユーザーを除いても足りるよう多めに取得する
+        candidates = friend_graph.get(get_user_repository()).suggest(user_id, limit * 2)
+        if not candidates:
+            return []
+        
+        users, _ = _get_indexed_users([candidate_id for candidate_id, _ in candidates])
+        suggestions = [
+            dict(users[candidate_id], mutual_friend_count=mutual_count)
+            for candidate_id, mutual_count in candidates if candidate_id in users
+        ]
+        return suggestions[:limit]
+        
+    except Exception as e:
+        st.error(f"友達候補取得エラー: {e}")
+        return []
+
+@instrumented
+def get_mutual_friend_count(user_id, other_id):
+    """2人のユーザーの共通の友達の数を取得する"""
+    try:
+        return friend_graph.get(get_user_repository()).mutual_friend_count(user_id, other_id)
+        
+    except Exception as e:
+        st.error(f"共通の友達取得エラー: {e}")
+        return 0
+
+def get_friend_graph_stats():
+    """友達関係のインデックスの統計情報を取得する（未作成の場合はNone）"""
+    return friend_graph.stats()
+
+@instrumented
+def get_similar_interest_users(user_id, limit=INTEREST_MATCH_CONFIG["suggestions"], metric=INTEREST_MATCH_CONFIG["metric"]):
+    """興味のあるジャンルが似ている参加者を類似度の高い順に取得する
+    
+    Returns:
+        ユーザー情報（USER_SUMMARY_FIELDSと'interests'）に'similarity'（0〜1）を加えたリスト
+    """
+    try:
+        # 退会したユーザーを除いても足りるよう多めに取得する
+        matches = interest_matrix.get(get_user_repository()).top_matches(user_id, limit * 2, metric)
+        if not matches:
+            return []
+        
+        users, _ = _get_indexed_users([match_id for match_id, _ in matches], USER_SUMMARY_FIELDS + ['interests'])
+        similar_users = [
+            dict(users[match_id], similarity=similarity)
+            for match_id, similarity in matches if match_id in users
+        ]
+        return similar_users[:limit]
+        
+    except Exception as e:
+        st.error(f"似ている参加者の取得エラー: {e}")
+        return []
+
+def get_interest_matrix_stats():
+    """興味のあるジャンルのインデックスの統計情報を取得する（未作成の場合はNone）"""
+    return interest_matrix.stats()
+
+@instrumented
+def migrate_friend_arrays():
+    """ユーザードキュメント内の友達の配列を友達関係のドキュメントに移行する（管理者用）
+    
+    Returns:
+        (移行したユーザー数, 作成した友達関係の数, エラーメッセージ)
+    """
+    try:
+        repository = get_user_repository()
+        migrated_users = 0
+        created_edges = 0
+        for user_data in repository.iter_all(['user_id', 'friends']):
+            if 'friends' not in user_data:
+                continue
+            created_edges += repository.migrate_friend_array(user_data['user_id'])
+            friend_graph.apply('add_edges', user_data['user_id'], user_data['friends'])
+            migrated_users += 1
+        user_cache.clear()
+        return migrated_users, created_edges, None
+        
+    except Exception as e:
+        return 0, 0, f"友達移行エラー: {e}"
+
+@instrumented
+def migrate_photo_data_uris(batch_size=50):
+    """ユーザードキュメント内のdata URI形式の写真をBlobストアへ移行する（管理者用）
+    
+    Returns:
+        (移行したユーザー数, 移行できなかったユーザーIDのリスト, エラーメッセージ)
+    """
+    try:
+        repository = get_user_repository()
+        store = get_blob_store()
+        migrated_count = 0
+        failed_ids = []
+        updates = []
+        # 写真フィールドだけを1件ずつ読み込み、メモリ使用量を抑える
+        for user_data in repository.iter_all(['user_id', 'photo']):
+            photo = user_data.get('photo')
+            if not isinstance(photo, str) or not photo.startswith('data:'):
+                continue
+            
+            parsed = parse_data_uri(photo)
+            if parsed is None:
+                failed_ids.append(user_data['user_id'])
+                continue
+            
+            photo_bytes, content_type = parsed
+            try:
+                photo_fields = store_profile_photo(photo_bytes)
+            except Exception:
+                # 画像として読み込めない場合は元のデータをそのまま移行する
+                photo_fields = {'photo': store.put(photo_bytes, content_type)}
+            updates.append((user_data['user_id'], photo_fields))
+            if len(updates) == batch_size:
+                repository.update_many(updates)
+                migrated_count += len(updates)
+                updates = []
+        
+        if updates:
+            repository.update_many(updates)
+            migrated_count += len(updates)
+        user_cache.clear()
+        return migrated_count, failed_ids, None
+        
+    except Exception as e:
+        return 0, [], f"写真移行エラー: {e}"
@@ -0,0 +1,174 @@
+import threading
+import numpy as np
+
+EMPTY_ROW = np.zeros(0, dtype=np.int32)
+
+def build_csr(sources, targets, node_count):
+    """(友達を追加したユーザー, 友達)の番号の配列からCSR形式の配列を作成する
+
+    重複した友達関係と自分自身への友達関係は除く。
+
+    Returns:
+        (indptr, indices) indices[indptr[i]:indptr[i + 1]]がi番目のユーザーの友達（昇順）
+    """
+    order = np.lexsort((targets, sources))
+    sources = sources[order]
+    targets = targets[order]
+    keep = sources != targets
+    keep[1:] &= (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+    sources = sources[keep]
+    indptr = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=node_count), out=indptr[1:])
+    return indptr, targets[keep].astype(np.int32)
+
+class FriendGraph:
+    """友達関係の隣接インデックス（スレッドセーフ）
+
+    ユーザーIDに0からの番号を割り当て、各ユーザーの友達の番号をCSR形式の整数配列で保持する。
+    友達の追加・削除では変更したユーザーの行だけを置き換え、
+    置き換えた行がcompact_thresholdを超えたらCSR配列にまとめ直す。
+    """
+
+    def __init__(self, compact_threshold=1024):
+        self.compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        self._user_ids = []
+        self._positions = {}
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._indices = EMPTY_ROW
+        # 置き換えた行（ユーザーの番号 → 友達の番号の配列）
+        self._rows = {}
+        # 削除したユーザーの番号（友達候補から除く）
+        self._deleted = set()
+
+    @classmethod
+    def from_edges(cls, edges, compact_threshold=1024):
+        """(ユーザーID, 友達のユーザーID)のタプルの列から作成する"""
+        graph = cls(compact_threshold)
+        sources = []
+        targets = []
+        for user_id, friend_id in edges:
+            sources.append(graph._position(user_id))
+            targets.append(graph._position(friend_id))
+        graph._indptr, graph._indices = build_csr(
+            np.array(sources, dtype=np.int32), np.array(targets, dtype=np.int32), len(graph._user_ids)
+        )
+        return graph
+
+    def _position(self, user_id):
+        position = self._positions.get(user_id)
+        if position is None:
+            position = self._positions[user_id] = len(self._user_ids)
+            self._user_ids.append(user_id)
+        return position
+
+    def _row(self, position):
+        row = self._rows.get(position)
+        if row is not None:
+            return row
+        if position + 1 < len(self._indptr):
+            return self._indices[self._indptr[position]:self._indptr[position + 1]]
+        return EMPTY_ROW
+
+    def _replace_row(self, position, row):
+        self._rows[position] = row
+        if len(self._rows) > self.compact_threshold:
+            self.compact()
+
+    def compact(self):
+        """置き換えた行をCSR配列にまとめ直す"""
+        with self._lock:
+            node_count = len(self._user_ids)
+            old_sources = np.repeat(np.arange(len(self._indptr) - 1, dtype=np.int32), np.diff(self._indptr))
+            changed = np.fromiter(self._rows, dtype=np.int32, count=len(self._rows))
+            keep = ~np.isin(old_sources, changed)
+            rows = list(self._rows.items())
+            sources = np.concatenate([old_sources[keep]] + [np.full(len(row), position, dtype=np.int32) for position, row in rows])
+            targets = np.concatenate([self._indices[keep]] + [row for _, row in rows])
+            self._indptr, self._indices = build_csr(sources, targets, node_count)
+            self._rows = {}
+
+    def add_edges(self, user_id, friend_ids):
+        """友達を追加する"""
+        with self._lock:
+            position = self._position(user_id)
+            added = np.array([self._position(friend_id) for friend_id in friend_ids], dtype=np.int32)
+            row = np.union1d(self._row(position), added[added != position]).astype(np.int32)
+            self._deleted.discard(position)
+            self._replace_row(position, row)
+
+    def add_edge(self, user_id, friend_id):
+        self.add_edges(user_id, [friend_id])
+
+    def remove_edge(self, user_id, friend_id):
+        """友達を削除する"""
+        with self._lock:
+            position = self._positions.get(user_id)
+            friend_position = self._positions.get(friend_id)
+            if position is None or friend_position is None:
+                return
+            row = self._row(position)
+            self._replace_row(position, row[row != friend_position])
+
+    def remove_user(self, user_id):
+        """ユーザーの友達関係を削除し、以降は友達候補に含めない"""
+        with self._lock:
+            position = self._positions.get(user_id)
+            if position is None:
+                return
+            self._deleted.add(position)
+            self._replace_row(position, EMPTY_ROW)
+
+    def mutual_friend_count(self, user_id, other_id):
+        """2人のユーザーの共通の友達の数"""
+        with self._lock:
+            position = self._positions.get(user_id)
+            other_position = self._positions.get(other_id)
+            if position is None or other_position is None:
+                return 0
+            return len(np.intersect1d(self._row(position), self._row(other_position), assume_unique=True))
+
+    def suggest(self, user_id, limit):
+        """友達の友達のうち、まだ友達でないユーザーを共通の友達が多い順に取得する
+
+        Returns:
+            (ユーザーID, 共通の友達の数)のリスト（同数の場合は番号の順）
+        """
+        with self._lock:
+            position = self._positions.get(user_id)
+            if position is None or limit <= 0:
+                return []
+            friends = self._row(position)
+            if not len(friends):
+                return []
+            # 友達ごとの友達を連結し、現れた回数を共通の友達の数とする
+            candidates, counts = np.unique(
+                np.concatenate([self._row(friend) for friend in friends]), return_counts=True
+            )
+            excluded = np.concatenate((friends, [position], np.fromiter(self._deleted, dtype=np.int32)))
+            keep = ~np.isin(candidates, excluded)
+            candidates = candidates[keep]
+            counts = counts[keep]
+            if len(candidates) > limit:
+                # 上位limit件に入り得る候補に絞ってから並べ替える
+                threshold = np.partition(counts, len(counts) - limit)[len(counts) - limit]
+                top = counts >= threshold
+                candidates = candidates[top]
+                counts = counts[top]
+            order = np.lexsort((candidates, -counts))[:limit]
+            return [(self._user_ids[candidates[index]], int(counts[index])) for index in order]
+
+    def stats(self):
+        """インデックスの統計情報を取得する"""
+        with self._lock:
+            changed_edges = sum(len(row) for row in self._rows.values())
+            replaced_edges = sum(
+                int(self._indptr[position + 1] - self._indptr[position])
+                for position in self._rows if position + 1 < len(self._indptr)
+            )
+            return {
+                'users': len(self._user_ids),
+                'edges': len(self._indices) - replaced_edges + changed_edges,
+                'pending_rows': len(self._rows),
+                'bytes': self._indptr.nbytes + self._indices.nbytes
+            }
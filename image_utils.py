@@ -0,0 +1,77 @@
+from io import BytesIO
+from PIL import Image, ImageOps
+from blob_store import get_blob_store
+from config import IMAGE_CONFIG
+
+# 生成する写真のサイズ（長辺のピクセル数）。小さい順に並べる
+PHOTO_RENDITIONS = {
+    'thumb': 64,    # 友達リスト用
+    'avatar': 200,  # プロフィールページ用
+    'full': 1280    # 拡大表示用
+}
+
+# 保存形式ごとのContent-Typeと保存オプション
+OUTPUT_FORMATS = {
+    'WEBP': ('image/webp', {'method': 4}),
+    'JPEG': ('image/jpeg', {'optimize': True, 'progressive': True})
+}
+
+def _normalize_image(image):
+    """EXIFの向きを反映し、保存可能なカラーモードに変換する"""
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    if has_alpha and IMAGE_CONFIG['format'] == 'WEBP':
+        return image.convert('RGBA')
+    if has_alpha:
+        # JPEGは透過を扱えないため白背景に合成する
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+def _encode(image):
+    """画像を設定された形式でエンコードする（メタデータは付与しない）"""
+    image_format = IMAGE_CONFIG['format']
+    content_type, options = OUTPUT_FORMATS[image_format]
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, quality=IMAGE_CONFIG['quality'], **options)
+    return buffer.getvalue(), content_type
+
+def create_photo_renditions(photo_bytes):
+    """アップロードされた写真から各サイズの画像を生成する
+
+    Returns:
+        {サイズ名: (データ, Content-Type)}
+    """
+    with Image.open(BytesIO(photo_bytes)) as source:
+        image = _normalize_image(source)
+
+    renditions = {}
+    # 大きいサイズから順に縮小し、縮小済みの画像を次の縮小に使う
+    for name, max_size in sorted(PHOTO_RENDITIONS.items(), key=lambda item: -item[1]):
+        if max(image.size) > max_size:
+            image = image.copy()
+            image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        renditions[name] = _encode(image)
+    return renditions
+
+def store_profile_photo(photo_bytes):
+    """写真を各サイズに変換してBlobストアに保存する
+
+    Returns:
+        ユーザードキュメントに保存するフィールドの辞書
+    """
+    store = get_blob_store()
+    refs = {
+        name: store.put(data, content_type)
+        for name, (data, content_type) in create_photo_renditions(photo_bytes).items()
+    }
+    return {'photo': refs['full'], 'photo_renditions': refs}
+
+def select_photo(user, width):
+    """表示幅に収まる最小の写真を選ぶ（変換済みの写真が無い場合は元の写真）"""
+    renditions = user.get('photo_renditions') or {}
+    for name, max_size in PHOTO_RENDITIONS.items():
+        if name in renditions and max_size >= width:
+            return renditions[name]
+    return renditions.get('full') or user.get('photo')
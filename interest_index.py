@@ -0,0 +1,167 @@
+import bisect
+import threading
+from datetime import datetime, timezone
+import numpy as np
+from interest_matching import POPCOUNT
+
+def created_key(created_at):
+    """登録日時の並び替え用の値（文字列の順序と時刻の順序が一致する形式）"""
+    if not isinstance(created_at, datetime):
+        return ''
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return created_at.isoformat(sep=' ', timespec='microseconds')
+
+class InterestIndex:
+    """興味のあるジャンルごとの参加者のビットマップ（転置インデックス、スレッドセーフ）
+
+    参加者には登録日時の順に番号を割り当て、ジャンルごとに参加者の番号の位置のビットを立てた
+    ビットマップ（np.packbitsと同じ並び）を保持する。選択肢が少ないため、番号のリストより
+    ビットマップの方が小さく、AND・OR・NOTもバイト単位の演算で求められる。
+    削除した参加者の番号は再利用せず、カーソルが指す位置を保つ。
+    """
+
+    def __init__(self, capacity=1024):
+        self._lock = threading.Lock()
+        self._user_ids = []
+        # 番号ごとの(登録日時の並び替え用の値, ユーザーID)（カーソルの位置の検索に使う）
+        self._keys = []
+        self._positions = {}
+        # 番号ごとの現在のジャンル（更新時に古いビットを消すため）
+        self._user_interests = []
+        self._capacity_bytes = max(1, capacity // 8)
+        self._bitmaps = {}
+        # 登録されている（削除されていない）参加者
+        self._active = np.zeros(self._capacity_bytes, dtype=np.uint8)
+
+    @classmethod
+    def from_users(cls, users):
+        """'user_id'・'interests'・'created_at'を持つユーザー情報の列から作成する"""
+        users = sorted(users, key=lambda user: (created_key(user.get('created_at')), user['user_id']))
+        index = cls(capacity=len(users) + 1024)
+        for user in users:
+            index.set_user(user['user_id'], user.get('interests') or [], user.get('created_at'))
+        return index
+
+    def _empty_bitmap(self):
+        return np.zeros(self._capacity_bytes, dtype=np.uint8)
+
+    def _grow(self):
+        def grown(bitmap):
+            return np.concatenate((bitmap, np.zeros(len(bitmap), dtype=np.uint8)))
+        self._capacity_bytes *= 2
+        self._active = grown(self._active)
+        self._bitmaps = {interest: grown(bitmap) for interest, bitmap in self._bitmaps.items()}
+
+    def set_user(self, user_id, interests, created_at=None):
+        """参加者のジャンルを登録・更新する（新しい参加者は末尾に追加する）"""
+        with self._lock:
+            position = self._positions.get(user_id)
+            if position is None:
+                position = self._positions[user_id] = len(self._user_ids)
+                self._user_ids.append(user_id)
+                self._keys.append((created_key(created_at or datetime.now()), user_id))
+                self._user_interests.append(())
+                if position >= self._capacity_bytes * 8:
+                    self._grow()
+            byte, mask = position >> 3, np.uint8(0x80 >> (position & 7))
+            for interest in self._user_interests[position]:
+                self._bitmaps[interest][byte] &= ~mask
+            interests = tuple(dict.fromkeys(interests))
+            for interest in interests:
+                bitmap = self._bitmaps.get(interest)
+                if bitmap is None:
+                    bitmap = self._bitmaps[interest] = self._empty_bitmap()
+                bitmap[byte] |= mask
+            self._user_interests[position] = interests
+            self._active[byte] |= mask
+
+    def remove_user(self, user_id):
+        """参加者を検索結果に含めないようにする"""
+        with self._lock:
+            position = self._positions.get(user_id)
+            if position is None:
+                return
+            byte, mask = position >> 3, np.uint8(0x80 >> (position & 7))
+            for interest in self._user_interests[position]:
+                self._bitmaps[interest][byte] &= ~mask
+            self._user_interests[position] = ()
+            self._active[byte] &= ~mask
+
+    def _match(self, all_of, any_of, none_of):
+        """条件に該当する参加者のビットマップを求める"""
+        result = self._active.copy()
+        empty = self._empty_bitmap()
+        for interest in all_of:
+            result &= self._bitmaps.get(interest, empty)
+        if any_of:
+            union = empty.copy()
+            for interest in any_of:
+                union |= self._bitmaps.get(interest, empty)
+            result &= union
+        for interest in none_of:
+            result &= ~self._bitmaps.get(interest, empty)
+        return result
+
+    def count(self, all_of=(), any_of=(), none_of=()):
+        """条件に該当する参加者の数"""
+        with self._lock:
+            return int(POPCOUNT[self._match(all_of, any_of, none_of)].sum(dtype=np.int64))
+
+    def matching_user_ids(self, all_of=(), any_of=(), none_of=()):
+        """条件に該当する参加者のユーザーIDのset（他のインデックスでの検索の絞り込み用）"""
+        with self._lock:
+            positions = np.flatnonzero(np.unpackbits(self._match(all_of, any_of, none_of)))
+            return {self._user_ids[position] for position in positions}
+
+    def _start_position(self, cursor):
+        """カーソル（前のページの最後の参加者）の次の番号"""
+        if cursor is None:
+            return 0
+        position = self._positions.get(cursor[1])
+        if position is not None:
+            return position + 1
+        # 作り直したインデックスに無い参加者の場合は登録日時の順の位置から続ける
+        return bisect.bisect_right(self._keys, tuple(cursor))
+
+    def search(self, all_of=(), any_of=(), none_of=(), limit=20, cursor=None):
+        """all_ofのすべて・any_ofのいずれかを持ち、none_ofのいずれも持たない参加者を登録日時の順に取得する
+
+        条件を指定しない場合はすべての参加者が該当する。
+
+        Returns:
+            {'user_ids': 最大limit件のユーザーID, 'total': 該当する参加者の数,
+             'next_cursor': 次ページのカーソル（無い場合はNone）}
+        """
+        with self._lock:
+            result = self._match(all_of, any_of, none_of)
+            total = int(POPCOUNT[result].sum(dtype=np.int64))
+            start = self._start_position(cursor)
+            first_byte = start >> 3
+            positions = np.flatnonzero(np.unpackbits(result[first_byte:])) + first_byte * 8
+            positions = positions[positions >= start][:limit + 1]
+            page = positions[:limit]
+            return {
+                'user_ids': [self._user_ids[position] for position in page],
+                'total': total,
+                'next_cursor': list(self._keys[page[-1]]) if len(positions) > limit else None
+            }
+
+    def interest_counts(self):
+        """ジャンルごとの参加者の数（多い順）"""
+        with self._lock:
+            counts = {
+                interest: int(POPCOUNT[bitmap & self._active].sum(dtype=np.int64))
+                for interest, bitmap in self._bitmaps.items()
+            }
+        return dict(sorted(((interest, count) for interest, count in counts.items() if count),
+                           key=lambda item: item[1], reverse=True))
+
+    def stats(self):
+        """インデックスの統計情報を取得する"""
+        with self._lock:
+            return {
+                'users': int(POPCOUNT[self._active].sum(dtype=np.int64)),
+                'interests': len(self._bitmaps),
+                'bytes': self._active.nbytes + sum(bitmap.nbytes for bitmap in self._bitmaps.values())
+            }
@@ -0,0 +1,167 @@
+import threading
+import numpy as np
+
+# 0〜255の各値で立っているビットの数
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+# 類似度の計算方法
+SIMILARITY_METRICS = ('jaccard', 'cosine')
+
+# 同じ類似度のユーザーを番号の順に並べるための補正値（類似度の最小の差より十分小さい）
+TIE_BREAK_STEP = 1e-12
+
+class InterestMatrix:
+    """参加者の興味のあるジャンルをビット行列で保持し、類似した参加者を求める（スレッドセーフ）
+
+    ジャンルは選択肢（options）の順にビットを割り当て、1人あたりceil(選択肢の数 / 8)バイトで保持する。
+    選択肢に無いジャンルは無視する。
+    """
+
+    def __init__(self, options, capacity=1024):
+        self.options = list(options)
+        self._bit_positions = {option: position for position, option in enumerate(self.options)}
+        self._width = max(1, (len(self.options) + 7) // 8)
+        self._lock = threading.Lock()
+        self._user_ids = []
+        self._positions = {}
+        self._bits = np.zeros((capacity, self._width), dtype=np.uint8)
+        # 各参加者のジャンルの数（0の参加者は類似した参加者に含めない）
+        self._sizes = np.zeros(capacity, dtype=np.int16)
+
+    @classmethod
+    def from_users(cls, users, options):
+        """'user_id'と'interests'を持つユーザー情報の列から作成する"""
+        matrix = cls(options)
+        for user in users:
+            matrix.set_interests(user['user_id'], user.get('interests') or [])
+        return matrix
+
+    def encode(self, interests):
+        """ジャンルのリストを1人分のビット列に変換する"""
+        flags = np.zeros(self._width * 8, dtype=bool)
+        for interest in interests:
+            position = self._bit_positions.get(interest)
+            if position is not None:
+                flags[position] = True
+        return np.packbits(flags)
+
+    def set_interests(self, user_id, interests):
+        """参加者のジャンルを登録・更新する"""
+        row = self.encode(interests)
+        with self._lock:
+            position = self._positions.get(user_id)
+            if position is None:
+                position = self._positions[user_id] = len(self._user_ids)
+                self._user_ids.append(user_id)
+                if position == len(self._bits):
+                    self._grow()
+            self._bits[position] = row
+            self._sizes[position] = POPCOUNT[row].sum()
+
+    def _grow(self):
+        capacity = len(self._bits) * 2
+        self._bits = np.resize(self._bits, (capacity, self._width))
+        self._bits[len(self._user_ids):] = 0
+        self._sizes = np.resize(self._sizes, capacity)
+        self._sizes[len(self._user_ids):] = 0
+
+    def remove_user(self, user_id):
+        """参加者を類似した参加者に含めないようにする"""
+        with self._lock:
+            position = self._positions.get(user_id)
+            if position is not None:
+                self._bits[position] = 0
+                self._sizes[position] = 0
+
+    def _similarity(self, rows, sizes, count, metric):
+        """rows（参加者数 × バイト数）の各参加者と、先頭count人との類似度の行列を求める"""
+        bits = self._bits[:count]
+        intersections = POPCOUNT[rows[:, None, :] & bits[None, :, :]].sum(axis=2, dtype=np.int16)
+        intersections = intersections.astype(np.float64)
+        all_sizes = self._sizes[:count].astype(np.float64)
+        sizes = sizes.astype(np.float64)[:, None]
+        if metric == 'jaccard':
+            unions = sizes + all_sizes - intersections
+            return np.divide(intersections, unions, out=np.zeros_like(intersections), where=unions > 0)
+        if metric == 'cosine':
+            norms = np.sqrt(sizes * all_sizes)
+            return np.divide(intersections, norms, out=np.zeros_like(intersections), where=norms > 0)
+        raise ValueError(f"不明な類似度です: {metric}")
+
+    def _top_k(self, scores, excluded, limit):
+        """類似度の行列から、行ごとに類似度が0より大きい上位limit件の(番号, 類似度)を求める"""
+        count = scores.shape[1]
+        # 同じ類似度の場合は番号の小さい参加者を優先する
+        keys = scores - np.arange(count) * TIE_BREAK_STEP
+        keys[scores <= 0] = -1
+        if excluded is not None:
+            keys[np.arange(len(keys)), excluded] = -1
+        limit = min(limit, count)
+        top = np.argpartition(-keys, limit - 1, axis=1)[:, :limit]
+        top_keys = np.take_along_axis(keys, top, axis=1)
+        order = np.argsort(-top_keys, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        return [
+            [(position, float(row_scores[position])) for position in row_top if keys[row_index, position] > 0]
+            for row_index, (row_top, row_scores) in enumerate(zip(top, scores))
+        ]
+
+    def top_matches(self, user_id, limit=5, metric='jaccard'):
+        """興味のあるジャンルが似ている参加者を類似度の高い順に取得する
+
+        Returns:
+            (ユーザーID, 類似度)のリスト（同じ類似度の場合は登録された順）
+        """
+        with self._lock:
+            position = self._positions.get(user_id)
+            count = len(self._user_ids)
+            if position is None or limit <= 0 or count < 2:
+                return []
+            scores = self._similarity(self._bits[position:position + 1], self._sizes[position:position + 1], count, metric)
+            matches = self._top_k(scores, np.array([position]), limit)[0]
+            return [(self._user_ids[match], score) for match, score in matches]
+
+    def iter_all_top_matches(self, limit=5, metric='jaccard', batch_size=64):
+        """すべての参加者について、類似した参加者を求める（参加者の順序は不定）
+
+        類似度はジャンルの組み合わせだけで決まるため、同じ組み合わせの参加者はまとめて1回だけ計算する。
+        組み合わせはbatch_size件ずつ計算し、作業用のメモリはbatch_size × 参加者数 × 8バイト程度になる。
+
+        Yields:
+            (ユーザーID, top_matchesと同じ形式のリスト)
+        """
+        with self._lock:
+            bits = self._bits[:len(self._user_ids)].copy()
+            sizes = self._sizes[:len(bits)].copy()
+            user_ids = list(self._user_ids)
+        count = len(user_ids)
+        if limit <= 0 or count < 2:
+            return
+
+        snapshot = InterestMatrix(self.options, capacity=count)
+        snapshot._bits = bits
+        snapshot._sizes = sizes
+        patterns, inverse = np.unique(bits, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        # 組み合わせごとの参加者の番号（登録された順）
+        members = np.split(np.argsort(inverse, kind='stable'), np.cumsum(np.bincount(inverse))[:-1])
+        pattern_sizes = POPCOUNT[patterns].sum(axis=1)
+        for start in range(0, len(patterns), batch_size):
+            batch = slice(start, start + batch_size)
+            scores = snapshot._similarity(patterns[batch], pattern_sizes[batch], count, metric)
+            # 本人を除いてもlimit件になるよう1件多く求める
+            for pattern_members, matches in zip(members[batch], snapshot._top_k(scores, None, limit + 1)):
+                for position in pattern_members:
+                    if sizes[position]:
+                        yield user_ids[position], [
+                            (user_ids[match], score) for match, score in matches if match != position
+                        ][:limit]
+
+    def stats(self):
+        """インデックスの統計情報を取得する"""
+        with self._lock:
+            count = len(self._user_ids)
+            return {
+                'users': int(np.count_nonzero(self._sizes[:count])),
+                'bytes': self._bits.nbytes + self._sizes.nbytes
+            }
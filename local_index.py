@@ -0,0 +1,87 @@
+import threading
+import time
+
+class LocalIndex:
+    """リポジトリから作成するプロセス内のインデックスの読み込みと更新を管理する
+
+    最初に使うときにbuild(repository)で作成し、max_age_secondsを過ぎたらバックグラウンドで
+    作り直す（他のプロセスでの変更を反映するため）。変更はapplyでインデックスのメソッドを
+    呼び出して反映し、作成中に行われた変更は記録しておいて作成後のインデックスにも適用する。
+    """
+
+    def __init__(self, name, build, max_age_seconds=600.0):
+        self.name = name
+        self._build_index = build
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._index = None
+        self._repository = None
+        self._built_at = 0.0
+        self._build_seconds = 0.0
+        self._refreshing = False
+        self._journal = None
+
+    def get(self, repository):
+        """repositoryから作成したインデックスを取得する（無い場合はこの場で作成する）"""
+        with self._lock:
+            index = self._index if self._repository is repository else None
+            if index is not None and not self._refreshing and time.monotonic() - self._built_at > self.max_age_seconds:
+                self._refreshing = True
+                threading.Thread(target=self._refresh, args=(repository,), name=f"{self.name}-refresh", daemon=True).start()
+        if index is None:
+            index = self._build(repository, force=False)
+        return index
+
+    def _refresh(self, repository):
+        try:
+            self._build(repository, force=True)
+        except Exception:
+            # 作り直せなかった場合は古いインデックスを使い続け、次の呼び出しで再度試す
+            pass
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _build(self, repository, force):
+        with self._build_lock:
+            with self._lock:
+                if not force and self._index is not None and self._repository is repository:
+                    return self._index
+                self._journal = []
+
+            started = time.perf_counter()
+            try:
+                index = self._build_index(repository)
+            except Exception:
+                with self._lock:
+                    self._journal = None
+                raise
+
+            with self._lock:
+                for method, args in self._journal:
+                    getattr(index, method)(*args)
+                self._journal = None
+                self._index = index
+                self._repository = repository
+                self._built_at = time.monotonic()
+                self._build_seconds = time.perf_counter() - started
+            return index
+
+    def apply(self, method, *args):
+        """作成済みのインデックスに変更を適用する（インデックスのメソッド名と引数）"""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((method, args))
+            if self._index is not None:
+                getattr(self._index, method)(*args)
+
+    def stats(self):
+        """インデックスの統計情報を取得する（未作成の場合はNone）"""
+        with self._lock:
+            index = self._index
+            if index is None:
+                return None
+            age_seconds = time.monotonic() - self._built_at
+            build_seconds = self._build_seconds
+        return dict(index.stats(), age_seconds=age_seconds, build_seconds=build_seconds)
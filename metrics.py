@@ -0,0 +1,303 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import streamlit as st
+from config import METRICS_CONFIG
+
+# 処理時間のヒストグラムの区切り（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 画面の外（CLIやバックグラウンド処理）で実行された場合のページ名
+NO_PAGE = 'none'
+
+# rerun中でページが決まる前（ナビゲーションなど）のページ名
+APP_PAGE = 'app'
+
+METRIC_HELP = {
+    'mypage_operation_seconds': "database.py・qr_utils.pyの関数の処理時間",
+    'mypage_operation_errors_total': "例外で終了した関数の呼び出し回数",
+    'mypage_storage_seconds': "ユーザーリポジトリの呼び出しの処理時間",
+    'mypage_storage_reads_total': "読み込んだドキュメント数",
+    'mypage_storage_writes_total': "書き込んだドキュメント数",
+    'mypage_storage_errors_total': "例外で終了したユーザーリポジトリの呼び出し回数",
+    'mypage_rerun_seconds': "Streamlitのスクリプト実行（rerun）1回の処理時間",
+    'mypage_rerun_storage_reads_total': "rerunで読み込んだドキュメント数の合計",
+    'mypage_rerun_storage_writes_total': "rerunで書き込んだドキュメント数の合計",
+    'mypage_mirror_lag_seconds': "ユーザー情報のミラーへの反映の遅れ（change: 保存先の読み込み時刻から、write: このプロセスでの書き込みから）",
+    'mypage_mirror_reads_total': "ユーザー情報のミラーを通した読み込み回数（source: mirrorは複製から、directは保存先から）"
+}
+
+class Histogram:
+    """Prometheus形式のヒストグラム"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.bucket_counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """分位数の近似値（該当する区切りの上限）を求める"""
+        if not self.count:
+            return 0.0
+        threshold = q * self.count
+        cumulative = 0
+        for upper_bound, bucket_count in zip(self.buckets, self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= threshold:
+                return upper_bound
+        return float('inf')
+
+    def p95_ms(self):
+        """管理者パネル用の95パーセンタイル（ミリ秒）と、最大の区切りを超えたかどうか
+
+        最大の区切りを超えた場合はinfの代わりに最大の区切りの値を返す。
+        """
+        value = self.quantile(0.95)
+        if value == float('inf'):
+            return self.buckets[-1] * 1000, True
+        return value * 1000, False
+
+class MetricsRegistry:
+    """ヒストグラムとカウンターの保存先（スレッドセーフ）
+
+    値は(メトリクス名, ラベルのタプル)ごとに保持する。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name, labels, value):
+        """ヒストグラムに値を記録する"""
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name, labels, amount=1):
+        """カウンターを増やす"""
+        if amount:
+            with self._lock:
+                self._counters[(name, labels)] = self._counters.get((name, labels), 0) + amount
+
+    def reset(self):
+        """記録したすべての値を削除する"""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def summarize(self):
+        """管理者パネル用に、ページごと・処理ごとの集計を作成する"""
+        with self._lock:
+            pages = {}
+            operations = {}
+            for (name, labels), histogram in self._histograms.items():
+                label_map = dict(labels)
+                if name == 'mypage_rerun_seconds':
+                    p95_ms, p95_overflow = histogram.p95_ms()
+                    pages[label_map['page']] = {
+                        'page': label_map['page'],
+                        'reruns': histogram.count,
+                        'mean_ms': histogram.sum / histogram.count * 1000,
+                        'p95_ms': p95_ms,
+                        'p95_overflow': p95_overflow,
+                        'reads_per_rerun': self._counters.get(('mypage_rerun_storage_reads_total', labels), 0) / histogram.count,
+                        'writes_per_rerun': self._counters.get(('mypage_rerun_storage_writes_total', labels), 0) / histogram.count
+                    }
+                elif name == 'mypage_operation_seconds':
+                    operation = operations.setdefault(label_map['operation'], {
+                        'operation': label_map['operation'], 'calls': 0, 'total_ms': 0.0, 'errors': 0,
+                        'histogram': Histogram()
+                    })
+                    operation['calls'] += histogram.count
+                    operation['total_ms'] += histogram.sum * 1000
+                    operation['errors'] += self._counters.get(('mypage_operation_errors_total', labels), 0)
+                    merged = operation['histogram']
+                    merged.bucket_counts = [a + b for a, b in zip(merged.bucket_counts, histogram.bucket_counts)]
+                    merged.count += histogram.count
+
+        operation_rows = []
+        for operation in operations.values():
+            histogram = operation.pop('histogram')
+            operation['mean_ms'] = operation['total_ms'] / operation['calls']
+            operation['p95_ms'], operation['p95_overflow'] = histogram.p95_ms()
+            operation_rows.append(operation)
+        operation_rows.sort(key=lambda row: row['total_ms'], reverse=True)
+        return {
+            'pages': sorted(pages.values(), key=lambda row: row['reruns'], reverse=True),
+            'operations': operation_rows
+        }
+
+    def render_prometheus(self):
+        """Prometheusのテキスト形式で出力する"""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        lines = []
+        written_headers = set()
+
+        def header(name, metric_type):
+            if name not in written_headers:
+                written_headers.add(name)
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), histogram in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for upper_bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(upper_bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum!r}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label_value(value)}"' for key, value in labels) + '}'
+
+registry = MetricsRegistry()
+
+class RerunStats:
+    """実行中のrerunの集計"""
+
+    def __init__(self):
+        self.page = APP_PAGE
+        self.started = time.perf_counter()
+        self.reads = 0
+        self.writes = 0
+
+_local = threading.local()
+
+def _current_rerun():
+    return getattr(_local, 'rerun', None)
+
+def record_operation(operation, seconds, failed=False):
+    """関数の呼び出しを記録する"""
+    rerun = _current_rerun()
+    labels = (('operation', operation), ('page', rerun.page if rerun else NO_PAGE))
+    registry.observe('mypage_operation_seconds', labels, seconds)
+    if failed:
+        registry.increment('mypage_operation_errors_total', labels)
+
+def record_storage(method, seconds, reads, writes, failed):
+    """ユーザーリポジトリの呼び出しを記録する（InstrumentedUserRepositoryのobserver）"""
+    rerun = _current_rerun()
+    labels = (('method', method), ('page', rerun.page if rerun else NO_PAGE))
+    registry.observe('mypage_storage_seconds', labels, seconds)
+    registry.increment('mypage_storage_reads_total', labels, reads)
+    registry.increment('mypage_storage_writes_total', labels, writes)
+    if failed:
+        registry.increment('mypage_storage_errors_total', labels)
+    if rerun:
+        rerun.reads += reads
+        rerun.writes += writes
+
+def instrumented(func):
+    """関数の処理時間を記録するデコレーター（計測が無効の場合は関数をそのまま返す）"""
+    if not METRICS_CONFIG["enabled"]:
+        return func
+
+    operation = f"{func.__module__}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            record_operation(operation, time.perf_counter() - started, failed)
+    return wrapper
+
+def instrument_repository(repository):
+    """計測が有効の場合、ユーザーリポジトリの呼び出しを記録するラッパーを付ける"""
+    if not METRICS_CONFIG["enabled"]:
+        return repository
+    from storage.instrumented import InstrumentedUserRepository
+    return InstrumentedUserRepository(repository, record_storage)
+
+def record_mirror_lag(kind, seconds):
+    """ミラーへの反映の遅れを記録する（MirroredUserRepositoryのon_lag）"""
+    registry.observe('mypage_mirror_lag_seconds', (('kind', kind),), seconds)
+
+def record_mirror_read(method, source):
+    """ミラーを通した読み込みを記録する（MirroredUserRepositoryのon_read）"""
+    registry.increment('mypage_mirror_reads_total', (('method', method), ('source', source)))
+
+def mirror_observers():
+    """ミラーに渡す(on_lag, on_read)（計測が無効の場合は記録しない）"""
+    if not METRICS_CONFIG["enabled"]:
+        return None, None
+    return record_mirror_lag, record_mirror_read
+
+@contextmanager
+def _track_rerun():
+    rerun = RerunStats()
+    _local.rerun = rerun
+    try:
+        yield rerun
+    finally:
+        # st.rerun()やst.stop()で中断された場合も記録する
+        _local.rerun = None
+        labels = (('page', rerun.page),)
+        registry.observe('mypage_rerun_seconds', labels, time.perf_counter() - rerun.started)
+        registry.increment('mypage_rerun_storage_reads_total', labels, rerun.reads)
+        registry.increment('mypage_rerun_storage_writes_total', labels, rerun.writes)
+
+def track_rerun():
+    """スクリプトの実行1回分を計測する（with文で使う）"""
+    return _track_rerun() if METRICS_CONFIG["enabled"] else nullcontext()
+
+def set_page(page):
+    """実行中のrerunで表示しているページを設定する"""
+    rerun = _current_rerun()
+    if rerun is not None:
+        rerun.page = page
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # アクセスログは出力しない
+        pass
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_server(port):
+    """/metricsを公開するHTTPサーバーをバックグラウンドで起動する（プロセスごとに一度だけ）"""
+    server = ThreadingHTTPServer(('0.0.0.0', port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,23 @@
+"""
+ユーザードキュメント内の友達の配列を友達関係のドキュメントに移行するスクリプト
+python migrate_friends.py で実行してください。
+"""
+
+from config import STORAGE_CONFIG, initialize_firebase
+from database import migrate_friend_arrays
+
+def main():
+    """友達を移行する"""
+    if STORAGE_CONFIG["backend"] == "firestore" and not initialize_firebase():
+        print("Firebaseの初期化に失敗しました。")
+        return
+    
+    migrated_users, created_edges, error = migrate_friend_arrays()
+    if error:
+        print(f"移行エラー: {error}")
+        return
+    
+    print(f"{migrated_users}人の友達（{created_edges}件）を移行しました。")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""
+ユーザードキュメントに保存されたdata URI形式の写真をBlobストアへ移行するスクリプト
+python migrate_photos.py で実行してください。
+"""
+
+from config import initialize_firebase
+from database import migrate_photo_data_uris
+
+def main():
+    """写真を移行する"""
+    if not initialize_firebase():
+        print("Firebaseの初期化に失敗しました。")
+        return
+    
+    migrated_count, failed_ids, error = migrate_photo_data_uris()
+    if error:
+        print(f"移行エラー: {error}")
+        return
+    
+    print(f"{migrated_count}人の写真を移行しました。")
+    if failed_ids:
+        print("形式が正しくないため移行できなかったユーザー:")
+        for user_id in failed_ids:
+            print(f"  {user_id}")
+
+if __name__ == "__main__":
+    main()
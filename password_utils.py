@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import PASSWORD_HASH_CONFIG
+from process_pool import create_process_pool
+
+# 保存形式: pbkdf2_sha256$<反復回数>$<ソルト(base64)>$<ハッシュ(base64)>
+PASSWORD_HASH_ALGORITHM = 'pbkdf2_sha256'
+
+# 旧形式（ソルト32バイト + ハッシュ32バイトのバイト列）の反復回数
+LEGACY_SALT_LENGTH = 32
+LEGACY_ITERATIONS = 100000
+
+# 自動調整時の反復回数の下限と丸め単位
+MIN_ITERATIONS = LEGACY_ITERATIONS
+ITERATION_STEP = 10000
+
+class PasswordHasherBusy(Exception):
+    """同時に実行できるハッシュ計算の上限に達した"""
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_CONFIG["max_pending"])
+_iterations = None
+
+def _get_executor():
+    """ハッシュ計算用のワーカープールを取得する"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if PASSWORD_HASH_CONFIG["executor"] == "process":
+                _executor = create_process_pool(PASSWORD_HASH_CONFIG["workers"])
+            else:
+                # pbkdf2_hmacは計算中にGILを解放するため、スレッドでも並列に実行できる
+                _executor = ThreadPoolExecutor(
+                    max_workers=PASSWORD_HASH_CONFIG["workers"],
+                    thread_name_prefix="password-hash"
+                )
+        return _executor
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+
+def _run_in_pool(func, *args):
+    """ワーカープールで計算を実行し、結果を待つ"""
+    if not _slots.acquire(timeout=PASSWORD_HASH_CONFIG["queue_timeout"]):
+        raise PasswordHasherBusy("ログインが混み合っています。しばらくしてから再度お試しください")
+    try:
+        return _get_executor().submit(func, *args).result()
+    finally:
+        _slots.release()
+
+def calibrate_iterations(target_ms, sample_iterations=20000):
+    """1回のハッシュ計算が目標時間になる反復回数を測定する"""
+    salt = os.urandom(16)
+    started = time.perf_counter()
+    _pbkdf2('calibration', salt, sample_iterations)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    iterations = int(sample_iterations * target_ms / max(elapsed_ms, 0.001))
+    iterations = iterations // ITERATION_STEP * ITERATION_STEP
+    return max(MIN_ITERATIONS, iterations)
+
+def get_hash_iterations():
+    """新しく保存するハッシュの反復回数を取得する（未設定の場合はプロセスごとに一度だけ測定する）"""
+    global _iterations
+    if _iterations is None:
+        if PASSWORD_HASH_CONFIG["iterations"]:
+            _iterations = PASSWORD_HASH_CONFIG["iterations"]
+        else:
+            _iterations = calibrate_iterations(PASSWORD_HASH_CONFIG["target_ms"])
+    return _iterations
+
+def parse_password_hash(stored_hash):
+    """保存されたハッシュを(アルゴリズム, 反復回数, ソルト, ハッシュ)に分解する"""
+    if isinstance(stored_hash, (bytes, bytearray)):
+        stored_hash = bytes(stored_hash)
+        return 'legacy', LEGACY_ITERATIONS, stored_hash[:LEGACY_SALT_LENGTH], stored_hash[LEGACY_SALT_LENGTH:]
+
+    algorithm, iterations, salt, hash_value = stored_hash.split('$')
+    return algorithm, int(iterations), base64.b64decode(salt), base64.b64decode(hash_value)
+
+def _encode_password_hash(password, iterations):
+    salt = os.urandom(16)
+    hash_value = _pbkdf2(password, salt, iterations)
+    return '$'.join([
+        PASSWORD_HASH_ALGORITHM,
+        str(iterations),
+        base64.b64encode(salt).decode('ascii'),
+        base64.b64encode(hash_value).decode('ascii')
+    ])
+
+def _check_password(password, stored_hash):
+    algorithm, iterations, salt, hash_value = parse_password_hash(stored_hash)
+    if algorithm not in ('legacy', PASSWORD_HASH_ALGORITHM):
+        return False
+    return hmac.compare_digest(_pbkdf2(password, salt, iterations), hash_value)
+
+def hash_password(password):
+    """パスワードをハッシュ化する"""
+    return _run_in_pool(_encode_password_hash, password, get_hash_iterations())
+
+def hash_passwords(passwords, executor, chunksize=16):
+    """複数のパスワードをハッシュ化する（一括登録用）
+
+    ログインの処理を待たせないよう、ログイン用のワーカープールではなく呼び出し側で用意した
+    executor（ProcessPoolExecutorなど）で計算する。
+    """
+    iterations = get_hash_iterations()
+    return list(executor.map(_encode_password_hash, passwords, [iterations] * len(passwords), chunksize=chunksize))
+
+def verify_password(password, stored_hash):
+    """パスワードを検証する"""
+    try:
+        return _run_in_pool(_check_password, password, stored_hash)
+    except PasswordHasherBusy:
+        raise
+    except Exception:
+        return False
+
+def needs_rehash(stored_hash):
+    """現在の設定でハッシュを作り直すべきか判定する
+
+    反復回数は設定値（PASSWORD_HASH_ITERATIONS）と比較する。自動調整の場合は測定値がプロセスごとに
+    異なり、ログインのたびに作り直すことにならないよう、下限（MIN_ITERATIONS）未満の場合だけ作り直す。
+    """
+    try:
+        algorithm, iterations, _, _ = parse_password_hash(stored_hash)
+    except Exception:
+        return False
+    required_iterations = PASSWORD_HASH_CONFIG["iterations"] or MIN_ITERATIONS
+    return algorithm != PASSWORD_HASH_ALGORITHM or iterations < required_iterations
@@ -0,0 +1,10 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+def create_process_pool(max_workers=None):
+    """CPUを使う計算用のプロセスプールを作成する
+
+    Streamlitやgoogle-cloud-firestoreはgRPCなどのスレッドを持つため、
+    プロセスをforkするとワーカーが固まることがある。ワーカーは常にspawnで起動する。
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
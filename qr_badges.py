@@ -0,0 +1,243 @@
+"""
+全参加者のQRコードバッジをA4シート（PNG・PDF）として一括生成するモジュール
+管理者パネルから実行するほか、python qr_badges.py <出力ディレクトリ> でも実行できます。
+"""
+
+import os
+import sys
+import zlib
+from io import BytesIO
+from PIL import Image, ImageDraw, ImageFont
+from config import APP_CONFIG, BADGE_CONFIG
+from process_pool import create_process_pool
+from qr_utils import generate_qr_png, get_user_page_url
+
+# A4サイズ（ミリメートル）
+A4_SIZE_MM = (210, 297)
+
+# 日本語の表示名を描画するためのフォント候補（BADGE_FONT_PATHが優先される）
+FONT_CANDIDATES = [
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/fonts-japanese-gothic.ttf",
+    "/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc",
+    "C:/Windows/Fonts/meiryo.ttc"
+]
+
+def _render_badge_qr(args):
+    """ワーカープロセスでQRコードを生成する"""
+    user_id, display_name, base_url = args
+    return user_id, display_name, generate_qr_png(get_user_page_url(user_id, base_url), size=10, border=2)
+
+def _load_font(size):
+    """表示名用のフォントを読み込む"""
+    candidates = [BADGE_CONFIG["font_path"]] + FONT_CANDIDATES
+    for path in candidates:
+        if path and os.path.exists(path):
+            return ImageFont.truetype(path, size)
+    return ImageFont.load_default(size)
+
+class StreamingPdfWriter:
+    """ページを1枚ずつ書き出すPDFライター
+
+    Pillowの追記モードはページを追加するたびに既存のPDFを読み直すため、
+    ページ数が多い場合はこちらで画像を直接書き出す。
+    """
+
+    def __init__(self, path, dpi):
+        self.dpi = dpi
+        self._file = open(path, "wb")
+        self._offsets = {}
+        self._page_ids = []
+        # 1: カタログ、2: ページツリー（最後に書き出す）
+        self._next_id = 3
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write_object(self, object_id, body, stream=None):
+        self._offsets[object_id] = self._file.tell()
+        self._file.write(f"{object_id} 0 obj\n".encode("ascii"))
+        self._file.write(body)
+        if stream is not None:
+            self._file.write(b"\nstream\n")
+            self._file.write(stream)
+            self._file.write(b"\nendstream")
+        self._file.write(b"\nendobj\n")
+
+    def _allocate(self, count):
+        first_id = self._next_id
+        self._next_id += count
+        return range(first_id, first_id + count)
+
+    def add_page(self, image):
+        """グレースケール画像を1ページとして書き出す"""
+        image_id, content_id, page_id = self._allocate(3)
+        width, height = image.size
+        data = zlib.compress(image.convert("L").tobytes(), 6)
+        self._write_object(image_id, (
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode /Length {len(data)} >>"
+        ).encode("ascii"), data)
+
+        page_width = width * 72 / self.dpi
+        page_height = height * 72 / self.dpi
+        content = f"q {page_width:.2f} 0 0 {page_height:.2f} 0 0 cm /Im0 Do Q".encode("ascii")
+        self._write_object(content_id, f"<< /Length {len(content)} >>".encode("ascii"), content)
+        self._write_object(page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width:.2f} {page_height:.2f}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode("ascii"))
+        self._page_ids.append(page_id)
+
+    def close(self):
+        """ページツリーと相互参照表を書き出してファイルを閉じる"""
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        self._write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>".encode("ascii"))
+
+        xref_offset = self._file.tell()
+        self._file.write(f"xref\n0 {self._next_id}\n".encode("ascii"))
+        self._file.write(b"0000000000 65535 f \n")
+        for object_id in range(1, self._next_id):
+            self._file.write(f"{self._offsets[object_id]:010d} 00000 n \n".encode("ascii"))
+        self._file.write((
+            f"trailer\n<< /Size {self._next_id} /Root 1 0 R >>\n"
+            f"startxref\n{xref_offset}\n%%EOF\n"
+        ).encode("ascii"))
+        self._file.close()
+
+class BadgeSheetLayout:
+    """A4シート上のバッジの配置"""
+
+    def __init__(self, dpi=200, columns=3, rows=4, margin_mm=10):
+        self.dpi = dpi
+        self.columns = columns
+        self.rows = rows
+        self.sheet_size = tuple(round(mm / 25.4 * dpi) for mm in A4_SIZE_MM)
+        self.margin = round(margin_mm / 25.4 * dpi)
+        self.cell_width = (self.sheet_size[0] - self.margin * 2) // columns
+        self.cell_height = (self.sheet_size[1] - self.margin * 2) // rows
+        self.label_height = self.cell_height // 6
+        self.qr_size = min(self.cell_width, self.cell_height - self.label_height) * 9 // 10
+        self.font = _load_font(self.label_height // 2)
+
+    @property
+    def badges_per_sheet(self):
+        return self.columns * self.rows
+
+    def new_sheet(self):
+        """空のシートを作成する"""
+        return Image.new("L", self.sheet_size, 255)
+
+    def place(self, sheet, index, display_name, qr_png):
+        """シートのindex番目の位置にバッジを描画する"""
+        column, row = index % self.columns, index // self.columns
+        left = self.margin + column * self.cell_width
+        top = self.margin + row * self.cell_height
+
+        with Image.open(BytesIO(qr_png)) as qr_image:
+            qr_image = qr_image.convert("L").resize((self.qr_size, self.qr_size), Image.Resampling.NEAREST)
+        sheet.paste(qr_image, (left + (self.cell_width - self.qr_size) // 2, top))
+
+        draw = ImageDraw.Draw(sheet)
+        label_center = (left + self.cell_width // 2, top + self.qr_size + self.label_height // 2)
+        draw.text(label_center, display_name, fill=0, font=self.font, anchor="mm")
+        # 切り取り線
+        draw.rectangle(
+            (left, top, left + self.cell_width - 1, top + self.cell_height - 1),
+            outline=200
+        )
+
+def generate_badge_sheets(users, output_dir, total=None, progress_callback=None,
+                          base_url=None, layout=None, max_workers=None, chunk_size=200):
+    """ユーザーのQRコードバッジをA4シートに配置してPNGとPDFに保存する
+
+    usersは(ユーザーID, 表示名)を返すイテラブル。chunk_size件ずつワーカーに渡すため、
+    参加者数に関わらずメモリ使用量はシート1枚分とチャンク1つ分に収まる。
+
+    Returns:
+        (PDFファイルのパス, 生成したバッジ数, シート数)
+    """
+    base_url = base_url or APP_CONFIG["base_url"]
+    layout = layout or BadgeSheetLayout(BADGE_CONFIG["dpi"])
+    max_workers = max_workers or BADGE_CONFIG["workers"]
+    os.makedirs(output_dir, exist_ok=True)
+    pdf_path = os.path.join(output_dir, "badges.pdf")
+    pdf_writer = StreamingPdfWriter(pdf_path, layout.dpi)
+
+    badge_count = 0
+    sheet_count = 0
+    sheet = None
+
+    def flush_sheet():
+        nonlocal sheet, sheet_count
+        sheet_count += 1
+        sheet.save(os.path.join(output_dir, f"badges_{sheet_count:04d}.png"))
+        # PDFへは1ページずつ書き出し、全シートをメモリに保持しない
+        pdf_writer.add_page(sheet)
+        sheet = None
+
+    with create_process_pool(max_workers) as executor:
+        chunk = []
+        users = iter(users)
+        while True:
+            for user_id, display_name in users:
+                chunk.append((user_id, display_name, base_url))
+                if len(chunk) == chunk_size:
+                    break
+
+            if not chunk:
+                break
+
+            for user_id, display_name, qr_png in executor.map(_render_badge_qr, chunk, chunksize=16):
+                if sheet is None:
+                    sheet = layout.new_sheet()
+                layout.place(sheet, badge_count % layout.badges_per_sheet, display_name, qr_png)
+                badge_count += 1
+                if badge_count % layout.badges_per_sheet == 0:
+                    flush_sheet()
+
+            chunk = []
+            if progress_callback:
+                progress_callback(badge_count, total)
+
+    if sheet is not None:
+        flush_sheet()
+    pdf_writer.close()
+    return pdf_path, badge_count, sheet_count
+
+def generate_all_badge_sheets(output_dir, progress_callback=None):
+    """登録済みの全ユーザーのバッジシートを生成する（管理者用）
+
+    読み込みに失敗した場合は、一部のユーザーだけのシートを返さないよう例外を送出する。
+    """
+    from database import count_users, iter_all_users
+
+    users = (
+        (user['user_id'], user.get('display_name', ''))
+        for user in iter_all_users(['user_id', 'display_name'])
+    )
+    return generate_badge_sheets(users, output_dir, total=count_users(), progress_callback=progress_callback)
+
+def main():
+    """コマンドラインからバッジシートを生成する"""
+    from config import STORAGE_CONFIG, initialize_firebase
+
+    if len(sys.argv) != 2:
+        print("使い方: python qr_badges.py <出力ディレクトリ>")
+        return
+    if STORAGE_CONFIG["backend"] == "firestore" and not initialize_firebase():
+        print("Firebaseの初期化に失敗しました。")
+        return
+
+    def print_progress(done, total):
+        print(f"{done}/{total or '?'} 人のバッジを生成しました")
+
+    try:
+        pdf_path, badge_count, sheet_count = generate_all_badge_sheets(sys.argv[1], print_progress)
+    except Exception as e:
+        print(f"バッジシート生成エラー: {e}")
+        return
+    print(f"{badge_count}人分のバッジを{sheet_count}枚のシートに出力しました: {pdf_path}")
+
+if __name__ == "__main__":
+    main()
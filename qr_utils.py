@@ -1,45 +1,218 @@
 import qrcode
+import numpy as np
 import streamlit as st
 from io import BytesIO
 import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
 from PIL import Image
+from config import QR_CACHE_CONFIG, QR_RENDERER
+from metrics import instrumented
 
-def generate_qr_code(data, size=10):
-    """QRコードを生成する"""
-    try:
-        # QRコードを生成
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=size,
-            border=4,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
+class QRCodeCache:
+    """生成済みQRコード画像のLRUキャッシュ（スレッドセーフ）
+    
+    persist_dirを指定すると、メモリから追い出された画像もディスクから復元できる。
+    """
+    
+    def __init__(self, max_entries=1024, persist_dir=None):
+        self.max_entries = max_entries
+        self.persist_dir = persist_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def _path(self, key):
+        digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.persist_dir, f"{digest}.img")
+    
+    def get(self, key):
+        """キャッシュから画像データを取得する（無い場合はNone）"""
+        with self._lock:
+            png_bytes = self._entries.get(key)
+            if png_bytes is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return png_bytes
         
-        # PIL Imageとして生成
-        qr_image = qr.make_image(fill_color="black", back_color="white")
+        if self.persist_dir:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    png_bytes = f.read()
+            except FileNotFoundError:
+                png_bytes = None
+            if png_bytes is not None:
+                self._store(key, png_bytes)
+                with self._lock:
+                    self.hits += 1
+                return png_bytes
         
-        # BytesIOに変換
-        buffer = BytesIO()
-        qr_image.save(buffer, format="PNG")
-        buffer.seek(0)
-        
-        return buffer
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def put(self, key, png_bytes):
+        """画像データをキャッシュに保存する"""
+        self._store(key, png_bytes)
+        if self.persist_dir:
+            os.makedirs(self.persist_dir, exist_ok=True)
+            path = self._path(key)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(png_bytes)
+            os.replace(temp_path, path)
+    
+    def _store(self, key, png_bytes):
+        with self._lock:
+            self._entries[key] = png_bytes
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        """メモリ上のキャッシュと統計をクリアする"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+    
+    def stats(self):
+        """キャッシュの統計情報を取得する"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+# プロセス全体で共有するキャッシュ
+qr_code_cache = QRCodeCache(QR_CACHE_CONFIG["max_entries"], QR_CACHE_CONFIG["persist_dir"])
+
+# 選択できるQRコードの描画方式
+QR_RENDERERS = ('pil', 'numpy', 'svg')
+
+def _render_qr_png(data, box_size, border, error_correction):
+    """qrcodeのPIL描画でQRコードを生成してPNGデータを返す"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=error_correction,
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    
+    # PIL Imageとして生成
+    qr_image = qr.make_image(fill_color="black", back_color="white")
+    
+    buffer = BytesIO()
+    qr_image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def build_qr_matrix(data, error_correction=qrcode.constants.ERROR_CORRECT_L):
+    """QRコードのモジュール配置を真偽値の2次元配列として取得する（余白なし、Trueが黒）"""
+    qr = qrcode.QRCode(version=1, error_correction=error_correction, border=0)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return np.array(qr.get_matrix(), dtype=bool)
+
+def rasterize_qr_matrix(matrix, box_size, border):
+    """モジュール配置を配列の繰り返しで拡大し、1ビットのPNGデータを返す"""
+    # 1ビット画像ではTrueが白になるため反転してから余白を付ける
+    modules = np.pad(~matrix, border, constant_values=True)
+    pixels = modules.repeat(box_size, axis=0).repeat(box_size, axis=1)
+    
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def render_qr_svg(matrix, border):
+    """モジュール配置を1つのpath要素で表すSVGデータを返す"""
+    size = matrix.shape[0] + border * 2
+    commands = []
+    for y, row in enumerate(matrix):
+        # 行内で黒が連続する区間を1つの矩形にまとめる
+        edges = np.flatnonzero(np.diff(np.concatenate(([False], row, [False])).astype(np.int8)))
+        for start, stop in zip(edges[::2], edges[1::2]):
+            commands.append(f"M{start + border} {y + border}h{stop - start}v1h-{stop - start}z")
+    
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path d="{"".join(commands)}" fill="#000"/></svg>'
+    ).encode('utf-8')
+
+@instrumented
+def render_qr_image(data, size=10, border=4, error_correction=qrcode.constants.ERROR_CORRECT_L, renderer='numpy'):
+    """指定した描画方式でQRコードを生成する（キャッシュは使用しない）"""
+    if renderer == 'pil':
+        return _render_qr_png(data, size, border, error_correction)
+    
+    matrix = build_qr_matrix(data, error_correction)
+    if renderer == 'numpy':
+        return rasterize_qr_matrix(matrix, size, border)
+    if renderer == 'svg':
+        return render_qr_svg(matrix, border)
+    raise ValueError(f"不明な描画方式です: {renderer}")
+
+@instrumented
+def generate_qr_image(data, size=10, border=4, error_correction=qrcode.constants.ERROR_CORRECT_L, renderer=None):
+    """QRコードの画像データを取得する（生成済みの場合はキャッシュから返す）
+    
+    rendererが'svg'の場合はSVG、それ以外はPNGのデータを返す。
+    """
+    renderer = renderer or QR_RENDERER
+    # SVGは拡大率に依存しない
+    key = (data, None if renderer == 'svg' else size, border, error_correction, renderer)
+    image_bytes = qr_code_cache.get(key)
+    if image_bytes is None:
+        image_bytes = render_qr_image(data, size, border, error_correction, renderer)
+        qr_code_cache.put(key, image_bytes)
+    return image_bytes
+
+@instrumented
+def generate_qr_png(data, size=10, border=4, error_correction=qrcode.constants.ERROR_CORRECT_L):
+    """QRコードのPNGデータを取得する（生成済みの場合はキャッシュから返す）"""
+    renderer = 'numpy' if QR_RENDERER == 'svg' else QR_RENDERER
+    return generate_qr_image(data, size, border, error_correction, renderer)
+
+@instrumented
+def generate_qr_code(data, size=10, image_format='png'):
+    """QRコードを生成する
+    
+    image_formatが'svg'の場合はSVG、それ以外はst.imageで表示できるPNGを返す
+    （PNGの描画方式はQR_RENDERERに従い、'svg'の場合は'numpy'で描画する）。
+    """
+    try:
+        if image_format == 'svg':
+            return BytesIO(generate_qr_image(data, size, renderer='svg'))
+        return BytesIO(generate_qr_png(data, size))
     except Exception as e:
         st.error(f"QRコード生成エラー: {e}")
         return None
 
-def generate_user_qr_code(user_id, base_url):
+def get_user_page_url(user_id, base_url):
+    """個別ユーザーページのURLを生成する"""
+    return f"{base_url}/?user_id={user_id}"
+
+@instrumented
+def generate_user_qr_code(user_id, base_url, image_format='png'):
     """ユーザーのマイページURL用のQRコードを生成する"""
-    # 個別ユーザーページのURLを生成
-    user_url = f"{base_url}/?user_id={user_id}"
-    return generate_qr_code(user_url)
+    return generate_qr_code(get_user_page_url(user_id, base_url), image_format=image_format)
 
-def display_qr_code(qr_buffer, caption="QRコード"):
-    """QRコードをStreamlitで表示する"""
+def display_qr_code(qr_buffer, caption="QRコード", svg_buffer=None):
+    """QRコードをStreamlitで表示する（svg_bufferを指定すると、SVGのダウンロードボタンも表示する）"""
     if qr_buffer:
         st.image(qr_buffer, caption=caption, use_container_width=True)
+        if svg_buffer:
+            download_qr_code_button(svg_buffer, "qr_code.svg", "QRコードをダウンロード（SVG）", mime="image/svg+xml")
         return True
     return False
 
@@ -51,7 +224,7 @@ def get_qr_code_as_base64(qr_buffer):
         return base64.b64encode(qr_data).decode()
     return None
 
-def download_qr_code_button(qr_buffer, filename="qr_code.png", button_text="QRコードをダウンロード"):
+def download_qr_code_button(qr_buffer, filename="qr_code.png", button_text="QRコードをダウンロード", mime="image/png"):
     """QRコードのダウンロードボタンを表示する"""
     if qr_buffer:
         qr_buffer.seek(0)
@@ -59,7 +232,7 @@ def download_qr_code_button(qr_buffer, filename="qr_code.png", button_text="QR
             label=button_text,
             data=qr_buffer.read(),
             file_name=filename,
-            mime="image/png"
+            mime=mime
         )
         return True
     return False
@@ -0,0 +1,45 @@
+import streamlit as st
+from config import MIRROR_CONFIG, STORAGE_CONFIG
+from metrics import instrument_repository, mirror_observers
+from storage.base import (
+    DELETE_FIELD, EMAIL_INDEX_COLLECTION, FRIENDS_COLLECTION, USERS_COLLECTION,
+    EmailAlreadyRegistered, UserNotFound, UserRepository, normalize_email
+)
+
+def create_user_repository(backend, sqlite_path=None):
+    """バックエンド名を指定してユーザーリポジトリを作成する"""
+    if backend == 'firestore':
+        from storage.firestore_backend import FirestoreUserRepository
+        return FirestoreUserRepository()
+    if backend == 'sqlite':
+        from storage.sqlite_backend import SqliteUserRepository
+        return SqliteUserRepository(sqlite_path or STORAGE_CONFIG["sqlite_path"], STORAGE_CONFIG["sqlite_pool_size"])
+    if backend == 'memory':
+        from storage.memory_backend import MemoryUserRepository
+        return MemoryUserRepository()
+    raise ValueError(f"不明なストレージです: {backend}")
+
+_repository_override = None
+
+@st.cache_resource(show_spinner=False)
+def _get_configured_repository():
+    repository = instrument_repository(create_user_repository(STORAGE_CONFIG["backend"]))
+    if MIRROR_CONFIG["enabled"]:
+        # 複製から返した読み込みは保存先の読み込みとして数えないよう、計測用のラッパーの外側に付ける
+        from storage.mirror import MirroredUserRepository
+        repository = MirroredUserRepository(
+            repository, MIRROR_CONFIG["pending_seconds"], MIRROR_CONFIG["reconnect_seconds"], *mirror_observers()
+        )
+        repository.start()
+    return repository
+
+def get_user_repository():
+    """設定されたユーザーリポジトリを取得する（プロセス全体で共有する）"""
+    if _repository_override is not None:
+        return _repository_override
+    return _get_configured_repository()
+
+def override_user_repository(repository):
+    """get_user_repositoryが返すリポジトリを差し替える（ベンチマーク用、Noneで設定に戻す）"""
+    global _repository_override
+    _repository_override = repository
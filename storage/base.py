@@ -0,0 +1,238 @@
+import copy
+import unicodedata
+
+# ユーザー情報のコレクション（テーブル）名
+USERS_COLLECTION = 'users'
+
+# メールアドレス索引のコレクション（ドキュメントIDは正規化したメールアドレス）
+EMAIL_INDEX_COLLECTION = 'emails'
+
+# 友達関係のサブコレクション（users/{ユーザーID}/friends/{友達のユーザーID}）
+FRIENDS_COLLECTION = 'friends'
+
+class _DeleteField:
+    def __repr__(self):
+        return 'DELETE_FIELD'
+
+# updateの値に指定すると、そのフィールドを削除する
+DELETE_FIELD = _DeleteField()
+
+class EmailAlreadyRegistered(Exception):
+    """メールアドレスが既に登録されている"""
+
+class UserNotFound(Exception):
+    """ユーザーが見つからない"""
+
+def normalize_email(email):
+    """メールアドレスを比較用に正規化する（全角・大文字小文字・前後の空白の違いを無視する）"""
+    return unicodedata.normalize('NFKC', email).strip().lower()
+
+def project_fields(user, fields):
+    """ユーザーデータから指定したフィールドだけを取り出す（'a.b'形式の入れ子にも対応）"""
+    if fields is None:
+        return copy.deepcopy(user)
+
+    projected = {}
+    for field_path in fields:
+        keys = field_path.split('.')
+        value = user
+        for key in keys:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = projected
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+            target[keys[-1]] = copy.deepcopy(value)
+    return projected
+
+def apply_update(user, update_data):
+    """ユーザーデータに更新を適用する（'a.b'形式のフィールドは入れ子の値を更新する）"""
+    for field_path, value in update_data.items():
+        keys = field_path.split('.')
+        target = user
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        if value is DELETE_FIELD:
+            target.pop(keys[-1], None)
+        else:
+            target[keys[-1]] = copy.deepcopy(value)
+
+def page_sort_key(user, order_by):
+    """一覧の並び順のキー（同じ値の場合はユーザーIDで順序を決める）"""
+    return (user[order_by], user['user_id'])
+
+class UserRepository:
+    """ユーザー情報の保存先のインターフェース
+
+    database.pyの各関数はこのインターフェースを通してデータを読み書きする。
+    実装ごとの振る舞いはstorage.conformanceで確認できる。
+    """
+
+    # 設定で指定するバックエンド名
+    name = None
+
+    def get(self, user_id, fields=None):
+        """ユーザーを取得する（存在しない場合はNone）"""
+        raise NotImplementedError
+
+    def get_many(self, user_ids, fields=None):
+        """複数のユーザーを取得し、ユーザーIDをキーとする辞書で返す（存在しないユーザーは含まない）"""
+        raise NotImplementedError
+
+    def get_by_email(self, email):
+        """メールアドレス（正規化して比較）でユーザーを取得する"""
+        raise NotImplementedError
+
+    def get_user_id_by_email(self, email):
+        """メールアドレス（正規化して比較）で登録されたユーザーのIDを取得する（存在しない場合はNone）
+
+        ユーザー本体はget_user_by_idの読み込みキャッシュから取得できるよう、IDだけを返す。
+        """
+        raise NotImplementedError
+
+    def find_registered_emails(self, emails):
+        """登録済みのメールアドレスを、正規化したメールアドレスのsetで返す"""
+        raise NotImplementedError
+
+    def create(self, user_doc):
+        """ユーザーを作成する（メールアドレスが登録済みの場合はEmailAlreadyRegistered）"""
+        raise NotImplementedError
+
+    def create_each(self, user_docs):
+        """複数のユーザーをまとめて作成し、ユーザーごとの結果を返す
+
+        メールアドレスが登録済みのユーザーはEmailAlreadyRegisteredになり、他のユーザーは作成する。
+
+        Yields:
+            update_eachと同じ形式のバッチごとの結果
+        """
+        raise NotImplementedError
+
+    def update(self, user_id, update_data):
+        """ユーザーを更新する（存在しない場合はUserNotFound）
+
+        update_dataに'email'が含まれる場合はメールアドレス索引も付け替える。
+        """
+        raise NotImplementedError
+
+    def update_many(self, updates):
+        """複数のユーザーをまとめて更新する（updatesは(ユーザーID, 更新データ)のリスト）"""
+        raise NotImplementedError
+
+    def update_each(self, updates):
+        """複数のユーザーをまとめて更新し、ユーザーごとの結果を返す
+
+        update_manyと異なり、存在しないユーザーなどで失敗しても他のユーザーは更新する。
+        結果は書き込みのバッチが終わるたびに返す（バッチの順序は不定）。
+
+        Yields:
+            バッチごとの{ユーザーID: 失敗した場合は例外、成功した場合はNone}
+        """
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        """ユーザーとメールアドレス索引、ユーザーが追加した友達関係を削除する（削除した場合はTrue）"""
+        raise NotImplementedError
+
+    def delete_each(self, user_ids):
+        """複数のユーザーをまとめて削除し、ユーザーごとの結果を返す（存在しないユーザーはUserNotFound）
+
+        Yields:
+            update_eachと同じ形式のバッチごとの結果
+        """
+        raise NotImplementedError
+
+    def count(self):
+        """ユーザー数を取得する"""
+        raise NotImplementedError
+
+    def list_page(self, order_by, descending=False, limit=20, start_after=None, end_before=None, fields=None):
+        """並び順に従ってユーザーを最大limit件取得する
+
+        start_after・end_beforeには[order_byの値, ユーザーID]を指定する。
+        end_beforeを指定した場合は、その直前のlimit件を並び順どおりに返す。
+        order_byのフィールドを持たないユーザーは含まれない。
+        """
+        raise NotImplementedError
+
+    def iter_all(self, fields=None, start_after=None):
+        """すべてのユーザーをユーザーIDの順に1人ずつ返す
+
+        start_afterにユーザーIDを指定すると、そのユーザーIDより後のユーザーから返す
+        （中断したエクスポートなどの再開に使う）。
+        """
+        raise NotImplementedError
+
+    def search_by_interests(self, interests, fields=None):
+        """いずれかの興味のあるジャンルを持つユーザーを取得する"""
+        raise NotImplementedError
+
+    def watch(self, on_changes):
+        """ユーザーの変更を購読する（ミラー用、購読に対応していない保存先はNotImplementedError）
+
+        on_changesは最初に全員分、以降は変更があるたびに、購読のスレッドから
+        ({ユーザーID: ユーザー情報（削除された場合はNone）}, 保存先での読み込み時刻, 全員分かどうか)で呼び出される。
+
+        Returns:
+            unsubscribe()で購読を止め、is_activeで購読が続いているかを確認できるオブジェクト
+        """
+        raise NotImplementedError
+
+    def add_friend(self, user_id, friend_id):
+        """友達を追加し、ユーザーのfriend_countを増やす（1つのトランザクションで行う）
+
+        Returns:
+            追加した場合はTrue、既に友達の場合はFalse（ユーザーが存在しない場合はUserNotFound）
+        """
+        raise NotImplementedError
+
+    def remove_friend(self, user_id, friend_id):
+        """友達を削除し、ユーザーのfriend_countを減らす（削除した場合はTrue）"""
+        raise NotImplementedError
+
+    def is_friend(self, user_id, friend_id):
+        """friend_idがuser_idの友達かどうか"""
+        raise NotImplementedError
+
+    def list_friends(self, user_id, limit=20, start_after=None):
+        """友達を追加した順に最大limit件取得する
+
+        start_afterには[created_at, 友達のユーザーID]を指定する。
+
+        Returns:
+            {'friend_id': 友達のユーザーID, 'created_at': 追加日時}のリスト
+        """
+        raise NotImplementedError
+
+    def iter_friend_edges(self):
+        """すべての友達関係を(ユーザーID, 友達のユーザーID)のタプルで1件ずつ返す（順序は不定）"""
+        raise NotImplementedError
+
+    def migrate_friend_array(self, user_id):
+        """ユーザードキュメント内の友達の配列（'friends'）を友達関係のドキュメントに移行する
+
+        配列の順序を追加日時の順序として保持し、移行後は配列を削除してfriend_countを設定する。
+        何度実行しても同じ結果になる。
+
+        Returns:
+            作成した友達関係の数
+        """
+        raise NotImplementedError
+
+    def backfill_email_index(self):
+        """メールアドレス索引が無いユーザーの索引を作成する
+
+        Returns:
+            (作成した索引の数, 他のユーザーとメールアドレスが重複していたユーザーIDのリスト)
+        """
+        raise NotImplementedError
+
+    def health_check(self):
+        """接続状態を確認する
+
+        Returns:
+            {'ok': bool, 'latency_ms': float, 'detail': str, 'error': str}
+        """
+        raise NotImplementedError
@@ -0,0 +1,386 @@
+"""ユーザーリポジトリの共通動作確認
+
+すべてのバックエンドが同じ振る舞いをすることを確認する。
+
+使い方:
+    python -m storage.conformance memory
+    python -m storage.conformance sqlite
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m storage.conformance firestore
+"""
+import os
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from storage import DELETE_FIELD, EmailAlreadyRegistered, UserNotFound, create_user_repository
+
+class ConformanceError(AssertionError):
+    """リポジトリの振る舞いが仕様と異なる"""
+
+def _check(condition, message):
+    if not condition:
+        raise ConformanceError(message)
+
+def _make_user(index, base_time, **overrides):
+    user_doc = {
+        'user_id': str(uuid.uuid4()),
+        'email': f"user{index}@example.com",
+        'password_hash': None,
+        'has_password': False,
+        'display_name': f"ユーザー{index:02d}",
+        'profile': '',
+        'interests': ['技術'] if index % 2 == 0 else ['音楽'],
+        'photo': '',
+        'photo_renditions': {'thumb': f"blob:{index:064x}.webp"},
+        'sns_accounts': {},
+        'is_admin': False,
+        # 並び順の同値をユーザーIDで解決できるか確認するため、作成日時を2人ずつ同じにする
+        'created_at': base_time + timedelta(seconds=index // 2),
+        'updated_at': base_time
+    }
+    user_doc.update(overrides)
+    return user_doc
+
+def check_create_and_get(repository, users):
+    user = users[0]
+    _check(repository.get(user['user_id']) == user, "作成したユーザーを取得できません")
+    _check(repository.get(str(uuid.uuid4())) is None, "存在しないユーザーはNoneになるべきです")
+
+    projected = repository.get(user['user_id'], ['display_name', 'photo_renditions.thumb'])
+    _check(projected == {'display_name': user['display_name'], 'photo_renditions': user['photo_renditions']},
+           f"指定したフィールドだけを取得できません: {projected}")
+
+def check_duplicate_email(repository, users):
+    duplicate = _make_user(99, datetime.now(), email=" USER0@Example.com ")
+    try:
+        repository.create(duplicate)
+    except EmailAlreadyRegistered:
+        pass
+    else:
+        raise ConformanceError("正規化して同じメールアドレスのユーザーを作成できてしまいます")
+    _check(repository.get(duplicate['user_id']) is None, "重複したユーザーが保存されています")
+
+def check_get_many(repository, users):
+    missing_id = str(uuid.uuid4())
+    user_ids = [users[1]['user_id'], missing_id, users[2]['user_id']]
+    found = repository.get_many(user_ids, ['user_id', 'display_name'])
+    _check(set(found) == {users[1]['user_id'], users[2]['user_id']}, "一括取得の結果が正しくありません")
+    _check(found[users[1]['user_id']] == {'user_id': users[1]['user_id'], 'display_name': users[1]['display_name']},
+           "一括取得で指定したフィールドだけを取得できません")
+
+def check_get_by_email(repository, users):
+    found = repository.get_by_email("  ＵＳＥＲ3@EXAMPLE.COM ")
+    _check(found is not None and found['user_id'] == users[3]['user_id'], "メールアドレスを正規化して検索できません")
+    _check(repository.get_by_email("nobody@example.com") is None, "未登録のメールアドレスはNoneになるべきです")
+    _check(repository.get_user_id_by_email(" User3@Example.com") == users[3]['user_id'],
+           "メールアドレスを正規化してユーザーIDを取得できません")
+    _check(repository.get_user_id_by_email("nobody@example.com") is None, "未登録のメールアドレスのユーザーIDはNoneになるべきです")
+
+def check_find_registered_emails(repository, users):
+    emails = [users[0]['email'].upper(), f" {users[1]['email']} ", "unknown@example.com"]
+    registered = repository.find_registered_emails(emails)
+    _check(registered == {users[0]['email'].lower(), users[1]['email'].lower()},
+           f"登録済みのメールアドレスを判定できません: {registered}")
+    _check(repository.find_registered_emails([]) == set(), "空のリストの結果は空のsetになるべきです")
+
+def check_update(repository, users):
+    user = users[4]
+    repository.update(user['user_id'], {'display_name': "変更後", 'photo_renditions.thumb': "blob:changed.webp"})
+    updated = repository.get(user['user_id'])
+    _check(updated['display_name'] == "変更後", "更新が反映されていません")
+    _check(updated['photo_renditions']['thumb'] == "blob:changed.webp", "入れ子のフィールドを更新できません")
+    user['display_name'] = "変更後"
+    user['photo_renditions'] = {'thumb': "blob:changed.webp"}
+
+    try:
+        repository.update(str(uuid.uuid4()), {'display_name': "x"})
+    except UserNotFound:
+        pass
+    else:
+        raise ConformanceError("存在しないユーザーの更新はUserNotFoundになるべきです")
+
+def check_update_email(repository, users):
+    user = users[5]
+    repository.update(user['user_id'], {'email': "renamed@example.com"})
+    _check(repository.get_by_email("renamed@example.com")['user_id'] == user['user_id'],
+           "変更後のメールアドレスで検索できません")
+    _check(repository.get_by_email(user['email']) is None, "変更前のメールアドレスの索引が残っています")
+    user['email'] = "renamed@example.com"
+
+    try:
+        repository.update(user['user_id'], {'email': users[6]['email']})
+    except EmailAlreadyRegistered:
+        pass
+    else:
+        raise ConformanceError("他のユーザーのメールアドレスに変更できてしまいます")
+
+    # 表記だけが異なる同じメールアドレスへの変更は許可する
+    repository.update(user['user_id'], {'email': "Renamed@Example.com"})
+    user['email'] = "Renamed@Example.com"
+
+def check_update_many(repository, users):
+    repository.update_many([(user['user_id'], {'has_password': True}) for user in users[:3]])
+    for user in users[:3]:
+        _check(repository.get(user['user_id'], ['has_password']) == {'has_password': True}, "一括更新が反映されていません")
+        user['has_password'] = True
+
+def check_update_each(repository, users):
+    missing_id = str(uuid.uuid4())
+    updates = [(user['user_id'], {'is_admin': True}) for user in users[3:5]] + [(missing_id, {'is_admin': True})]
+    results = {}
+    for batch_results in repository.update_each(updates):
+        results.update(batch_results)
+    _check(set(results) == {user_id for user_id, _ in updates}, f"一括更新の結果が揃っていません: {results}")
+    _check(isinstance(results[missing_id], UserNotFound), "存在しないユーザーの結果はUserNotFoundになるべきです")
+    for user in users[3:5]:
+        _check(results[user['user_id']] is None, f"一括更新に失敗しました: {results[user['user_id']]}")
+        _check(repository.get(user['user_id'], ['is_admin']) == {'is_admin': True}, "一括更新が反映されていません")
+        user['is_admin'] = True
+    _check(repository.get(missing_id) is None, "存在しないユーザーが作成されました")
+
+def check_list_page(repository, users):
+    for order_by in ('created_at', 'display_name'):
+        for descending in (False, True):
+            expected = [user['user_id'] for user in
+                        sorted(users, key=lambda user: (user[order_by], user['user_id']), reverse=descending)]
+
+            # 前へ進む
+            seen = []
+            cursor = None
+            while True:
+                page = repository.list_page(order_by, descending, 3, start_after=cursor, fields=['user_id', order_by])
+                if not page:
+                    break
+                seen.extend(user['user_id'] for user in page)
+                cursor = [page[-1][order_by], page[-1]['user_id']]
+            _check(seen == expected, f"{order_by}（降順={descending}）のページ送りの順序が正しくありません")
+
+            # 後ろへ戻る
+            last = next(user for user in users if user['user_id'] == expected[-1])
+            page = repository.list_page(order_by, descending, 3, end_before=[last[order_by], last['user_id']],
+                                        fields=['user_id'])
+            _check([user['user_id'] for user in page] == expected[-4:-1],
+                   f"{order_by}（降順={descending}）の前のページが正しくありません")
+
+    # 並び替えのフィールドを持たないユーザーは含まれない
+    unordered = _make_user(98, datetime.now())
+    del unordered['created_at']
+    repository.create(unordered)
+    try:
+        listed_ids = [user['user_id'] for user in repository.list_page('created_at', limit=100, fields=['user_id'])]
+        _check(unordered['user_id'] not in listed_ids, "並び替えのフィールドを持たないユーザーが含まれています")
+    finally:
+        repository.delete(unordered['user_id'])
+
+def check_iter_and_count(repository, users):
+    _check(repository.count() == len(users), f"ユーザー数が正しくありません: {repository.count()}")
+    all_ids = sorted(user['user_id'] for user in repository.iter_all(['user_id']))
+    _check(all_ids == sorted(user['user_id'] for user in users), "全件取得の結果が正しくありません")
+
+def check_iter_all_start_after(repository, users):
+    all_ids = [user['user_id'] for user in repository.iter_all(['user_id'])]
+    _check(all_ids == sorted(all_ids), "全件取得がユーザーIDの順になっていません")
+    resumed_ids = [user['user_id'] for user in repository.iter_all(['user_id'], start_after=all_ids[4])]
+    _check(resumed_ids == all_ids[5:], "start_afterの次のユーザーから再開できません")
+    # 削除されたユーザーIDからも再開できる
+    resumed_ids = [user['user_id'] for user in repository.iter_all(['user_id'], start_after=all_ids[4] + '0')]
+    _check(resumed_ids == all_ids[5:], "存在しないユーザーIDの次から再開できません")
+
+def check_search_by_interests(repository, users):
+    found = {user['user_id'] for user in repository.search_by_interests(['技術'], ['user_id'])}
+    expected = {user['user_id'] for user in users if '技術' in user['interests']}
+    _check(found == expected, "興味のあるジャンルで検索できません")
+    _check(repository.search_by_interests(['存在しないジャンル']) == [], "該当しない検索結果が返されています")
+
+def check_friends(repository, users):
+    user_id = users[7]['user_id']
+    friend_ids = [users[index]['user_id'] for index in (8, 1, 9, 2, 3)]
+    for friend_id in friend_ids:
+        _check(repository.add_friend(user_id, friend_id) is True, "友達を追加できません")
+    _check(repository.add_friend(user_id, friend_ids[0]) is False, "既に友達の場合はFalseになるべきです")
+    _check(repository.is_friend(user_id, friend_ids[1]), "追加した友達が友達になっていません")
+    _check(not repository.is_friend(friend_ids[1], user_id), "友達関係は一方向であるべきです")
+    _check(repository.get(user_id, ['friend_count']) == {'friend_count': 5}, "friend_countが正しくありません")
+
+    # 追加した順にページ送りできる
+    listed_ids = []
+    cursor = None
+    while True:
+        page = repository.list_friends(user_id, 2, start_after=cursor)
+        if not page:
+            break
+        listed_ids.extend(edge['friend_id'] for edge in page)
+        cursor = [page[-1]['created_at'], page[-1]['friend_id']]
+    _check(listed_ids == friend_ids, f"友達の一覧の順序が正しくありません: {listed_ids}")
+
+    _check(repository.remove_friend(user_id, friend_ids[2]) is True, "友達を削除できません")
+    _check(repository.remove_friend(user_id, friend_ids[2]) is False, "友達でない場合の削除はFalseになるべきです")
+    _check(not repository.is_friend(user_id, friend_ids[2]), "削除した友達が残っています")
+    _check(repository.get(user_id, ['friend_count']) == {'friend_count': 4}, "削除後のfriend_countが正しくありません")
+    users[7]['friend_count'] = 4
+
+    try:
+        repository.add_friend(str(uuid.uuid4()), user_id)
+    except UserNotFound:
+        pass
+    else:
+        raise ConformanceError("存在しないユーザーへの友達追加はUserNotFoundになるべきです")
+
+def check_migrate_friend_array(repository, users):
+    user = users[9]
+    friend_ids = [users[index]['user_id'] for index in (4, 0, 6)]
+    # 移行前に追加された友達と、配列内の重複・自分自身は1件にまとめる
+    repository.add_friend(user['user_id'], friend_ids[1])
+    repository.update(user['user_id'], {'friends': friend_ids + [friend_ids[0], user['user_id']]})
+    created_count = repository.migrate_friend_array(user['user_id'])
+    _check(created_count == 2, f"移行した友達関係の数が正しくありません: {created_count}")
+    migrated = repository.get(user['user_id'])
+    _check('friends' not in migrated, "移行後も友達の配列が残っています")
+    _check(migrated['friend_count'] == 3, "移行後のfriend_countが正しくありません")
+    listed_ids = [edge['friend_id'] for edge in repository.list_friends(user['user_id'], 10)]
+    _check(listed_ids == [friend_ids[1], friend_ids[0], friend_ids[2]], f"移行後の友達の順序が正しくありません: {listed_ids}")
+    _check(repository.migrate_friend_array(user['user_id']) == 0, "移行済みのユーザーを再度移行できてしまいます")
+    user['friend_count'] = 3
+
+    # フィールドの削除
+    repository.update(user['user_id'], {'profile': DELETE_FIELD})
+    _check('profile' not in repository.get(user['user_id']), "DELETE_FIELDでフィールドを削除できません")
+    repository.update(user['user_id'], {'profile': user['profile']})
+
+def check_iter_friend_edges(repository, users):
+    expected = {
+        (user['user_id'], edge['friend_id'])
+        for user in users for edge in repository.list_friends(user['user_id'], len(users))
+    }
+    edges = list(repository.iter_friend_edges())
+    _check(len(edges) == len(expected) and set(edges) == expected, f"全友達関係の取得結果が正しくありません: {edges}")
+
+def check_backfill_email_index(repository, users):
+    created_count, duplicate_ids = repository.backfill_email_index()
+    _check((created_count, duplicate_ids) == (0, []), "索引済みのユーザーの索引が作成されました")
+
+def check_delete(repository, users):
+    user = users.pop()
+    repository.add_friend(user['user_id'], users[0]['user_id'])
+    _check(repository.delete(user['user_id']) is True, "削除に失敗しました")
+    _check(repository.get(user['user_id']) is None, "削除したユーザーを取得できます")
+    _check(repository.get_by_email(user['email']) is None, "削除したユーザーのメールアドレス索引が残っています")
+    _check(repository.delete(user['user_id']) is False, "存在しないユーザーの削除はFalseになるべきです")
+    _check(repository.list_friends(user['user_id']) == [], "削除したユーザーの友達関係が残っています")
+
+    # 削除したメールアドレスは再登録できる
+    replacement = _make_user(len(users), datetime.now(), email=user['email'], created_at=user['created_at'])
+    repository.create(replacement)
+    users.append(replacement)
+
+def check_delete_each(repository, users):
+    deleted = [users.pop(), users.pop()]
+    repository.add_friend(deleted[0]['user_id'], users[0]['user_id'])
+    missing_id = str(uuid.uuid4())
+    results = {}
+    for batch_results in repository.delete_each([user['user_id'] for user in deleted] + [missing_id]):
+        results.update(batch_results)
+    _check(isinstance(results.pop(missing_id, None), UserNotFound), "存在しないユーザーの結果はUserNotFoundになるべきです")
+    for user in deleted:
+        _check(results[user['user_id']] is None, f"一括削除に失敗しました: {results[user['user_id']]}")
+        _check(repository.get(user['user_id']) is None, "一括削除したユーザーを取得できます")
+        _check(repository.get_by_email(user['email']) is None, "一括削除したユーザーのメールアドレス索引が残っています")
+    _check(repository.list_friends(deleted[0]['user_id']) == [], "一括削除したユーザーの友達関係が残っています")
+
+    # 削除したメールアドレスは再登録できる
+    for user in reversed(deleted):
+        replacement = _make_user(len(users), datetime.now(), email=user['email'], created_at=user['created_at'])
+        repository.create(replacement)
+        users.append(replacement)
+
+def check_create_each(repository, users):
+    created = [_make_user(len(users) + offset, datetime.now()) for offset in range(2)]
+    duplicate = _make_user(97, datetime.now(), email=users[0]['email'].upper())
+    results = {}
+    for batch_results in repository.create_each(created + [duplicate]):
+        results.update(batch_results)
+    _check(isinstance(results.pop(duplicate['user_id'], None), EmailAlreadyRegistered),
+           "登録済みのメールアドレスの結果はEmailAlreadyRegisteredになるべきです")
+    _check(repository.get(duplicate['user_id']) is None, "登録済みのメールアドレスのユーザーが作成されました")
+    for user in created:
+        _check(results[user['user_id']] is None, f"一括作成に失敗しました: {results[user['user_id']]}")
+        _check(repository.get_by_email(user['email']) == user, "一括作成したユーザーをメールアドレスで取得できません")
+        users.append(user)
+
+def check_health(repository, users):
+    health = repository.health_check()
+    _check(health['ok'] and health['error'] is None, f"接続状態の確認に失敗しました: {health}")
+
+CHECKS = [
+    check_create_and_get,
+    check_duplicate_email,
+    check_get_many,
+    check_get_by_email,
+    check_find_registered_emails,
+    check_update,
+    check_update_email,
+    check_update_many,
+    check_update_each,
+    check_list_page,
+    check_iter_and_count,
+    check_iter_all_start_after,
+    check_search_by_interests,
+    check_friends,
+    check_migrate_friend_array,
+    check_iter_friend_edges,
+    check_backfill_email_index,
+    check_delete,
+    check_delete_each,
+    check_create_each,
+    check_list_page,
+    check_health
+]
+
+def run_conformance(repository, user_count=11):
+    """空のリポジトリに対してすべての確認を実行する
+
+    Returns:
+        失敗した確認の(名前, メッセージ)のリスト
+    """
+    if repository.count() != 0:
+        raise ValueError("空のリポジトリで実行してください")
+
+    base_time = datetime(2024, 1, 1)
+    users = [_make_user(index, base_time) for index in range(user_count)]
+    for user in users:
+        repository.create(user)
+
+    failures = []
+    for check in CHECKS:
+        try:
+            check(repository, users)
+        except Exception as e:
+            failures.append((check.__name__, str(e)))
+    return failures
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    backend = argv[0] if argv else 'memory'
+    if backend == 'firestore' and not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        print("Firestoreの確認はエミュレータでのみ実行できます（FIRESTORE_EMULATOR_HOSTを設定してください）")
+        return 2
+
+    if backend == 'sqlite':
+        # 既存のデータベースを汚さないよう、一時ファイルで確認する
+        with tempfile.TemporaryDirectory() as directory:
+            repository = create_user_repository(backend, sqlite_path=os.path.join(directory, 'conformance.db'))
+            try:
+                failures = run_conformance(repository)
+            finally:
+                repository.close()
+    else:
+        failures = run_conformance(create_user_repository(backend))
+    for name, message in failures:
+        print(f"❌ {name}: {message}")
+    if failures:
+        return 1
+    print(f"✅ {backend}: {len(CHECKS)}件の確認がすべて成功しました")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,470 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from urllib.parse import quote
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+from google.cloud.firestore_v1.watch import ChangeType
+from config import BULK_WRITE_CONFIG, EMAIL_INDEX_CONFIG, check_firestore_health, get_firestore_client, get_firestore_pool
+from storage.base import (
+    DELETE_FIELD, EMAIL_INDEX_COLLECTION, FRIENDS_COLLECTION, USERS_COLLECTION,
+    EmailAlreadyRegistered, UserNotFound, UserRepository, normalize_email
+)
+
+# 一括取得1回あたりのドキュメント数
+BULK_GET_CHUNK_SIZE = 100
+
+# iter_allで1回のクエリで読み込むドキュメント数
+ITER_PAGE_SIZE = 500
+
+# 1バッチあたりの書き込み上限
+BATCH_WRITE_LIMIT = 500
+
+def _commit_in_parallel(write_chunk, chunks):
+    """チャンクごとの書き込みを並行して実行し、終わった順に結果を返す"""
+    if not chunks:
+        return
+    workers = max(1, min(BULK_WRITE_CONFIG["workers"], len(chunks)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-write") as executor:
+        futures = [executor.submit(write_chunk, chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            yield future.result()
+
+def _email_index_ref(db, email):
+    """メールアドレス索引のドキュメント参照を取得する"""
+    # ドキュメントIDに使えない'/'などはエスケープする
+    document_id = quote(normalize_email(email), safe="@.+-_")
+    return db.collection(EMAIL_INDEX_COLLECTION).document(document_id)
+
+def _to_firestore_update(update_data):
+    """DELETE_FIELDをFirestoreのフィールド削除に置き換える"""
+    return {
+        field_path: firestore.DELETE_FIELD if value is DELETE_FIELD else value
+        for field_path, value in update_data.items()
+    }
+
+@firestore.transactional
+def _create_user_in_transaction(transaction, db, user_doc):
+    """メールアドレスの予約とユーザーの作成を1つのトランザクションで行う"""
+    email_ref = _email_index_ref(db, user_doc['email'])
+    if email_ref.get(transaction=transaction).exists:
+        raise EmailAlreadyRegistered()
+
+    transaction.create(email_ref, {'user_id': user_doc['user_id'], 'email': user_doc['email']})
+    transaction.create(db.collection(USERS_COLLECTION).document(user_doc['user_id']), user_doc)
+
+@firestore.transactional
+def _update_user_with_email_in_transaction(transaction, db, user_id, update_data):
+    """メールアドレスの変更を伴う更新を、索引の付け替えと合わせて行う"""
+    user_ref = db.collection(USERS_COLLECTION).document(user_id)
+    user_doc = user_ref.get(field_paths=['email'], transaction=transaction)
+    if not user_doc.exists:
+        raise UserNotFound(user_id)
+
+    current_email = user_doc.to_dict().get('email')
+    new_email_ref = _email_index_ref(db, update_data['email'])
+    if not current_email or normalize_email(current_email) != normalize_email(update_data['email']):
+        if new_email_ref.get(transaction=transaction).exists:
+            raise EmailAlreadyRegistered()
+        if current_email:
+            transaction.delete(_email_index_ref(db, current_email))
+    transaction.set(new_email_ref, {'user_id': user_id, 'email': update_data['email']})
+    transaction.update(user_ref, _to_firestore_update(update_data))
+
+@firestore.transactional
+def _change_friend_in_transaction(transaction, user_ref, friend_id, add):
+    """友達関係の作成・削除とfriend_countの増減を1つのトランザクションで行う"""
+    edge_ref = user_ref.collection(FRIENDS_COLLECTION).document(friend_id)
+    # トランザクション内では書き込みの前にすべて読み込む
+    user_doc = user_ref.get(field_paths=['user_id'], transaction=transaction)
+    edge_doc = edge_ref.get(transaction=transaction)
+    if not user_doc.exists:
+        raise UserNotFound(user_ref.id)
+    if edge_doc.exists == add:
+        return False
+
+    if add:
+        transaction.create(edge_ref, {'friend_id': friend_id, 'created_at': datetime.now()})
+    else:
+        transaction.delete(edge_ref)
+    transaction.update(user_ref, {'friend_count': firestore.Increment(1 if add else -1)})
+    return True
+
+class FirestoreUserRepository(UserRepository):
+    """Cloud Firestoreに保存するユーザーリポジトリ"""
+
+    name = 'firestore'
+
+    def __init__(self):
+        # 接続プールを作成し、起動時に接続を確立しておく
+        get_firestore_pool()
+
+    def _db(self):
+        db = get_firestore_client()
+        if not db:
+            raise ConnectionError("データベース接続エラー")
+        return db
+
+    def _users(self, db):
+        return db.collection(USERS_COLLECTION)
+
+    def get(self, user_id, fields=None):
+        user_doc = self._users(self._db()).document(user_id).get(field_paths=fields)
+        return user_doc.to_dict() if user_doc.exists else None
+
+    def get_many(self, user_ids, fields=None):
+        db = self._db()
+        users = {}
+        for start in range(0, len(user_ids), BULK_GET_CHUNK_SIZE):
+            refs = [self._users(db).document(user_id) for user_id in user_ids[start:start + BULK_GET_CHUNK_SIZE]]
+            for user_doc in db.get_all(refs, field_paths=fields):
+                if user_doc.exists:
+                    users[user_doc.id] = user_doc.to_dict()
+        return users
+
+    def _find_by_email_query(self, db, email):
+        """索引を使わずにメールアドレスでユーザーを検索する（旧データ用）"""
+        for candidate in (email.strip(), normalize_email(email)):
+            for user_doc in self._users(db).where('email', '==', candidate).limit(1).stream():
+                return user_doc.to_dict()
+        return None
+
+    def get_by_email(self, email):
+        db = self._db()
+        index_doc = _email_index_ref(db, email).get()
+        if index_doc.exists:
+            user = self.get(index_doc.get('user_id'))
+            if user:
+                return user
+
+        if EMAIL_INDEX_CONFIG["fallback"]:
+            return self._find_by_email_query(db, email)
+        return None
+
+    def get_user_id_by_email(self, email):
+        db = self._db()
+        index_doc = _email_index_ref(db, email).get()
+        if index_doc.exists:
+            return index_doc.get('user_id')
+
+        if EMAIL_INDEX_CONFIG["fallback"]:
+            user = self._find_by_email_query(db, email)
+            return user['user_id'] if user else None
+        return None
+
+    def find_registered_emails(self, emails):
+        db = self._db()
+        # 索引のドキュメントID -> (正規化したメールアドレス, メールアドレス, 参照)
+        refs = {}
+        for email in emails:
+            ref = _email_index_ref(db, email)
+            refs[ref.id] = (normalize_email(email), email, ref)
+        document_ids = list(refs)
+        registered = set()
+        for start in range(0, len(document_ids), BULK_GET_CHUNK_SIZE):
+            chunk = [refs[document_id][2] for document_id in document_ids[start:start + BULK_GET_CHUNK_SIZE]]
+            registered.update(refs[index_doc.id][0] for index_doc in db.get_all(chunk) if index_doc.exists)
+
+        # 索引が未整備の旧データとの重複も確認する
+        if EMAIL_INDEX_CONFIG["fallback"]:
+            for email_key, email, _ in refs.values():
+                if email_key not in registered and self._find_by_email_query(db, email):
+                    registered.add(email_key)
+        return registered
+
+    def create(self, user_doc):
+        db = self._db()
+        # 索引が未整備の旧データとの重複も確認する
+        if EMAIL_INDEX_CONFIG["fallback"] and self._find_by_email_query(db, user_doc['email']):
+            raise EmailAlreadyRegistered()
+        _create_user_in_transaction(db.transaction(), db, user_doc)
+
+    def create_each(self, user_docs):
+        db = self._db()
+        # ユーザーとメールアドレス索引の2件を作成するため、1バッチあたりのユーザー数は半分にする
+        chunk_size = BATCH_WRITE_LIMIT // 2
+        chunks = [user_docs[start:start + chunk_size] for start in range(0, len(user_docs), chunk_size)]
+        return _commit_in_parallel(lambda chunk: self._create_chunk(db, chunk), chunks)
+
+    def _create_chunk(self, db, chunk):
+        registered = self.find_registered_emails([user_doc['email'] for user_doc in chunk])
+        results = {}
+        batch = db.batch()
+        batch_docs = []
+        for user_doc in chunk:
+            if normalize_email(user_doc['email']) in registered:
+                results[user_doc['user_id']] = EmailAlreadyRegistered()
+                continue
+            batch.create(_email_index_ref(db, user_doc['email']), {'user_id': user_doc['user_id'], 'email': user_doc['email']})
+            batch.create(self._users(db).document(user_doc['user_id']), user_doc)
+            batch_docs.append(user_doc)
+        try:
+            if batch_docs:
+                batch.commit()
+            results.update((user_doc['user_id'], None) for user_doc in batch_docs)
+        except Exception:
+            # 確認後に他の処理で登録された場合などは、1人ずつ作成して失敗したユーザーを特定する
+            for user_doc in batch_docs:
+                try:
+                    self.create(user_doc)
+                    results[user_doc['user_id']] = None
+                except Exception as e:
+                    results[user_doc['user_id']] = e
+        return results
+
+    def update(self, user_id, update_data):
+        db = self._db()
+        if 'email' in update_data:
+            _update_user_with_email_in_transaction(db.transaction(), db, user_id, update_data)
+            return
+
+        try:
+            self._users(db).document(user_id).update(_to_firestore_update(update_data))
+        except NotFound:
+            raise UserNotFound(user_id)
+
+    def update_many(self, updates):
+        db = self._db()
+        for start in range(0, len(updates), BATCH_WRITE_LIMIT):
+            batch = db.batch()
+            for user_id, update_data in updates[start:start + BATCH_WRITE_LIMIT]:
+                batch.update(self._users(db).document(user_id), _to_firestore_update(update_data))
+            batch.commit()
+
+    def update_each(self, updates):
+        db = self._db()
+        chunks = [updates[start:start + BATCH_WRITE_LIMIT] for start in range(0, len(updates), BATCH_WRITE_LIMIT)]
+        return _commit_in_parallel(lambda chunk: self._update_chunk(db, chunk), chunks)
+
+    def _update_chunk(self, db, chunk):
+        # メールアドレスの変更は索引の付け替えが必要なため、トランザクションで1人ずつ更新する
+        email_updates = [(user_id, update_data) for user_id, update_data in chunk if 'email' in update_data]
+        batch_updates = [(user_id, update_data) for user_id, update_data in chunk if 'email' not in update_data]
+        results = self._update_one_by_one(email_updates)
+        batch = db.batch()
+        for user_id, update_data in batch_updates:
+            batch.update(self._users(db).document(user_id), _to_firestore_update(update_data))
+        try:
+            if batch_updates:
+                batch.commit()
+            results.update((user_id, None) for user_id, _ in batch_updates)
+        except Exception:
+            # バッチは1件でも失敗すると全体が取り消されるため、1人ずつ更新して失敗したユーザーを特定する
+            results.update(self._update_one_by_one(batch_updates))
+        return results
+
+    def _update_one_by_one(self, updates):
+        results = {}
+        for user_id, update_data in updates:
+            try:
+                self.update(user_id, update_data)
+                results[user_id] = None
+            except Exception as e:
+                results[user_id] = e
+        return results
+
+    def delete(self, user_id):
+        db = self._db()
+        user_ref = self._users(db).document(user_id)
+        user_doc = user_ref.get(field_paths=['email'])
+        if not user_doc.exists:
+            return False
+
+        # サブコレクションは自動では削除されないため、友達関係を先に削除する
+        self._delete_friend_edges(db, user_ref)
+
+        # ユーザーとメールアドレス索引をまとめて削除する
+        batch = db.batch()
+        batch.delete(user_ref)
+        email = user_doc.to_dict().get('email')
+        if email:
+            batch.delete(_email_index_ref(db, email))
+        batch.commit()
+        return True
+
+    def delete_each(self, user_ids):
+        db = self._db()
+        # ユーザーとメールアドレス索引の2件を削除するため、1バッチあたりのユーザー数は半分にする
+        chunk_size = BATCH_WRITE_LIMIT // 2
+        chunks = [user_ids[start:start + chunk_size] for start in range(0, len(user_ids), chunk_size)]
+        return _commit_in_parallel(lambda chunk: self._delete_chunk(db, chunk), chunks)
+
+    def _delete_chunk(self, db, chunk):
+        users = self.get_many(chunk, ['email', 'friend_count'])
+        results = {user_id: UserNotFound(user_id) for user_id in chunk if user_id not in users}
+        batch = db.batch()
+        for user_id, user in users.items():
+            user_ref = self._users(db).document(user_id)
+            # 友達が0人と分かっているユーザーはサブコレクションを確認しない
+            if user.get('friend_count') != 0:
+                self._delete_friend_edges(db, user_ref)
+            batch.delete(user_ref)
+            if user.get('email'):
+                batch.delete(_email_index_ref(db, user['email']))
+        try:
+            if users:
+                batch.commit()
+            results.update((user_id, None) for user_id in users)
+        except Exception:
+            for user_id in users:
+                try:
+                    results[user_id] = None if self.delete(user_id) else UserNotFound(user_id)
+                except Exception as e:
+                    results[user_id] = e
+        return results
+
+    def _delete_friend_edges(self, db, user_ref):
+        while True:
+            edge_docs = list(user_ref.collection(FRIENDS_COLLECTION).select([]).limit(BATCH_WRITE_LIMIT).stream())
+            if not edge_docs:
+                return
+            batch = db.batch()
+            for edge_doc in edge_docs:
+                batch.delete(edge_doc.reference)
+            batch.commit()
+
+    def count(self):
+        # 集計クエリを使用し、ドキュメントは読み込まない
+        result = self._users(self._db()).count().get()
+        return int(result[0][0].value)
+
+    def list_page(self, order_by, descending=False, limit=20, start_after=None, end_before=None, fields=None):
+        direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+        query = self._users(self._db())
+        if fields is not None:
+            query = query.select(fields)
+        # 同じ値のユーザーがいても順序が一意になるようドキュメントIDを第2キーにする
+        query = (query
+                 .order_by(order_by, direction=direction)
+                 .order_by(firestore.FieldPath.document_id(), direction=direction))
+
+        if start_after is not None:
+            query = query.start_after(list(start_after))
+        if end_before is not None:
+            return [user_doc.to_dict() for user_doc in query.end_before(list(end_before)).limit_to_last(limit).get()]
+        return [user_doc.to_dict() for user_doc in query.limit(limit).stream()]
+
+    def iter_all(self, fields=None, start_after=None):
+        query = self._users(self._db())
+        if fields is not None:
+            query = query.select(fields)
+        query = query.order_by(firestore.FieldPath.document_id())
+        # 1つのストリームが長時間にならないよう、ドキュメントIDの順に区切って読み込む
+        last_user_id = start_after
+        while True:
+            page = query.start_after([last_user_id]) if last_user_id is not None else query
+            user_docs = list(page.limit(ITER_PAGE_SIZE).stream())
+            for user_doc in user_docs:
+                yield user_doc.to_dict()
+            if len(user_docs) < ITER_PAGE_SIZE:
+                break
+            last_user_id = user_docs[-1].id
+
+    def search_by_interests(self, interests, fields=None):
+        query = self._users(self._db()).where('interests', 'array_contains_any', interests)
+        if fields is not None:
+            query = query.select(fields)
+        return [user_doc.to_dict() for user_doc in query.stream()]
+
+    def watch(self, on_changes):
+        initial = [True]
+
+        def on_snapshot(user_docs, changes, read_time):
+            # 最初の呼び出しでは全員分、以降は変更されたドキュメントだけを渡す
+            if initial[0]:
+                initial[0] = False
+                on_changes({user_doc.id: user_doc.to_dict() for user_doc in user_docs}, read_time, True)
+                return
+            on_changes({
+                change.document.id: None if change.type == ChangeType.REMOVED else change.document.to_dict()
+                for change in changes
+            }, read_time, False)
+
+        return self._users(self._db()).on_snapshot(on_snapshot)
+
+    def add_friend(self, user_id, friend_id):
+        db = self._db()
+        return _change_friend_in_transaction(db.transaction(), self._users(db).document(user_id), friend_id, True)
+
+    def remove_friend(self, user_id, friend_id):
+        db = self._db()
+        return _change_friend_in_transaction(db.transaction(), self._users(db).document(user_id), friend_id, False)
+
+    def is_friend(self, user_id, friend_id):
+        edge_ref = self._users(self._db()).document(user_id).collection(FRIENDS_COLLECTION).document(friend_id)
+        return edge_ref.get(field_paths=['friend_id']).exists
+
+    def list_friends(self, user_id, limit=20, start_after=None):
+        query = (self._users(self._db()).document(user_id).collection(FRIENDS_COLLECTION)
+                 .order_by('created_at')
+                 .order_by(firestore.FieldPath.document_id()))
+        if start_after is not None:
+            query = query.start_after(list(start_after))
+        return [
+            {'friend_id': edge_doc.id, 'created_at': edge_doc.get('created_at')}
+            for edge_doc in query.limit(limit).stream()
+        ]
+
+    def iter_friend_edges(self):
+        # すべてのユーザーのfriendsサブコレクションを1つのクエリで読み込む（ドキュメント名のみ）
+        query = self._db().collection_group(FRIENDS_COLLECTION).select([])
+        for edge_doc in query.stream():
+            yield edge_doc.reference.parent.parent.id, edge_doc.id
+
+    def migrate_friend_array(self, user_id):
+        db = self._db()
+        user_ref = self._users(db).document(user_id)
+        user_doc = user_ref.get(field_paths=['friends'])
+        if not user_doc.exists:
+            raise UserNotFound(user_id)
+        friend_ids = user_doc.to_dict().get('friends')
+        if friend_ids is None:
+            return 0
+
+        # 作成済みの友達関係は上書きしない（途中で中断した場合も再実行できる）
+        edges = user_ref.collection(FRIENDS_COLLECTION)
+        existing_ids = {edge_doc.id for edge_doc in edges.select([]).stream()}
+        migrated_at = datetime.now()
+        new_edges = [
+            (friend_id, migrated_at + timedelta(microseconds=position))
+            for position, friend_id in enumerate(dict.fromkeys(friend_ids))
+            if friend_id not in existing_ids and friend_id != user_id
+        ]
+        for start in range(0, len(new_edges), BATCH_WRITE_LIMIT):
+            batch = db.batch()
+            for friend_id, created_at in new_edges[start:start + BATCH_WRITE_LIMIT]:
+                batch.set(edges.document(friend_id), {'friend_id': friend_id, 'created_at': created_at})
+            batch.commit()
+
+        # 件数は集計クエリで数え直し、配列を削除する
+        friend_count = int(edges.count().get()[0][0].value)
+        user_ref.update({'friend_count': friend_count, 'friends': firestore.DELETE_FIELD})
+        return len(new_edges)
+
+    def backfill_email_index(self):
+        db = self._db()
+        created_count = 0
+        duplicate_ids = []
+        for user_doc in self._users(db).select(['email']).stream():
+            email = user_doc.to_dict().get('email')
+            if not email:
+                continue
+
+            email_ref = _email_index_ref(db, email)
+            index_doc = email_ref.get()
+            if index_doc.exists:
+                if index_doc.get('user_id') != user_doc.id:
+                    duplicate_ids.append(user_doc.id)
+                continue
+
+            email_ref.create({'user_id': user_doc.id, 'email': email})
+            created_count += 1
+        return created_count, duplicate_ids
+
+    def health_check(self):
+        health = check_firestore_health()
+        return {
+            'ok': health['ok'],
+            'latency_ms': health['latency_ms'],
+            'detail': f"Firestore（プール {health['pool_size']}）",
+            'error': health['error']
+        }
@@ -0,0 +1,154 @@
+import time
+from storage.base import UserRepository
+
+def _success_count(results):
+    """create_each・update_each・delete_eachのバッチの結果のうち、成功したユーザーの数"""
+    return sum(1 for error in results.values() if error is None)
+
+class InstrumentedUserRepository(UserRepository):
+    """呼び出しごとに処理時間と読み書きしたドキュメント数を通知するリポジトリ
+
+    読み込みは返したドキュメント数（該当なしでも1回の読み込みとして数える）、
+    書き込みはメールアドレス索引を含めて書き込んだドキュメント数を数える。
+    observerは(メソッド名, 秒数, 読み込み数, 書き込み数, 失敗したか)で呼び出される。
+    """
+
+    def __init__(self, repository, observer):
+        self.repository = repository
+        self.name = repository.name
+        self._observer = observer
+
+    def _call(self, method, func, reads=0, writes=0, count_reads=None, count_writes=None):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = func()
+            failed = False
+            if count_reads is not None:
+                reads = max(1, count_reads(result))
+            if count_writes is not None:
+                writes = count_writes(result)
+            return result
+        finally:
+            # 失敗した呼び出しは読み書きしなかったものとして扱う
+            if failed:
+                reads = writes = 0
+            self._observer(method, time.perf_counter() - started, reads, writes, failed)
+
+    def get(self, user_id, fields=None):
+        return self._call('get', lambda: self.repository.get(user_id, fields), reads=1)
+
+    def get_many(self, user_ids, fields=None):
+        return self._call('get_many', lambda: self.repository.get_many(user_ids, fields), reads=max(1, len(user_ids)))
+
+    def get_by_email(self, email):
+        # メールアドレス索引とユーザーの2件
+        return self._call('get_by_email', lambda: self.repository.get_by_email(email), reads=2)
+
+    def get_user_id_by_email(self, email):
+        return self._call('get_user_id_by_email', lambda: self.repository.get_user_id_by_email(email), reads=1)
+
+    def find_registered_emails(self, emails):
+        return self._call('find_registered_emails', lambda: self.repository.find_registered_emails(emails),
+                          reads=max(1, len(emails)))
+
+    def create(self, user_doc):
+        return self._call('create', lambda: self.repository.create(user_doc), writes=2)
+
+    def create_each(self, user_docs):
+        return self._iterate('create_each', self.repository.create_each(user_docs),
+                             count_writes=lambda results: _success_count(results) * 2)
+
+    def update(self, user_id, update_data):
+        writes = 3 if 'email' in update_data else 1
+        return self._call('update', lambda: self.repository.update(user_id, update_data), writes=writes)
+
+    def update_many(self, updates):
+        return self._call('update_many', lambda: self.repository.update_many(updates), writes=len(updates))
+
+    def update_each(self, updates):
+        return self._iterate('update_each', self.repository.update_each(updates), count_writes=_success_count)
+
+    def delete(self, user_id):
+        return self._call('delete', lambda: self.repository.delete(user_id), reads=1, writes=2)
+
+    def delete_each(self, user_ids):
+        return self._iterate('delete_each', self.repository.delete_each(user_ids),
+                             count_writes=lambda results: _success_count(results) * 2)
+
+    def count(self):
+        return self._call('count', self.repository.count, reads=1)
+
+    def list_page(self, order_by, descending=False, limit=20, start_after=None, end_before=None, fields=None):
+        return self._call(
+            'list_page',
+            lambda: self.repository.list_page(order_by, descending, limit, start_after, end_before, fields),
+            count_reads=len
+        )
+
+    def _iterate(self, method, iterator, count_writes=None):
+        # count_writesを指定しない場合は、返した件数を読み込み数とする
+        started = time.perf_counter()
+        reads = writes = 0
+        failed = True
+        try:
+            for item in iterator:
+                if count_writes is None:
+                    reads += 1
+                else:
+                    writes += count_writes(item)
+                yield item
+            failed = False
+        except GeneratorExit:
+            # 呼び出し側が途中で読むのをやめた場合は失敗として扱わない
+            failed = False
+            raise
+        finally:
+            self._observer(method, time.perf_counter() - started, reads, writes, failed)
+
+    def iter_all(self, fields=None, start_after=None):
+        return self._iterate('iter_all', self.repository.iter_all(fields, start_after))
+
+    def search_by_interests(self, interests, fields=None):
+        return self._call('search_by_interests',
+                          lambda: self.repository.search_by_interests(interests, fields), count_reads=len)
+
+    def watch(self, on_changes):
+        # 購読で受け取ったドキュメントも読み込みとして数える
+        def observed(users, read_time, initial):
+            self._observer('watch', 0.0, len(users), 0, False)
+            on_changes(users, read_time, initial)
+        return self.repository.watch(observed)
+
+    def add_friend(self, user_id, friend_id):
+        # 追加した場合は友達関係とユーザーの2件を書き込む
+        return self._call('add_friend', lambda: self.repository.add_friend(user_id, friend_id),
+                          reads=2, count_writes=lambda added: 2 if added else 0)
+
+    def remove_friend(self, user_id, friend_id):
+        return self._call('remove_friend', lambda: self.repository.remove_friend(user_id, friend_id),
+                          reads=2, count_writes=lambda removed: 2 if removed else 0)
+
+    def is_friend(self, user_id, friend_id):
+        return self._call('is_friend', lambda: self.repository.is_friend(user_id, friend_id), reads=1)
+
+    def list_friends(self, user_id, limit=20, start_after=None):
+        return self._call('list_friends', lambda: self.repository.list_friends(user_id, limit, start_after),
+                          count_reads=len)
+
+    def iter_friend_edges(self):
+        return self._iterate('iter_friend_edges', self.repository.iter_friend_edges())
+
+    def migrate_friend_array(self, user_id):
+        return self._call('migrate_friend_array', lambda: self.repository.migrate_friend_array(user_id),
+                          reads=1, count_writes=lambda created_count: created_count + 1)
+
+    def backfill_email_index(self):
+        return self._call('backfill_email_index', self.repository.backfill_email_index)
+
+    def health_check(self):
+        return self._call('health_check', self.repository.health_check, reads=1)
+
+    def close(self):
+        if hasattr(self.repository, 'close'):
+            self.repository.close()
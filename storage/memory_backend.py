@@ -0,0 +1,240 @@
+import bisect
+import copy
+import threading
+from datetime import datetime, timedelta
+from storage.base import (
+    EmailAlreadyRegistered, UserNotFound, UserRepository,
+    apply_update, normalize_email, page_sort_key, project_fields
+)
+
+class MemoryUserRepository(UserRepository):
+    """プロセス内のメモリに保存するユーザーリポジトリ
+
+    ネットワークを使わないため、ベンチマークやCIでアプリ全体を動かす用途に使う。
+    """
+
+    name = 'memory'
+
+    def __init__(self):
+        self._users = {}
+        # 正規化したメールアドレス -> ユーザーID
+        self._emails = {}
+        # ユーザーID -> {友達のユーザーID: 追加日時}
+        self._friends = {}
+        self._lock = threading.RLock()
+
+    def get(self, user_id, fields=None):
+        with self._lock:
+            user = self._users.get(user_id)
+            return project_fields(user, fields) if user is not None else None
+
+    def get_many(self, user_ids, fields=None):
+        with self._lock:
+            return {
+                user_id: project_fields(self._users[user_id], fields)
+                for user_id in user_ids if user_id in self._users
+            }
+
+    def get_by_email(self, email):
+        with self._lock:
+            user_id = self._emails.get(normalize_email(email))
+            return self.get(user_id) if user_id else None
+
+    def get_user_id_by_email(self, email):
+        with self._lock:
+            return self._emails.get(normalize_email(email))
+
+    def find_registered_emails(self, emails):
+        with self._lock:
+            return {normalize_email(email) for email in emails if normalize_email(email) in self._emails}
+
+    def create(self, user_doc):
+        email_key = normalize_email(user_doc['email'])
+        with self._lock:
+            if email_key in self._emails:
+                raise EmailAlreadyRegistered()
+            self._emails[email_key] = user_doc['user_id']
+            self._users[user_doc['user_id']] = copy.deepcopy(user_doc)
+
+    def create_each(self, user_docs):
+        results = {}
+        with self._lock:
+            for user_doc in user_docs:
+                try:
+                    self.create(user_doc)
+                    results[user_doc['user_id']] = None
+                except Exception as e:
+                    results[user_doc['user_id']] = e
+        yield results
+
+    def update(self, user_id, update_data):
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                raise UserNotFound(user_id)
+
+            if 'email' in update_data:
+                old_key = normalize_email(user['email']) if user.get('email') else None
+                new_key = normalize_email(update_data['email'])
+                if new_key != old_key:
+                    if new_key in self._emails:
+                        raise EmailAlreadyRegistered()
+                    self._emails.pop(old_key, None)
+                    self._emails[new_key] = user_id
+
+            apply_update(user, update_data)
+
+    def update_many(self, updates):
+        with self._lock:
+            for user_id, update_data in updates:
+                self.update(user_id, update_data)
+
+    def update_each(self, updates):
+        # メモリ上の更新は一度にまとめて行う
+        results = {}
+        with self._lock:
+            for user_id, update_data in updates:
+                try:
+                    self.update(user_id, update_data)
+                    results[user_id] = None
+                except Exception as e:
+                    results[user_id] = e
+        yield results
+
+    def delete(self, user_id):
+        with self._lock:
+            user = self._users.pop(user_id, None)
+            if user is None:
+                return False
+            self._friends.pop(user_id, None)
+            if user.get('email'):
+                self._emails.pop(normalize_email(user['email']), None)
+            return True
+
+    def delete_each(self, user_ids):
+        with self._lock:
+            results = {user_id: None if self.delete(user_id) else UserNotFound(user_id) for user_id in user_ids}
+        yield results
+
+    def count(self):
+        with self._lock:
+            return len(self._users)
+
+    def list_page(self, order_by, descending=False, limit=20, start_after=None, end_before=None, fields=None):
+        with self._lock:
+            users = sorted(
+                (user for user in self._users.values() if user.get(order_by) is not None),
+                key=lambda user: page_sort_key(user, order_by),
+                reverse=descending
+            )
+
+            def follows(user, cursor):
+                # 並び順でuserがcursorより後ろにあるか
+                key = page_sort_key(user, order_by)
+                return key < tuple(cursor) if descending else key > tuple(cursor)
+
+            def precedes(user, cursor):
+                key = page_sort_key(user, order_by)
+                return key > tuple(cursor) if descending else key < tuple(cursor)
+
+            if start_after is not None:
+                users = [user for user in users if follows(user, start_after)]
+            if end_before is not None:
+                users = [user for user in users if precedes(user, end_before)][-limit:]
+            else:
+                users = users[:limit]
+            return [project_fields(user, fields) for user in users]
+
+    def iter_all(self, fields=None, start_after=None):
+        with self._lock:
+            user_ids = sorted(self._users)
+        if start_after is not None:
+            user_ids = user_ids[bisect.bisect_right(user_ids, start_after):]
+        for user_id in user_ids:
+            user = self.get(user_id, fields)
+            if user is not None:
+                yield user
+
+    def search_by_interests(self, interests, fields=None):
+        interests = set(interests)
+        with self._lock:
+            return [
+                project_fields(user, fields) for user in self._users.values()
+                if interests.intersection(user.get('interests', []))
+            ]
+
+    def _require_user(self, user_id):
+        user = self._users.get(user_id)
+        if user is None:
+            raise UserNotFound(user_id)
+        return user
+
+    def add_friend(self, user_id, friend_id):
+        with self._lock:
+            user = self._require_user(user_id)
+            friends = self._friends.setdefault(user_id, {})
+            if friend_id in friends:
+                return False
+            friends[friend_id] = datetime.now()
+            user['friend_count'] = user.get('friend_count', 0) + 1
+            return True
+
+    def remove_friend(self, user_id, friend_id):
+        with self._lock:
+            user = self._require_user(user_id)
+            if self._friends.get(user_id, {}).pop(friend_id, None) is None:
+                return False
+            user['friend_count'] = max(0, user.get('friend_count', 0) - 1)
+            return True
+
+    def is_friend(self, user_id, friend_id):
+        with self._lock:
+            return friend_id in self._friends.get(user_id, {})
+
+    def list_friends(self, user_id, limit=20, start_after=None):
+        with self._lock:
+            edges = sorted((created_at, friend_id) for friend_id, created_at in self._friends.get(user_id, {}).items())
+        if start_after is not None:
+            edges = [edge for edge in edges if edge > tuple(start_after)]
+        return [{'friend_id': friend_id, 'created_at': created_at} for created_at, friend_id in edges[:limit]]
+
+    def iter_friend_edges(self):
+        with self._lock:
+            edges = [(user_id, friend_id) for user_id, friends in self._friends.items() for friend_id in friends]
+        yield from edges
+
+    def migrate_friend_array(self, user_id):
+        with self._lock:
+            user = self._require_user(user_id)
+            friend_ids = user.pop('friends', None)
+            if friend_ids is None:
+                return 0
+
+            friends = self._friends.setdefault(user_id, {})
+            migrated_at = datetime.now()
+            created_count = 0
+            for position, friend_id in enumerate(friend_ids):
+                if friend_id not in friends and friend_id != user_id:
+                    friends[friend_id] = migrated_at + timedelta(microseconds=position)
+                    created_count += 1
+            user['friend_count'] = len(friends)
+            return created_count
+
+    def backfill_email_index(self):
+        created_count = 0
+        duplicate_ids = []
+        with self._lock:
+            for user_id, user in self._users.items():
+                if not user.get('email'):
+                    continue
+                email_key = normalize_email(user['email'])
+                indexed_id = self._emails.get(email_key)
+                if indexed_id is None:
+                    self._emails[email_key] = user_id
+                    created_count += 1
+                elif indexed_id != user_id:
+                    duplicate_ids.append(user_id)
+        return created_count, duplicate_ids
+
+    def health_check(self):
+        return {'ok': True, 'latency_ms': 0.0, 'detail': f"メモリ（{self.count()}人）", 'error': None}
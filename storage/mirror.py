@@ -0,0 +1,447 @@
+import bisect
+import functools
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from storage.base import UserRepository, normalize_email, page_sort_key, project_fields
+
+def _compact(value):
+    """ミラーに保持する値（フィールド名と文字列のリストを共有し、全員分のメモリを抑える）"""
+    if isinstance(value, dict):
+        return {sys.intern(key): _compact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [sys.intern(item) if isinstance(item, str) else item for item in value]
+    return value
+
+class MirroredUserRepository(UserRepository):
+    """保存先の変更を購読して全員分のユーザーをプロセス内に複製し、読み込みに使うリポジトリ
+
+    repository.watchで最初に全員分、以降は変更を受け取り、ユーザーIDをキーとする複製を更新する。
+    get・get_many・get_by_email・count・list_page・iter_all・search_by_interestsは複製から返し、
+    書き込みと友達関係の読み込みはrepositoryに任せる。
+
+    次の場合は複製を使わずrepositoryから直接読み込む。
+    - 最初の全員分を受け取るまでと、購読が切れてから再接続するまで
+    - このプロセスで書き込んだユーザーの変更を受け取るまで（最大pending_seconds秒、
+      一覧はいずれかのユーザーの変更を待っている間）
+    """
+
+    def __init__(self, repository, pending_seconds=10.0, reconnect_seconds=30.0, on_lag=None, on_read=None):
+        self.repository = repository
+        self.name = repository.name
+        self.pending_seconds = pending_seconds
+        self.reconnect_seconds = reconnect_seconds
+        # on_lagは('change'または'write', 秒数)、on_readは(メソッド名, 'mirror'または'direct')で呼び出される
+        self._on_lag = on_lag
+        self._on_read = on_read
+        self._lock = threading.Lock()
+        self._users = {}
+        # 正規化したメールアドレス -> ユーザーID
+        self._emails = {}
+        # 並び替えに使うフィールド -> 昇順の(値, ユーザーID)のリスト（変更を受け取るたびに作り直す）
+        self._sorted_keys = {}
+        # 変更を待っているユーザーID -> [最後に書き込んだ時刻, 変更を待っている書き込みの数, 正規化したメールアドレスのリスト]
+        self._pending = {}
+        # 変更を待っているユーザーの正規化したメールアドレス -> ユーザーID
+        self._pending_emails = {}
+        self._watch = None
+        # 購読ごとの番号（古い購読からのコールバックを無視するため）
+        self._generation = 0
+        self._state = 'connecting'
+        self._connecting = False
+        self._closed = False
+        self._connected_at = 0.0
+        self._last_change_at = None
+        self._last_lag_seconds = None
+        self._last_error = None
+        self._stats = {'mirror_reads': 0, 'direct_reads': 0, 'changes': 0, 'reconnects': 0}
+
+    def start(self):
+        """購読をバックグラウンドで開始する（全員分を受け取るまでは直接読み込む）"""
+        with self._lock:
+            self._start_connecting()
+
+    def _start_connecting(self):
+        # self._lockを取得した状態で呼び出す
+        self._connecting = True
+        self._connected_at = time.monotonic()
+        threading.Thread(target=self._connect, name="user-mirror-connect", daemon=True).start()
+
+    def _connect(self):
+        with self._lock:
+            old_watch = self._watch
+            self._watch = None
+            self._generation += 1
+            generation = self._generation
+        if old_watch is not None:
+            try:
+                old_watch.unsubscribe()
+            except Exception:
+                pass
+
+        watch = None
+        state = None
+        try:
+            watch = self.repository.watch(functools.partial(self._on_changes, generation))
+        except NotImplementedError:
+            state, error = 'unsupported', f"{self.name}は変更の購読に対応していません"
+        except Exception as e:
+            state, error = 'disconnected', f"変更を購読できません: {e}"
+
+        with self._lock:
+            self._connecting = False
+            if watch is None:
+                self._state = state
+                self._last_error = error
+            elif generation == self._generation:
+                self._watch = watch
+            else:
+                # 接続中に閉じられた場合
+                watch.unsubscribe()
+
+    def _on_changes(self, generation, users, read_time, initial):
+        """repository.watchのコールバック（購読のスレッドから呼び出される）"""
+        try:
+            compact_users = {user_id: _compact(user) if user is not None else None for user_id, user in users.items()}
+            now = time.monotonic()
+            write_lags = []
+            with self._lock:
+                if generation != self._generation:
+                    return
+                if initial:
+                    self._users = {}
+                    self._emails = {}
+                for user_id, user in compact_users.items():
+                    old_user = self._users.pop(user_id, None)
+                    if old_user is not None and old_user.get('email'):
+                        email_key = normalize_email(old_user['email'])
+                        if self._emails.get(email_key) == user_id:
+                            del self._emails[email_key]
+                    if user is not None:
+                        self._users[user_id] = user
+                        if user.get('email'):
+                            self._emails[normalize_email(user['email'])] = user_id
+                    pending = self._pending.get(user_id)
+                    if pending is not None:
+                        # 前の書き込みの変更で、後の書き込みを待っているユーザーを読み込み可能にしない
+                        pending[1] -= 1
+                        if pending[1] <= 0 or initial:
+                            write_lags.append(now - pending[0])
+                            self._forget_pending(user_id)
+                self._sorted_keys = {}
+                self._state = 'live'
+                self._last_change_at = now
+                self._stats['changes'] += len(users)
+                lag_seconds = None
+                if isinstance(read_time, datetime):
+                    lag_seconds = max(0.0, (datetime.now(timezone.utc) - read_time).total_seconds())
+                    self._last_lag_seconds = lag_seconds
+
+            if self._on_lag:
+                if lag_seconds is not None:
+                    self._on_lag('change', lag_seconds)
+                for write_lag in write_lags:
+                    self._on_lag('write', write_lag)
+        except Exception as e:
+            # 途中まで反映した複製は使わず、再接続して全員分を受け取り直す
+            with self._lock:
+                if generation == self._generation:
+                    self._generation += 1
+                    self._state = 'disconnected'
+                    self._last_error = f"変更を反映できませんでした: {e}"
+
+    def _live(self):
+        """複製から読み込めるか（購読が切れている場合は再接続を始める）。self._lockを取得した状態で呼び出す"""
+        if self._state in ('connecting', 'live') and self._watch is not None and not self._watch.is_active:
+            self._state = 'disconnected'
+            self._last_error = "変更の購読が切断されました"
+        if self._state == 'disconnected' and not self._connecting and not self._closed \
+                and time.monotonic() - self._connected_at >= self.reconnect_seconds:
+            self._stats['reconnects'] += 1
+            self._start_connecting()
+        return self._state == 'live'
+
+    def _is_pending(self, user_id, now):
+        pending = self._pending.get(user_id)
+        if pending is None:
+            return False
+        if now - pending[0] <= self.pending_seconds:
+            return True
+        # 変更が届かなかった書き込み（値が変わらない更新や、まとめて通知された書き込みなど）は待たない
+        self._forget_pending(user_id)
+        return False
+
+    def _forget_pending(self, user_id):
+        _, _, email_keys = self._pending.pop(user_id)
+        for email_key in email_keys:
+            if self._pending_emails.get(email_key) == user_id:
+                del self._pending_emails[email_key]
+
+    def _any_pending(self, now):
+        expired_ids = [user_id for user_id, pending in self._pending.items() if now - pending[0] > self.pending_seconds]
+        for user_id in expired_ids:
+            self._forget_pending(user_id)
+        return bool(self._pending)
+
+    def _count_read(self, method, mirrored):
+        # self._lockを取得した状態で呼び出す
+        self._stats['mirror_reads' if mirrored else 'direct_reads'] += 1
+        if self._on_read:
+            self._on_read(method, 'mirror' if mirrored else 'direct')
+
+    def _mark_pending(self, user_ids, emails=None):
+        """書き込んだユーザーの変更を受け取るまで、そのユーザーを直接読み込むようにする
+
+        emailsは書き込んだメールアドレス（ユーザーID -> メールアドレス）。
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._state == 'unsupported' or self._closed:
+                return
+            for user_id in user_ids:
+                pending = self._pending.setdefault(user_id, [now, 0, []])
+                pending[0] = now
+                pending[1] += 1
+                # 変更前・変更後のメールアドレスでの検索も、変更を受け取るまでは直接読み込む
+                user = self._users.get(user_id)
+                for email in (user.get('email') if user is not None else None, (emails or {}).get(user_id)):
+                    if email and normalize_email(email) not in pending[2]:
+                        pending[2].append(normalize_email(email))
+                for email_key in pending[2]:
+                    self._pending_emails[email_key] = user_id
+
+    def get(self, user_id, fields=None):
+        with self._lock:
+            mirrored = self._live() and not self._is_pending(user_id, time.monotonic())
+            self._count_read('get', mirrored)
+            if mirrored:
+                user = self._users.get(user_id)
+                return project_fields(user, fields) if user is not None else None
+        return self.repository.get(user_id, fields)
+
+    def get_many(self, user_ids, fields=None):
+        users = {}
+        missing_ids = []
+        with self._lock:
+            live = self._live()
+            now = time.monotonic()
+            for user_id in user_ids:
+                if live and not self._is_pending(user_id, now):
+                    if user_id in self._users:
+                        users[user_id] = project_fields(self._users[user_id], fields)
+                else:
+                    missing_ids.append(user_id)
+            self._count_read('get_many', not missing_ids)
+        if missing_ids:
+            users.update(self.repository.get_many(missing_ids, fields))
+        return users
+
+    def get_by_email(self, email):
+        email_key = normalize_email(email)
+        with self._lock:
+            now = time.monotonic()
+            pending_id = self._pending_emails.get(email_key)
+            mirrored = self._live() and not (pending_id is not None and self._is_pending(pending_id, now))
+            user_id = self._emails.get(email_key)
+            if mirrored and user_id is not None:
+                mirrored = not self._is_pending(user_id, now)
+            self._count_read('get_by_email', mirrored)
+            if mirrored:
+                return project_fields(self._users[user_id], None) if user_id is not None else None
+        return self.repository.get_by_email(email)
+
+    def get_user_id_by_email(self, email):
+        email_key = normalize_email(email)
+        with self._lock:
+            pending_id = self._pending_emails.get(email_key)
+            mirrored = self._live() and not (pending_id is not None and self._is_pending(pending_id, time.monotonic()))
+            self._count_read('get_user_id_by_email', mirrored)
+            if mirrored:
+                return self._emails.get(email_key)
+        return self.repository.get_user_id_by_email(email)
+
+    def _listing_live(self, method):
+        """一覧を複製から返せるか（いずれかのユーザーの変更を待っている間は直接読み込む）"""
+        mirrored = self._live() and not self._any_pending(time.monotonic())
+        self._count_read(method, mirrored)
+        return mirrored
+
+    def count(self):
+        with self._lock:
+            if self._listing_live('count'):
+                return len(self._users)
+        return self.repository.count()
+
+    def _sorted(self, order_by):
+        keys = self._sorted_keys.get(order_by)
+        if keys is None:
+            keys = self._sorted_keys[order_by] = sorted(
+                page_sort_key(user, order_by) for user in self._users.values() if user.get(order_by) is not None
+            )
+        return keys
+
+    def list_page(self, order_by, descending=False, limit=20, start_after=None, end_before=None, fields=None):
+        with self._lock:
+            if self._listing_live('list_page'):
+                try:
+                    keys = self._sorted(order_by)
+                except TypeError:
+                    # 型の異なる値が混在して並び替えられない場合は保存先の並び順に任せる
+                    keys = None
+                if keys is not None:
+                    # 昇順のリストで、並び順のstart_afterより後・end_beforeより前の範囲を求める
+                    if descending:
+                        high = bisect.bisect_left(keys, tuple(start_after)) if start_after is not None else len(keys)
+                        low = bisect.bisect_right(keys, tuple(end_before)) if end_before is not None else 0
+                    else:
+                        low = bisect.bisect_right(keys, tuple(start_after)) if start_after is not None else 0
+                        high = bisect.bisect_left(keys, tuple(end_before)) if end_before is not None else len(keys)
+                    window = keys[low:max(low, high)]
+                    # end_beforeを指定した場合は、並び順でその直前のlimit件
+                    if descending:
+                        page = window[:limit] if end_before is not None else window[-limit:]
+                        page = page[::-1]
+                    else:
+                        page = window[-limit:] if end_before is not None else window[:limit]
+                    return [project_fields(self._users[user_id], fields) for _, user_id in page]
+        return self.repository.list_page(order_by, descending, limit, start_after, end_before, fields)
+
+    def iter_all(self, fields=None, start_after=None):
+        with self._lock:
+            user_ids = sorted(self._users) if self._listing_live('iter_all') else None
+        if user_ids is None:
+            yield from self.repository.iter_all(fields, start_after)
+            return
+
+        if start_after is not None:
+            user_ids = user_ids[bisect.bisect_right(user_ids, start_after):]
+        for user_id in user_ids:
+            with self._lock:
+                user = self._users.get(user_id)
+                user = project_fields(user, fields) if user is not None else None
+            if user is not None:
+                yield user
+
+    def search_by_interests(self, interests, fields=None):
+        interests = set(interests)
+        with self._lock:
+            if self._listing_live('search_by_interests'):
+                return [
+                    project_fields(user, fields) for user in self._users.values()
+                    if interests.intersection(user.get('interests') or [])
+                ]
+        return self.repository.search_by_interests(interests, fields)
+
+    def find_registered_emails(self, emails):
+        # 一括登録の重複確認は、他のプロセスで登録されたばかりのメールアドレスも含めて保存先で確認する
+        return self.repository.find_registered_emails(emails)
+
+    def create(self, user_doc):
+        self.repository.create(user_doc)
+        self._mark_pending([user_doc['user_id']], {user_doc['user_id']: user_doc.get('email')})
+
+    def create_each(self, user_docs):
+        emails = {user_doc['user_id']: user_doc.get('email') for user_doc in user_docs}
+        for results in self.repository.create_each(user_docs):
+            self._mark_pending([user_id for user_id, error in results.items() if error is None], emails)
+            yield results
+
+    def update(self, user_id, update_data):
+        self.repository.update(user_id, update_data)
+        self._mark_pending([user_id], {user_id: update_data.get('email')})
+
+    def update_many(self, updates):
+        try:
+            self.repository.update_many(updates)
+        finally:
+            # 途中のバッチで失敗した場合も、それまでのバッチは書き込まれている
+            self._mark_pending([user_id for user_id, _ in updates],
+                               {user_id: update_data.get('email') for user_id, update_data in updates})
+
+    def update_each(self, updates):
+        emails = {user_id: update_data.get('email') for user_id, update_data in updates}
+        for results in self.repository.update_each(updates):
+            self._mark_pending([user_id for user_id, error in results.items() if error is None], emails)
+            yield results
+
+    def delete(self, user_id):
+        deleted = self.repository.delete(user_id)
+        if deleted:
+            self._mark_pending([user_id])
+        return deleted
+
+    def delete_each(self, user_ids):
+        for results in self.repository.delete_each(user_ids):
+            self._mark_pending([user_id for user_id, error in results.items() if error is None])
+            yield results
+
+    def add_friend(self, user_id, friend_id):
+        added = self.repository.add_friend(user_id, friend_id)
+        if added:
+            self._mark_pending([user_id])
+        return added
+
+    def remove_friend(self, user_id, friend_id):
+        removed = self.repository.remove_friend(user_id, friend_id)
+        if removed:
+            self._mark_pending([user_id])
+        return removed
+
+    def is_friend(self, user_id, friend_id):
+        return self.repository.is_friend(user_id, friend_id)
+
+    def list_friends(self, user_id, limit=20, start_after=None):
+        return self.repository.list_friends(user_id, limit, start_after)
+
+    def iter_friend_edges(self):
+        return self.repository.iter_friend_edges()
+
+    def migrate_friend_array(self, user_id):
+        try:
+            return self.repository.migrate_friend_array(user_id)
+        finally:
+            self._mark_pending([user_id])
+
+    def backfill_email_index(self):
+        return self.repository.backfill_email_index()
+
+    def health_check(self):
+        return self.repository.health_check()
+
+    def watch(self, on_changes):
+        return self.repository.watch(on_changes)
+
+    def close(self):
+        with self._lock:
+            watch = self._watch
+            self._watch = None
+            self._generation += 1
+            self._state = 'disconnected'
+            self._closed = True
+        if watch is not None:
+            watch.unsubscribe()
+        if hasattr(self.repository, 'close'):
+            self.repository.close()
+
+    def stats(self):
+        """複製の状態と統計情報を取得する
+
+        stateは'connecting'（最初の全員分を待っている）・'live'（複製から読み込んでいる）・
+        'disconnected'（再接続を待っている）・'unsupported'（保存先が購読に対応していない）のいずれか。
+        """
+        with self._lock:
+            self._live()
+            reads = self._stats['mirror_reads'] + self._stats['direct_reads']
+            return dict(
+                self._stats,
+                state=self._state,
+                users=len(self._users),
+                pending=len(self._pending),
+                mirror_ratio=self._stats['mirror_reads'] / reads if reads else 0.0,
+                # 最後に変更を受け取ってからの秒数（変更が無い間も増える）
+                last_change_age_seconds=time.monotonic() - self._last_change_at if self._last_change_at else None,
+                # 最後に受け取った変更の、保存先の読み込み時刻からの遅れ
+                lag_seconds=self._last_lag_seconds,
+                error=self._last_error
+            )
@@ -0,0 +1,478 @@
+import base64
+import json
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from storage.base import (
+    EmailAlreadyRegistered, UserNotFound, UserRepository,
+    apply_update, normalize_email, project_fields
+)
+
+# 並び替えに使用できるフィールドと、インデックスを張った列
+ORDER_COLUMNS = {'created_at': 'created_at', 'display_name': 'display_name'}
+
+# IN句1回あたりのユーザーID数
+BULK_GET_CHUNK_SIZE = 500
+
+# 1トランザクションあたりの書き込み件数
+BATCH_WRITE_LIMIT = 500
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        email_key TEXT UNIQUE,
+        created_at TEXT,
+        display_name TEXT,
+        data TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS users_created_at ON users (created_at, user_id)",
+    "CREATE INDEX IF NOT EXISTS users_display_name ON users (display_name, user_id)",
+    """CREATE TABLE IF NOT EXISTS user_interests (
+        interest TEXT NOT NULL,
+        user_id TEXT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+        PRIMARY KEY (interest, user_id)
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS user_interests_user ON user_interests (user_id)",
+    """CREATE TABLE IF NOT EXISTS friendships (
+        user_id TEXT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+        friend_id TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        PRIMARY KEY (user_id, friend_id)
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS friendships_created_at ON friendships (user_id, created_at, friend_id)"
+]
+
+def _json_default(value):
+    # Firestoreと同じ型で読み戻せるよう、日時とバイト列は印を付けて保存する
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, (bytes, bytearray)):
+        return {'$bytes': base64.b64encode(value).decode('ascii')}
+    raise TypeError(f"保存できない型です: {type(value).__name__}")
+
+def _json_object_hook(obj):
+    if len(obj) == 1:
+        if '$datetime' in obj:
+            return datetime.fromisoformat(obj['$datetime'])
+        if '$bytes' in obj:
+            return base64.b64decode(obj['$bytes'])
+    return obj
+
+def encode_user(user):
+    """ユーザーデータをJSON文字列にする"""
+    return json.dumps(user, default=_json_default, ensure_ascii=False, separators=(',', ':'))
+
+def decode_user(data):
+    """JSON文字列からユーザーデータを復元する"""
+    return json.loads(data, object_hook=_json_object_hook)
+
+def sort_value(value):
+    """並び替え用の列に保存する値（日時は文字列の順序と時刻の順序が一致する形式にする）"""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.isoformat(sep=' ', timespec='microseconds')
+    return value
+
+class SqliteConnectionPool:
+    """SQLiteの接続プール
+
+    Streamlitはスクリプトを複数のスレッドで実行するため、接続はスレッドをまたいで
+    貸し出し、同時に1つのスレッドだけが使用する。書き込みはプロセス内で直列化する。
+    """
+
+    def __init__(self, path, size=4, timeout=30.0):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._connections = queue.LifoQueue()
+        self._write_lock = threading.Lock()
+        for _ in range(size):
+            self._connections.put(self._connect())
+
+    def _connect(self):
+        # 同じSQL文は接続ごとにコンパイル済みの文がキャッシュされ、再利用される
+        connection = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+    @contextmanager
+    def connection(self):
+        """接続を借りる"""
+        connection = self._connections.get(timeout=self.timeout)
+        try:
+            yield connection
+        finally:
+            self._connections.put(connection)
+
+    @contextmanager
+    def transaction(self):
+        """書き込み用のトランザクションを開始する（例外が発生した場合はロールバックする）"""
+        with self.connection() as connection, self._write_lock:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def close(self):
+        """すべての接続を閉じる"""
+        for _ in range(self.size):
+            self._connections.get(timeout=self.timeout).close()
+
+def _is_email_conflict(error):
+    return 'users.email_key' in str(error)
+
+class SqliteUserRepository(UserRepository):
+    """SQLiteのファイルに保存するユーザーリポジトリ
+
+    会場内などネットワークが不安定な環境で、Firestoreの代わりに使用する。
+    ユーザーデータはJSONとして保存し、検索・並び替えに使うフィールドは列と
+    結合テーブル（興味のあるジャンル）に複製してインデックスを張る。
+    友達関係はfriendshipsテーブルに1行ずつ保存する。
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path, pool_size=4):
+        self._pool = SqliteConnectionPool(path, pool_size)
+        with self._pool.transaction() as connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+    def close(self):
+        """接続プールを閉じる"""
+        self._pool.close()
+
+    def _fetch_users(self, sql, parameters=(), fields=None):
+        with self._pool.connection() as connection:
+            rows = connection.execute(sql, parameters).fetchall()
+        return [project_fields(decode_user(data), fields) for data, in rows]
+
+    def _load(self, connection, user_id):
+        row = connection.execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return decode_user(row[0]) if row else None
+
+    def _write_interests(self, connection, user_id, interests):
+        connection.execute("DELETE FROM user_interests WHERE user_id = ?", (user_id,))
+        connection.executemany(
+            "INSERT INTO user_interests (interest, user_id) VALUES (?, ?)",
+            [(interest, user_id) for interest in dict.fromkeys(interests or [])]
+        )
+
+    def _save(self, connection, user_id, user, interests_changed):
+        email = user.get('email')
+        connection.execute(
+            "UPDATE users SET email_key = ?, created_at = ?, display_name = ?, data = ? WHERE user_id = ?",
+            (normalize_email(email) if email else None, sort_value(user.get('created_at')),
+             user.get('display_name'), encode_user(user), user_id)
+        )
+        if interests_changed:
+            self._write_interests(connection, user_id, user.get('interests'))
+
+    def _update(self, connection, user_id, update_data):
+        user = self._load(connection, user_id)
+        if user is None:
+            raise UserNotFound(user_id)
+        apply_update(user, update_data)
+        interests_changed = any(field_path.split('.')[0] == 'interests' for field_path in update_data)
+        self._save(connection, user_id, user, interests_changed)
+
+    def get(self, user_id, fields=None):
+        users = self._fetch_users("SELECT data FROM users WHERE user_id = ?", (user_id,), fields)
+        return users[0] if users else None
+
+    def get_many(self, user_ids, fields=None):
+        users = {}
+        for start in range(0, len(user_ids), BULK_GET_CHUNK_SIZE):
+            chunk = user_ids[start:start + BULK_GET_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            with self._pool.connection() as connection:
+                rows = connection.execute(
+                    f"SELECT user_id, data FROM users WHERE user_id IN ({placeholders})", chunk
+                ).fetchall()
+            for user_id, data in rows:
+                users[user_id] = project_fields(decode_user(data), fields)
+        return users
+
+    def get_by_email(self, email):
+        users = self._fetch_users("SELECT data FROM users WHERE email_key = ?", (normalize_email(email),))
+        return users[0] if users else None
+
+    def get_user_id_by_email(self, email):
+        with self._pool.connection() as connection:
+            row = connection.execute("SELECT user_id FROM users WHERE email_key = ?", (normalize_email(email),)).fetchone()
+        return row[0] if row else None
+
+    def find_registered_emails(self, emails):
+        email_keys = list({normalize_email(email) for email in emails})
+        registered = set()
+        for start in range(0, len(email_keys), BULK_GET_CHUNK_SIZE):
+            chunk = email_keys[start:start + BULK_GET_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            with self._pool.connection() as connection:
+                rows = connection.execute(
+                    f"SELECT email_key FROM users WHERE email_key IN ({placeholders})", chunk
+                ).fetchall()
+            registered.update(email_key for email_key, in rows)
+        return registered
+
+    def _insert(self, connection, user_doc):
+        user_id = user_doc['user_id']
+        try:
+            connection.execute(
+                "INSERT INTO users (user_id, email_key, created_at, display_name, data) VALUES (?, ?, ?, ?, ?)",
+                (user_id, normalize_email(user_doc['email']), sort_value(user_doc.get('created_at')),
+                 user_doc.get('display_name'), encode_user(user_doc))
+            )
+        except sqlite3.IntegrityError as e:
+            if _is_email_conflict(e):
+                raise EmailAlreadyRegistered()
+            raise
+        self._write_interests(connection, user_id, user_doc.get('interests'))
+
+    def create(self, user_doc):
+        with self._pool.transaction() as connection:
+            self._insert(connection, user_doc)
+
+    def create_each(self, user_docs):
+        for start in range(0, len(user_docs), BATCH_WRITE_LIMIT):
+            results = {}
+            with self._pool.transaction() as connection:
+                for user_doc in user_docs[start:start + BATCH_WRITE_LIMIT]:
+                    try:
+                        self._insert(connection, user_doc)
+                        results[user_doc['user_id']] = None
+                    except Exception as e:
+                        results[user_doc['user_id']] = e
+            yield results
+
+    def update(self, user_id, update_data):
+        try:
+            with self._pool.transaction() as connection:
+                self._update(connection, user_id, update_data)
+        except sqlite3.IntegrityError as e:
+            if _is_email_conflict(e):
+                raise EmailAlreadyRegistered()
+            raise
+
+    def update_many(self, updates):
+        for start in range(0, len(updates), BATCH_WRITE_LIMIT):
+            with self._pool.transaction() as connection:
+                for user_id, update_data in updates[start:start + BATCH_WRITE_LIMIT]:
+                    self._update(connection, user_id, update_data)
+
+    def update_each(self, updates):
+        # 書き込みはプロセス内で直列化されるため、バッチは順に書き込む
+        for start in range(0, len(updates), BATCH_WRITE_LIMIT):
+            results = {}
+            with self._pool.transaction() as connection:
+                for user_id, update_data in updates[start:start + BATCH_WRITE_LIMIT]:
+                    # 失敗した文は取り消されるため、同じトランザクションで残りのユーザーを更新できる
+                    try:
+                        self._update(connection, user_id, update_data)
+                        results[user_id] = None
+                    except sqlite3.IntegrityError as e:
+                        results[user_id] = EmailAlreadyRegistered() if _is_email_conflict(e) else e
+                    except Exception as e:
+                        results[user_id] = e
+            yield results
+
+    def delete(self, user_id):
+        # 興味のあるジャンルと友達関係は外部キーの連鎖削除で消える
+        with self._pool.transaction() as connection:
+            return connection.execute("DELETE FROM users WHERE user_id = ?", (user_id,)).rowcount > 0
+
+    def delete_each(self, user_ids):
+        for start in range(0, len(user_ids), BATCH_WRITE_LIMIT):
+            results = {}
+            with self._pool.transaction() as connection:
+                for user_id in user_ids[start:start + BATCH_WRITE_LIMIT]:
+                    deleted = connection.execute("DELETE FROM users WHERE user_id = ?", (user_id,)).rowcount > 0
+                    results[user_id] = None if deleted else UserNotFound(user_id)
+            yield results
+
+    def count(self):
+        with self._pool.connection() as connection:
+            return connection.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def list_page(self, order_by, descending=False, limit=20, start_after=None, end_before=None, fields=None):
+        if order_by not in ORDER_COLUMNS:
+            raise ValueError(f"並び替えできないフィールドです: {order_by}")
+        column = ORDER_COLUMNS[order_by]
+        after, before = ('<', '>') if descending else ('>', '<')
+        forward, reverse = ('DESC', 'ASC') if descending else ('ASC', 'DESC')
+
+        sql = f"SELECT data FROM users WHERE {column} IS NOT NULL"
+        parameters = []
+        if start_after is not None:
+            sql += f" AND ({column}, user_id) {after} (?, ?)"
+            parameters += [sort_value(start_after[0]), start_after[1]]
+        if end_before is not None:
+            # 直前のlimit件を逆順に取得してから並び順に戻す
+            sql += f" AND ({column}, user_id) {before} (?, ?) ORDER BY {column} {reverse}, user_id {reverse} LIMIT ?"
+            parameters += [sort_value(end_before[0]), end_before[1], limit]
+            return self._fetch_users(sql, parameters, fields)[::-1]
+
+        sql += f" ORDER BY {column} {forward}, user_id {forward} LIMIT ?"
+        parameters.append(limit)
+        return self._fetch_users(sql, parameters, fields)
+
+    def iter_all(self, fields=None, start_after=None):
+        # 接続を借りたままにしないよう、ユーザーID順に区切って読み込む
+        last_user_id = start_after or ''
+        while True:
+            with self._pool.connection() as connection:
+                rows = connection.execute(
+                    "SELECT user_id, data FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                    (last_user_id, BULK_GET_CHUNK_SIZE)
+                ).fetchall()
+            for user_id, data in rows:
+                yield project_fields(decode_user(data), fields)
+            if len(rows) < BULK_GET_CHUNK_SIZE:
+                break
+            last_user_id = rows[-1][0]
+
+    def search_by_interests(self, interests, fields=None):
+        interests = list(dict.fromkeys(interests))
+        if not interests:
+            return []
+        placeholders = ','.join('?' * len(interests))
+        return self._fetch_users(
+            f"SELECT data FROM users WHERE user_id IN "
+            f"(SELECT user_id FROM user_interests WHERE interest IN ({placeholders})) ORDER BY user_id",
+            interests, fields
+        )
+
+    def _change_friend_count(self, connection, user_id, delta):
+        user = self._load(connection, user_id)
+        user['friend_count'] = max(0, user.get('friend_count', 0) + delta)
+        self._save(connection, user_id, user, interests_changed=False)
+
+    def add_friend(self, user_id, friend_id):
+        with self._pool.transaction() as connection:
+            if self._load(connection, user_id) is None:
+                raise UserNotFound(user_id)
+            added = connection.execute(
+                "INSERT OR IGNORE INTO friendships (user_id, friend_id, created_at) VALUES (?, ?, ?)",
+                (user_id, friend_id, sort_value(datetime.now()))
+            ).rowcount > 0
+            if added:
+                self._change_friend_count(connection, user_id, 1)
+            return added
+
+    def remove_friend(self, user_id, friend_id):
+        with self._pool.transaction() as connection:
+            if self._load(connection, user_id) is None:
+                raise UserNotFound(user_id)
+            removed = connection.execute(
+                "DELETE FROM friendships WHERE user_id = ? AND friend_id = ?", (user_id, friend_id)
+            ).rowcount > 0
+            if removed:
+                self._change_friend_count(connection, user_id, -1)
+            return removed
+
+    def is_friend(self, user_id, friend_id):
+        with self._pool.connection() as connection:
+            return connection.execute(
+                "SELECT 1 FROM friendships WHERE user_id = ? AND friend_id = ?", (user_id, friend_id)
+            ).fetchone() is not None
+
+    def list_friends(self, user_id, limit=20, start_after=None):
+        sql = "SELECT friend_id, created_at FROM friendships WHERE user_id = ?"
+        parameters = [user_id]
+        if start_after is not None:
+            sql += " AND (created_at, friend_id) > (?, ?)"
+            parameters += [sort_value(start_after[0]), start_after[1]]
+        sql += " ORDER BY created_at, friend_id LIMIT ?"
+        parameters.append(limit)
+        with self._pool.connection() as connection:
+            rows = connection.execute(sql, parameters).fetchall()
+        return [{'friend_id': friend_id, 'created_at': datetime.fromisoformat(created_at)} for friend_id, created_at in rows]
+
+    def iter_friend_edges(self):
+        # iter_allと同様に、(ユーザーID, 友達のユーザーID)の順に区切って読み込む
+        last_edge = ('', '')
+        while True:
+            with self._pool.connection() as connection:
+                rows = connection.execute(
+                    "SELECT user_id, friend_id FROM friendships WHERE (user_id, friend_id) > (?, ?) "
+                    "ORDER BY user_id, friend_id LIMIT ?",
+                    (*last_edge, BULK_GET_CHUNK_SIZE)
+                ).fetchall()
+            yield from rows
+            if len(rows) < BULK_GET_CHUNK_SIZE:
+                break
+            last_edge = rows[-1]
+
+    def migrate_friend_array(self, user_id):
+        with self._pool.transaction() as connection:
+            user = self._load(connection, user_id)
+            if user is None:
+                raise UserNotFound(user_id)
+            friend_ids = user.pop('friends', None)
+            if friend_ids is None:
+                return 0
+
+            # 配列の順序を追加日時の順序として保持する
+            migrated_at = datetime.now()
+            created_count = 0
+            for position, friend_id in enumerate(friend_ids):
+                if friend_id == user_id:
+                    continue
+                created_count += connection.execute(
+                    "INSERT OR IGNORE INTO friendships (user_id, friend_id, created_at) VALUES (?, ?, ?)",
+                    (user_id, friend_id, sort_value(migrated_at + timedelta(microseconds=position)))
+                ).rowcount
+            user['friend_count'] = connection.execute(
+                "SELECT COUNT(*) FROM friendships WHERE user_id = ?", (user_id,)
+            ).fetchone()[0]
+            self._save(connection, user_id, user, interests_changed=False)
+            return created_count
+
+    def backfill_email_index(self):
+        # 通常は作成・更新時に索引の列が設定されるため、外部から取り込んだ行だけが対象になる
+        with self._pool.connection() as connection:
+            rows = connection.execute("SELECT user_id, data FROM users WHERE email_key IS NULL").fetchall()
+
+        created_count = 0
+        duplicate_ids = []
+        for user_id, data in rows:
+            email = decode_user(data).get('email')
+            if not email:
+                continue
+            try:
+                with self._pool.transaction() as connection:
+                    connection.execute("UPDATE users SET email_key = ? WHERE user_id = ?",
+                                       (normalize_email(email), user_id))
+                created_count += 1
+            except sqlite3.IntegrityError:
+                duplicate_ids.append(user_id)
+        return created_count, duplicate_ids
+
+    def health_check(self):
+        started = time.perf_counter()
+        try:
+            with self._pool.connection() as connection:
+                journal_mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+            return {
+                'ok': True,
+                'latency_ms': (time.perf_counter() - started) * 1000,
+                'detail': f"SQLite（{journal_mode.upper()}）",
+                'error': None
+            }
+        except Exception as e:
+            return {'ok': False, 'latency_ms': (time.perf_counter() - started) * 1000, 'detail': "SQLite", 'error': str(e)}
@@ -0,0 +1,261 @@
+import math
+import re
+import threading
+import unicodedata
+from array import array
+import numpy as np
+
+# 索引を作成するフィールドと重み（表示名での一致を最も高く評価する）
+FIELD_WEIGHTS = {'display_name': 3.0, 'email': 2.0, 'profile': 1.0}
+SEARCH_FIELDS = tuple(FIELD_WEIGHTS)
+
+# 1文字の語（unigram）の重み（2文字の語より弱い手がかりとして扱う）
+UNIGRAM_WEIGHT = 0.5
+
+# 表示名の先頭・途中に検索語が含まれる場合に加える点数
+NAME_PREFIX_BONUS = 10.0
+NAME_MATCH_BONUS = 5.0
+
+# 検索結果の候補として、最終的な件数の何倍を部分文字列で確認するか
+VERIFY_FACTOR = 5
+
+# 単語の区切り（英数字・かな・漢字以外）
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# カタカナ（ァ〜ヶ）をひらがなに変換する表
+KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+def normalize_text(text):
+    """検索用に文字列を正規化する（全角英数字・半角カナの統一、小文字化、カタカナのひらがな化）"""
+    return unicodedata.normalize('NFKC', text or '').lower().translate(KATAKANA_TO_HIRAGANA)
+
+def tokenize(text):
+    """正規化した文字列を単語（英数字・かな・漢字の連続）に分ける"""
+    return TOKEN_PATTERN.findall(text)
+
+def text_grams(token):
+    """単語に含まれる1文字・2文字の語（unigram・bigram）
+
+    1文字の語は、1文字でも意味を持つかな・漢字だけを対象にする。
+    """
+    grams = {char for char in token if not char.isascii()}
+    grams.update(token[index:index + 2] for index in range(len(token) - 1))
+    return grams
+
+def query_grams(term):
+    """検索語を探すのに使う語（2文字以上の場合はbigram、1文字の場合はその文字）"""
+    if len(term) == 1:
+        return {term}
+    return {term[index:index + 2] for index in range(len(term) - 1)}
+
+def intersect_positions(left, right, size):
+    """0〜size-1の重複の無い番号の配列2つの共通部分と、それぞれの配列での位置を求める
+
+    番号から位置への対応表を使い、配列の長さとsizeに比例する時間で求める（結果はleftの順）。
+    """
+    lookup = np.full(size, -1, dtype=np.int32)
+    lookup[right] = np.arange(len(right), dtype=np.int32)
+    right_indices = lookup[left]
+    left_indices = np.flatnonzero(right_indices >= 0)
+    return left[left_indices], left_indices, right_indices[left_indices]
+
+class TextSearchIndex:
+    """表示名・メールアドレス・プロフィールの文字n-gram転置インデックス（スレッドセーフ）
+
+    日本語は単語の区切りが無いため、1文字・2文字の語で索引を作成し、検索語の2文字の語を
+    すべて含む参加者を候補とする。候補は語の出現しにくさ（IDF）とフィールドの重みで
+    順位付けし、上位の候補だけ正規化した元の文字列に検索語が含まれるかを確認する。
+
+    参加者には追加・更新のたびに新しい番号を割り当てるため、各語の番号のリストは常に昇順になる。
+    古い番号は無効として扱い、無効な番号が有効な番号より多くなったら作り直す。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._user_ids = []
+        self._positions = {}
+        # 番号ごとの正規化したフィールド（無効な番号はNone）
+        self._texts = []
+        self._alive = np.zeros(1024, dtype=bool)
+        self._dead_count = 0
+        # 語ごとの(番号の配列, 重みの配列)
+        self._postings = {}
+
+    @classmethod
+    def from_users(cls, users):
+        """'user_id'と索引を作成するフィールドを持つユーザー情報の列から作成する"""
+        index = cls()
+        for user in users:
+            index.set_fields(user['user_id'], user)
+        return index
+
+    def _append(self, user_id, texts):
+        position = len(self._user_ids)
+        self._user_ids.append(user_id)
+        self._positions[user_id] = position
+        self._texts.append(texts)
+        if position >= len(self._alive):
+            self._alive = np.concatenate((self._alive, np.zeros(len(self._alive), dtype=bool)))
+        self._alive[position] = True
+
+        weights = {}
+        for field, text in texts.items():
+            for token in tokenize(text):
+                for gram in text_grams(token):
+                    gram_weight = FIELD_WEIGHTS[field] * (UNIGRAM_WEIGHT if len(gram) == 1 else 1.0)
+                    weights[gram] = max(weights.get(gram, 0.0), gram_weight)
+        for gram, weight in weights.items():
+            posting = self._postings.get(gram)
+            if posting is None:
+                posting = self._postings[gram] = (array('i'), array('f'))
+            posting[0].append(position)
+            posting[1].append(weight)
+
+    def _kill(self, position):
+        self._alive[position] = False
+        self._texts[position] = None
+        self._dead_count += 1
+
+    def _compact_if_needed(self):
+        alive_count = len(self._user_ids) - self._dead_count
+        if self._dead_count > max(alive_count, 1024):
+            entries = [(user_id, texts) for user_id, texts in zip(self._user_ids, self._texts) if texts is not None]
+            self._reset()
+            for user_id, texts in entries:
+                self._append(user_id, texts)
+
+    def set_fields(self, user_id, fields):
+        """参加者の表示名・メールアドレス・プロフィールを登録・更新する（fieldsに無いフィールドは変更しない）"""
+        with self._lock:
+            position = self._positions.get(user_id)
+            texts = dict(self._texts[position]) if position is not None else {field: '' for field in FIELD_WEIGHTS}
+            changed = False
+            for field in FIELD_WEIGHTS:
+                if field in fields:
+                    text = normalize_text(fields[field])
+                    changed = changed or text != texts[field]
+                    texts[field] = text
+            if position is not None:
+                if not changed:
+                    return
+                self._kill(position)
+            self._append(user_id, texts)
+            self._compact_if_needed()
+
+    def remove_user(self, user_id):
+        """参加者を検索結果に含めないようにする"""
+        with self._lock:
+            position = self._positions.pop(user_id, None)
+            if position is not None:
+                self._kill(position)
+                self._compact_if_needed()
+
+    def _posting(self, gram):
+        posting = self._postings.get(gram)
+        if posting is None:
+            return None
+        # 追加できなくならないよう、配列のバッファを共有せずにコピーする
+        return np.array(posting[0], dtype=np.int32), np.array(posting[1], dtype=np.float32)
+
+    def _match_term(self, term, alive_count):
+        """検索語の語をすべて含む番号と点数を求める"""
+        postings = []
+        for gram in query_grams(term):
+            posting = self._posting(gram)
+            if posting is None:
+                return None
+            postings.append((gram, posting))
+        postings.sort(key=lambda item: len(item[1][0]))
+
+        positions = None
+        scores = None
+        for gram, (gram_positions, gram_weights) in postings:
+            idf = math.log(1 + alive_count / len(gram_positions))
+            if positions is None:
+                positions = gram_positions
+                scores = gram_weights * idf
+            else:
+                positions, left, right = intersect_positions(positions, gram_positions, len(self._user_ids))
+                scores = scores[left] + gram_weights[right] * idf
+            if not len(positions):
+                return None
+        return positions, scores
+
+    def search(self, query, limit=20, fields=None, allowed=None):
+        """検索語（空白区切りの場合はすべてを含む）に一致する参加者を点数の高い順に取得する
+
+        検索語は各フィールドの部分文字列として照合するため、名前の先頭だけの入力（前方一致）にも一致する。
+        fieldsを指定した場合は、そのフィールドに検索語が含まれる参加者だけを返す。
+        allowed（ユーザーIDのset）を指定した場合は、件数を絞る前にその参加者だけを候補にする。
+
+        Returns:
+            (ユーザーID, 点数)のリスト
+        """
+        terms = list(dict.fromkeys(tokenize(normalize_text(query))))
+        # 英数字1文字の語は索引に無いため、候補の絞り込みには使わず部分文字列の確認だけに使う
+        indexed_terms = [term for term in terms if len(term) > 1 or not term.isascii()]
+        if not indexed_terms or limit <= 0:
+            return []
+        fields = list(fields or FIELD_WEIGHTS)
+
+        with self._lock:
+            alive_count = len(self._user_ids) - self._dead_count
+            positions = None
+            scores = None
+            for term in indexed_terms:
+                matched = self._match_term(term, alive_count)
+                if matched is None:
+                    return []
+                if positions is None:
+                    positions, scores = matched
+                else:
+                    positions, left, right = intersect_positions(positions, matched[0], len(self._user_ids))
+                    scores = scores[left] + matched[1][right]
+            alive = self._alive[positions]
+            positions = positions[alive]
+            scores = scores[alive]
+            if allowed is not None:
+                allowed_mask = np.fromiter((self._user_ids[position] in allowed for position in positions),
+                                           dtype=bool, count=len(positions))
+                positions = positions[allowed_mask]
+                scores = scores[allowed_mask]
+
+            # 点数の高い候補から、検索語が実際に含まれているかを確認する
+            # （絞り込みに使わなかった語がある場合は、すべての候補を確認する）
+            verify_count = limit * VERIFY_FACTOR
+            candidate_count = len(positions) if len(indexed_terms) < len(terms) else min(len(positions), verify_count)
+            if candidate_count < len(positions):
+                top = np.argpartition(-scores, candidate_count - 1)[:candidate_count]
+            else:
+                top = np.arange(len(positions))
+            results = []
+            for candidate in top[np.argsort(-scores[top], kind='stable')]:
+                position = int(positions[candidate])
+                texts = self._texts[position]
+                if not all(any(term in texts[field] for field in fields) for term in terms):
+                    continue
+                score = float(scores[candidate])
+                name = texts['display_name']
+                if name.startswith(terms[0]):
+                    score += NAME_PREFIX_BONUS
+                elif all(term in name for term in terms):
+                    score += NAME_MATCH_BONUS
+                results.append((self._user_ids[position], score))
+                if len(results) == verify_count:
+                    break
+
+        results.sort(key=lambda result: result[1], reverse=True)
+        return results[:limit]
+
+    def stats(self):
+        """インデックスの統計情報を取得する"""
+        with self._lock:
+            return {
+                'users': len(self._user_ids) - self._dead_count,
+                'grams': len(self._postings),
+                'postings': sum(len(positions) for positions, _ in self._postings.values()),
+                'bytes': sum(positions.itemsize * len(positions) * 2 for positions, _ in self._postings.values())
+            }
@@ -0,0 +1,150 @@
+"""
+参加者の一覧をCSV・JSON Lines形式でエクスポートするモジュール
+管理者パネルから実行するほか、python user_export.py <出力ファイル> でも実行できます。
+"""
+
+import argparse
+import csv
+import json
+import os
+from datetime import datetime
+
+# エクスポートできるフィールド（パスワードハッシュと写真は含めない）
+EXPORT_FIELDS = [
+    'user_id', 'email', 'display_name', 'profile', 'interests', 'sns_accounts',
+    'friend_count', 'is_admin', 'has_password', 'created_at', 'updated_at'
+]
+
+# 出力形式
+EXPORT_FORMATS = {'csv': "CSV", 'jsonl': "JSON Lines"}
+
+# 進捗を通知する間隔（人数）
+PROGRESS_INTERVAL = 1000
+
+# 表計算ソフトで数式として解釈される先頭の文字
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+# CSVで興味のあるジャンルなどのリストを連結する区切り文字（attendee_import.pyで読み込める）
+LIST_SEPARATOR = ';'
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"出力できない型です: {type(value).__name__}")
+
+def csv_value(value):
+    """CSVのセルに書き出す値（リストは区切り文字で連結し、辞書はJSONにする）"""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        value = LIST_SEPARATOR.join(str(item) for item in value)
+    elif isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False, default=_json_default)
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        # 参加者が入力した文字列が数式として実行されないようにする
+        return "'" + value
+    return value
+
+class CsvExportWriter:
+    """1人を1行として、fieldsの順の列で書き出す"""
+
+    def __init__(self, output, fields, write_header=True):
+        self._fields = fields
+        self._writer = csv.writer(output)
+        if write_header:
+            self._writer.writerow(fields)
+
+    def write(self, user):
+        self._writer.writerow([csv_value(user.get(field)) for field in self._fields])
+
+class JsonLinesExportWriter:
+    """1人を1行のJSONとして書き出す（入れ子のフィールドはそのまま保持する）"""
+
+    def __init__(self, output, fields, write_header=True):
+        self._output = output
+
+    def write(self, user):
+        self._output.write(json.dumps(user, ensure_ascii=False, default=_json_default))
+        self._output.write('\n')
+
+EXPORT_WRITERS = {'csv': CsvExportWriter, 'jsonl': JsonLinesExportWriter}
+
+def export_users(output, export_format='csv', fields=None, start_after=None, progress_callback=None, total=None):
+    """ユーザーをユーザーIDの順に読み込みながら、1人ずつoutputに書き出す
+
+    ユーザーは保存先から区切って読み込み、必要なフィールドだけを取得するため、
+    参加者数に関わらずメモリ使用量は一定になる。start_afterに前回の結果の'cursor'を渡すと、
+    そのユーザーの次から書き出す（CSVの見出しは書き出さないため、同じファイルに追記できる）。
+
+    progress_callbackはPROGRESS_INTERVAL人ごとと終了時に(書き出した人数, total)で呼び出される。
+
+    Returns:
+        ({'count': 書き出した人数, 'cursor': 最後に書き出したユーザーID}, エラーメッセージ)
+        途中でエラーになった場合も、'cursor'から再開できる
+    """
+    from database import iter_all_users
+
+    fields = list(fields or EXPORT_FIELDS)
+    if 'user_id' not in fields:
+        fields.insert(0, 'user_id')
+    summary = {'count': 0, 'cursor': start_after}
+    unknown = [field for field in fields if field not in EXPORT_FIELDS]
+    if unknown:
+        return summary, f"エクスポートできないフィールドです: {', '.join(unknown)}"
+    writer = EXPORT_WRITERS[export_format](output, fields, write_header=start_after is None)
+    try:
+        for user in iter_all_users(fields, start_after):
+            writer.write(user)
+            summary['count'] += 1
+            summary['cursor'] = user['user_id']
+            if progress_callback and summary['count'] % PROGRESS_INTERVAL == 0:
+                progress_callback(summary['count'], total)
+        if progress_callback:
+            progress_callback(summary['count'], total)
+        return summary, None
+
+    except Exception as e:
+        return summary, f"エクスポートエラー: {e}"
+
+def main():
+    """コマンドラインから参加者の一覧をエクスポートする"""
+    from config import STORAGE_CONFIG, initialize_firebase
+    from database import count_users
+
+    parser = argparse.ArgumentParser(description="参加者の一覧をCSV・JSON Lines形式でエクスポートする")
+    parser.add_argument("output_path", help="出力ファイル（拡張子が.jsonlの場合はJSON Lines形式）")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), help="出力形式（既定: 拡張子から判定）")
+    parser.add_argument("--fields", help=f"出力するフィールド（カンマ区切り、既定: {','.join(EXPORT_FIELDS)}）")
+    parser.add_argument("--after", help="中断したエクスポートを再開する（表示されたユーザーIDを指定し、ファイルに追記する）")
+    args = parser.parse_args()
+
+    export_format = args.format or ('jsonl' if args.output_path.endswith('.jsonl') else 'csv')
+    fields = [field.strip() for field in args.fields.split(',') if field.strip()] if args.fields else None
+    if fields is not None:
+        # パスワードハッシュや写真など、エクスポートできるフィールド以外は受け付けない
+        unknown = [field for field in fields if field not in EXPORT_FIELDS]
+        if unknown or not fields:
+            parser.error(f"--fieldsに指定できないフィールドです: {','.join(unknown)}（指定できるフィールド: {','.join(EXPORT_FIELDS)}）")
+    if STORAGE_CONFIG["backend"] == "firestore" and not initialize_firebase():
+        print("Firebaseの初期化に失敗しました。")
+        return
+
+    def print_progress(count, total):
+        print(f"{count}/{total or '?'} 人を書き出しました")
+
+    # CSVはExcelで開けるようBOM付きのUTF-8で書き出す（追記時はBOMを書き出さない）
+    encoding = 'utf-8-sig' if export_format == 'csv' else 'utf-8'
+    with open(args.output_path, 'a' if args.after else 'w', encoding=encoding, newline='') as output:
+        summary, error = export_users(output, export_format, fields, args.after, print_progress, count_users())
+
+    if error:
+        print(error)
+        if summary['cursor']:
+            print(f"再開するには --after {summary['cursor']} を指定して実行してください。")
+        return
+    print(f"{summary['count']}人を{os.path.abspath(args.output_path)}に書き出しました。")
+
+if __name__ == "__main__":
+    main()